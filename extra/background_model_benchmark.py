@@ -0,0 +1,126 @@
+"""Benchmark the throughput of the registered background models.
+
+Every component registered as a "background-model" is timed fitting the background (fit_background) and mapping a signal
+(integrate_signal) on synthetic power law spectrum images of several navigation sizes, dtypes and fit window widths. Runs
+headless, without Swift.
+
+Example:
+
+    python extra/background_model_benchmark.py --sizes 64x64 256x256 --dtypes float32 float64 --widths 20 100
+
+Each result line gives the model, the operation, the spectrum image size, dtype and fit window width (in channels), the best
+time of the repeats, the throughput in spectra (pixels) per second and the peak memory allocated during the operation.
+"""
+
+# standard libraries
+import argparse
+import time
+import tracemalloc
+import typing
+
+# third party libraries
+import numpy
+
+# local libraries
+from nion.data import Calibration
+from nion.data import DataAndMetadata
+from nion.eels_analysis import BackgroundModel  # noqa: F401 registers the background models
+from nion.utils import Registry
+
+
+def make_spectrum_image(navigation_shape: typing.Sequence[int], channel_count: int, dtype: numpy.dtype,
+                        seed: int = 0) -> DataAndMetadata.DataAndMetadata:
+    # Poisson sampled power law backgrounds with an edge two thirds of the way along the energy axis.
+    random_state = numpy.random.RandomState(seed)
+    energies = numpy.linspace(200.0, 200.0 + channel_count, channel_count, endpoint=False)
+    amplitudes = random_state.uniform(0.5, 2.0, tuple(navigation_shape) + (1,)) * 1E10
+    exponents = random_state.uniform(2.5, 3.5, tuple(navigation_shape) + (1,))
+    edge_energy = energies[2 * channel_count // 3]
+    spectra = amplitudes * numpy.power(energies, -exponents) * (1 + 0.2 * (energies > edge_energy))
+    data = random_state.poisson(spectra).astype(dtype)
+    dimensional_calibrations = [Calibration.Calibration(units="nm") for _ in navigation_shape] + [Calibration.Calibration(200.0, 1.0, "eV")]
+    data_descriptor = DataAndMetadata.DataDescriptor(False, len(navigation_shape), 1)
+    return DataAndMetadata.new_data_and_metadata(data, data_descriptor=data_descriptor, dimensional_calibrations=dimensional_calibrations,
+                                                 intensity_calibration=Calibration.Calibration(units="counts"))
+
+
+def make_interval(start: int, stop: int, channel_count: int) -> Calibration.CalibratedInterval:
+    return Calibration.CalibratedInterval(Calibration.Coordinate(Calibration.CoordinateType.NORMALIZED, start / channel_count),
+                                          Calibration.Coordinate(Calibration.CoordinateType.NORMALIZED, stop / channel_count))
+
+
+def measure(fn: typing.Callable[[], typing.Any], repeat: int) -> typing.Tuple[float, int]:
+    # return the best time of repeat calls and the peak memory traced during the calls.
+    best_time = float("inf")
+    tracemalloc.start()
+    try:
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            fn()
+            best_time = min(best_time, time.perf_counter() - start_time)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best_time, peak_memory
+
+
+def run_benchmarks(sizes: typing.Sequence[typing.Tuple[int, ...]], dtypes: typing.Sequence[str], widths: typing.Sequence[int],
+                   channel_count: int, repeat: int, model_ids: typing.Optional[typing.Sequence[str]] = None,
+                   options: typing.Optional[typing.Mapping[str, typing.Any]] = None) -> typing.List[typing.Dict[str, typing.Any]]:
+    options = options or dict()
+    models = sorted((model for model in Registry.get_components_by_type("background-model") if not model_ids or model.background_model_id in model_ids),
+                    key=lambda model: model.background_model_id)
+    edge_channel = 2 * channel_count // 3
+    signal_interval = make_interval(edge_channel, min(channel_count, edge_channel + channel_count // 8), channel_count)
+    results = list()
+    for size in sizes:
+        for dtype in dtypes:
+            spectrum_image_xdata = make_spectrum_image(size, channel_count, numpy.dtype(dtype))
+            pixel_count = int(numpy.prod(size))
+            for width in widths:
+                fit_intervals = [make_interval(edge_channel - width - 2, edge_channel - 2, channel_count)]
+                for model in models:
+                    operations = (
+                        ("fit_background", lambda: model.fit_background(spectrum_xdata=spectrum_image_xdata, fit_intervals=fit_intervals,
+                                                                        background_interval=signal_interval, cache=False, **options)),
+                        ("integrate_signal", lambda: model.integrate_signal(spectrum_xdata=spectrum_image_xdata, fit_intervals=fit_intervals,
+                                                                            signal_interval=signal_interval, cache=False, **options)),
+                    )
+                    for operation, fn in operations:
+                        elapsed, peak_memory = measure(fn, repeat)
+                        results.append({"model": model.background_model_id, "operation": operation, "size": size, "dtype": dtype,
+                                        "width": width, "seconds": elapsed, "pixels_per_second": pixel_count / elapsed,
+                                        "peak_memory": peak_memory})
+                        print_result(results[-1])
+    return results
+
+
+def print_result(result: typing.Mapping[str, typing.Any]) -> None:
+    size = "x".join(str(n) for n in result["size"])
+    print(f"{result['model']:<42} {result['operation']:<17} {size:>10} {result['dtype']:>8} {result['width']:>5} "
+          f"{result['seconds'] * 1000:>10.2f}ms {result['pixels_per_second']:>14,.0f} px/s {result['peak_memory'] / 2 ** 20:>10.1f}MiB",
+          flush=True)
+
+
+def parse_size(text: str) -> typing.Tuple[int, ...]:
+    return tuple(int(n) for n in text.lower().split("x"))
+
+
+def main(argv: typing.Optional[typing.Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the registered EELS background models.")
+    parser.add_argument("--sizes", nargs="+", type=parse_size, default=[(32, 32), (128, 128)], help="navigation sizes, e.g. 64x64")
+    parser.add_argument("--dtypes", nargs="+", default=["float32", "float64"], help="spectrum image dtypes")
+    parser.add_argument("--widths", nargs="+", type=int, default=[20, 100], help="fit window widths in channels")
+    parser.add_argument("--channels", type=int, default=1024, help="number of energy channels")
+    parser.add_argument("--repeat", type=int, default=3, help="number of timed repeats; the best time is reported")
+    parser.add_argument("--models", nargs="*", help="background model ids to benchmark; all registered models by default")
+    parser.add_argument("--working-dtype", help="working precision passed to the models as dtype")
+    parser.add_argument("--chunk-size", type=int, help="chunk size passed to the models")
+    parser.add_argument("--workers", type=int, help="number of worker processes passed to the models")
+    args = parser.parse_args(argv)
+    options = {key: value for key, value in (("dtype", args.working_dtype), ("chunk_size", args.chunk_size), ("workers", args.workers)) if value}
+    run_benchmarks(args.sizes, args.dtypes, args.widths, args.channels, args.repeat, args.models, options)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,31 @@
 from __future__ import annotations
 
 # imports
+import collections
+import concurrent.futures
+import contextlib
 import copy
 import gettext
+import hashlib
+import mmap
+import multiprocessing
 import numpy
+import threading
 import typing
+import weakref
 
 # local libraries
 from nion.data import Calibration
 from nion.data import Core
 from nion.data import DataAndMetadata
+from nion.eels_analysis import CurveFittingAndAnalysis
 from nion.utils import Registry
 
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python 3.7
+    shared_memory = typing.cast(typing.Any, None)
+
 
 _ = gettext.gettext
 
@@ -19,6 +33,298 @@ _ = gettext.gettext
 BackgroundModelParameters = typing.Dict
 
 
+def get_interval_slice(reference_frame: Calibration.ReferenceFrameAxis, interval: Calibration.CalibratedInterval) -> slice:
+    """Return the slice of datum channels covered by the calibrated interval."""
+    return slice(reference_frame.convert_to_pixel(interval.start).int_value, reference_frame.convert_to_pixel(interval.end).int_value)
+
+
+def get_channel_domain(calibration: Calibration.Calibration, channels: slice) -> numpy.ndarray:
+    """Return the calibrated x-values of the datum channels in the slice.
+
+    Signals are integrated over whole channels, so the background integrals subtracted from them are evaluated at these x-values. A
+    window of a longer slice then has the same x-values as the window on its own, so several signal intervals integrated at once
+    match each interval integrated separately.
+    """
+    return numpy.asarray(calibration.convert_to_calibrated_value(numpy.arange(channels.start, channels.stop)), dtype=numpy.float64)
+
+
+def iterate_navigation_chunks(navigation_shape: typing.Sequence[int], chunk_size: typing.Optional[int] = None) -> typing.Iterator[typing.Tuple]:
+    """Yield index tuples that together cover an array with navigation_shape, each addressing at most chunk_size spectra.
+
+    Leading navigation axes are indexed one at a time and the first axis whose trailing block fits within chunk_size is split
+    into contiguous slices, so each chunk is a basic index that reads only its own spectra from a memmap or other lazily loaded array.
+    A chunk_size of None yields a single chunk covering all spectra.
+    """
+    navigation_shape = tuple(navigation_shape)
+    if not chunk_size or not navigation_shape:
+        yield tuple(slice(None) for _ in navigation_shape)
+        return
+    chunk_size = max(1, chunk_size)
+    axis = 0
+    block_size = int(numpy.prod(navigation_shape[1:], dtype=numpy.int64))
+    while block_size > chunk_size:
+        axis += 1
+        block_size //= navigation_shape[axis]
+    step = max(1, chunk_size // max(1, block_size))
+    trailing = tuple(slice(None) for _ in navigation_shape[axis + 1:])
+    for leading in numpy.ndindex(*navigation_shape[:axis]):
+        for start in range(0, navigation_shape[axis], step):
+            yield leading + (slice(start, min(start + step, navigation_shape[axis])),) + trailing
+
+
+def gather_fit_data(data: numpy.ndarray, chunk: typing.Tuple, fit_slices: typing.Sequence[slice], dtype: numpy.dtype = None,
+                    channel_offsets: typing.Optional[numpy.ndarray] = None) -> numpy.ndarray:
+    """Return the channels in fit_slices of the spectra addressed by chunk, concatenated along the last axis, as dtype (float64 by default).
+
+    If channel_offsets (an array with the navigation shape of data) is supplied, channel c of each spectrum is read at channel c plus its
+    offset with linear interpolation (see CurveFittingAndAnalysis.gather_shifted_channels). Spectra with any channel shifted beyond
+    the spectrum are nan in all channels, so that every model treats them as spectra that cannot be fit.
+    """
+    dtype = numpy.dtype(dtype or numpy.float64)
+    if channel_offsets is not None:
+        channels = numpy.concatenate([numpy.arange(fit_slice.start, fit_slice.stop) for fit_slice in fit_slices])
+        offsets = numpy.asarray(channel_offsets[chunk], dtype=numpy.float64)
+        ys = CurveFittingAndAnalysis.gather_shifted_channels(data[chunk], channels, offsets).astype(dtype, copy=False)
+        # the same condition as the nan channels of gather_shifted_channels, which are not distinguishable from nan data channels.
+        is_out_of_range = (numpy.amin(channels) + numpy.floor(offsets) < 0) | (numpy.amax(channels) + numpy.ceil(offsets) >= data.shape[-1])
+        ys[is_out_of_range] = numpy.nan
+        return ys
+    if len(fit_slices) > 1:
+        return numpy.concatenate([numpy.asarray(data[chunk + (fit_slice,)], dtype=dtype) for fit_slice in fit_slices], axis=-1)
+    return numpy.asarray(data[chunk + (fit_slices[0],)], dtype=dtype)
+
+
+def bin_navigation_fit_data(data: numpy.ndarray, fit_slices: typing.Sequence[slice], binning: int, dtype: numpy.dtype = None) -> numpy.ndarray:
+    """Return the mean of the fit channels over binning x binning (x ...) blocks of the navigation axes, as dtype (float64 by default).
+
+    The result has shape ceil(navigation_shape / binning) + (L,), where partial blocks at the end of an axis are averaged over the
+    spectra they contain. data is read one block of rows of the first navigation axis at a time.
+    """
+    dtype = numpy.dtype(dtype or numpy.float64)
+    navigation_shape = tuple(data.shape[:-1])
+    binned_shape = tuple((n + binning - 1) // binning for n in navigation_shape)
+    binned = numpy.empty(binned_shape + (sum(fit_slice.stop - fit_slice.start for fit_slice in fit_slices),), dtype=dtype)
+    counts = numpy.ones(binned_shape[1:])
+    for axis, n in enumerate(navigation_shape[1:]):
+        counts = counts * numpy.reshape(numpy.diff(numpy.minimum(numpy.arange(binned_shape[axis + 1] + 1) * binning, n)),
+                                        (-1,) + (1,) * (len(navigation_shape) - axis - 2))
+    for row in range(binned_shape[0]):
+        chunk = (slice(row * binning, (row + 1) * binning),) + tuple(slice(None) for _ in navigation_shape[1:])
+        ys = numpy.sum(gather_fit_data(data, chunk, fit_slices), axis=0)
+        for axis, n in enumerate(navigation_shape[1:]):
+            ys = numpy.add.reduceat(ys, numpy.arange(0, n, binning), axis=axis)
+        binned[row] = ys / (counts[..., numpy.newaxis] * min(binning, navigation_shape[0] - row * binning))
+    return binned
+
+
+def get_upsampling_indexes(n: int, binning: int, interpolation: str) -> typing.Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """Return the lower and upper bin indexes and the upper bin weight of each of n pixels binned by binning.
+
+    interpolation is "nearest", which uses the bin containing the pixel, or "bilinear", which interpolates linearly between the
+    centers of the neighboring bins and holds the end values beyond the outer bin centers.
+    """
+    pixels = numpy.arange(n)
+    if interpolation == "nearest":
+        indexes = pixels // binning
+        return indexes, indexes, numpy.zeros(n)
+    assert interpolation == "bilinear"
+    starts = numpy.arange(0, n, binning)
+    centers = starts + (numpy.minimum(starts + binning, n) - starts - 1) / 2
+    positions = numpy.interp(pixels, centers, numpy.arange(len(centers)))
+    lower = numpy.floor(positions).astype(int)
+    upper = numpy.minimum(lower + 1, len(centers) - 1)
+    return lower, upper, positions - lower
+
+
+def upsample_navigation(binned: numpy.ndarray, navigation_shape: typing.Sequence[int], chunk: typing.Tuple, binning: int,
+                        interpolation: str = "nearest") -> numpy.ndarray:
+    """Return the spectra (or values) of binned, upsampled by binning on each navigation axis, for the pixels addressed by chunk.
+
+    binned has shape ceil(navigation_shape / binning) + trailing shape, as produced from bin_navigation_fit_data; chunk is a basic
+    index into navigation_shape such as from iterate_navigation_chunks. Interpolation is separable along the navigation axes.
+    """
+    upsampled = binned
+    axis = 0
+    for n, index in zip(navigation_shape, chunk):
+        lower, upper, weights = [numpy.atleast_1d(indexes[index]) for indexes in get_upsampling_indexes(n, binning, interpolation)]
+        if numpy.any(weights):
+            weights = numpy.reshape(weights, (-1,) + (1,) * (upsampled.ndim - axis - 1)).astype(upsampled.dtype)
+            upsampled = numpy.take(upsampled, lower, axis=axis) * (1 - weights) + numpy.take(upsampled, upper, axis=axis) * weights
+        else:
+            upsampled = numpy.take(upsampled, lower, axis=axis)
+        if isinstance(index, slice):
+            axis += 1
+        else:
+            upsampled = numpy.squeeze(upsampled, axis=axis)
+    return upsampled
+
+
+def upsample_validity(binned_validity: numpy.ndarray, navigation_shape: typing.Sequence[int], chunk: typing.Tuple, binning: int,
+                      interpolation: str = "nearest") -> numpy.ndarray:
+    """Return the validity of the upsampled values for the pixels addressed by chunk, i.e. whether no invalid bin contributes to them."""
+    invalid = upsample_navigation(numpy.logical_not(binned_validity).astype(numpy.float32), navigation_shape, chunk, binning, interpolation)
+    return numpy.equal(invalid, 0)
+
+
+def check_channel_offsets(channel_offsets: typing.Optional[numpy.ndarray], navigation_shape: typing.Tuple[int, ...], binning: int) -> None:
+    """Raise ValueError unless channel_offsets is None or an array with the navigation shape that is used without binning."""
+    if channel_offsets is None:
+        return
+    if numpy.shape(channel_offsets) != navigation_shape:
+        raise ValueError(f"Channel offsets must have the navigation shape {navigation_shape}, not {numpy.shape(channel_offsets)}.")
+    if binning > 1:
+        raise ValueError("Channel offsets cannot be combined with navigation binning.")
+
+
+def trapz_channels(data: numpy.ndarray) -> numpy.ndarray:
+    """Return the trapezoidal integral along the last axis with unit channel spacing, accumulated in float64.
+
+    Equivalent to numpy.trapz(data) but computed from a channel sum without temporary copies of data.
+    """
+    if data.shape[-1] < 2:
+        return numpy.zeros(data.shape[:-1])
+    return numpy.sum(data, axis=-1, dtype=numpy.float64) - 0.5 * (data[..., 0].astype(numpy.float64) + data[..., -1])
+
+
+def mask_invalid(values: numpy.ndarray, value_shape: typing.Tuple[int, ...] = ()) -> numpy.ndarray:
+    """Zero the values of each spectrum with any non-finite value, in place, and return the validity of each spectrum.
+
+    values has shape (spectra...) + value_shape, e.g. value_shape is the background shape for evaluated backgrounds and () for
+    integrals. The returned boolean array has shape (spectra...).
+    """
+    is_finite = numpy.isfinite(values)
+    is_valid = numpy.all(numpy.reshape(is_finite, is_finite.shape[:is_finite.ndim - len(value_shape)] + (-1,)), axis=-1)
+    values[~is_valid] = 0
+    return is_valid
+
+
+def exponential_trapz(a: numpy.ndarray, b: numpy.ndarray, n: int) -> numpy.ndarray:
+    """Return the trapezoidal integral of exp(a + b * j) over the channels j in range(n), with unit channel spacing."""
+    a = numpy.asarray(a, dtype=numpy.float64)
+    b = numpy.asarray(b, dtype=numpy.float64)
+    if n < 2:
+        return numpy.zeros(numpy.broadcast(a, b).shape)
+    is_flat = numpy.abs(b) < 1E-12
+    safe_b = numpy.where(is_flat, 1, b)
+    with numpy.errstate(over="ignore", invalid="ignore"):
+        geometric_sum = numpy.where(is_flat, n, numpy.expm1(n * safe_b) / numpy.expm1(safe_b))
+        return numpy.exp(a) * (geometric_sum - 0.5 * (1 + numpy.exp((n - 1) * b)))
+
+
+# inputs with fewer elements than this are always processed serially since starting worker processes would take longer.
+PARALLEL_MINIMUM_SIZE = 1 << 24
+
+
+class SharedArray:
+    """A picklable reference to an array that worker processes can open without copying it.
+
+    The array is either backed by a file (a numpy.memmap) or by a multiprocessing.shared_memory block.
+    """
+
+    def __init__(self, shape: typing.Tuple[int, ...], dtype: numpy.dtype, *, filename: typing.Optional[str] = None, offset: int = 0,
+                 shared_memory_name: typing.Optional[str] = None):
+        self.shape = shape
+        self.dtype = numpy.dtype(dtype)
+        self.filename = filename
+        self.offset = offset
+        self.shared_memory_name = shared_memory_name
+
+    @contextlib.contextmanager
+    def open(self, mode: str) -> typing.Iterator[numpy.ndarray]:
+        if self.filename:
+            memmap = numpy.memmap(self.filename, self.dtype, typing.cast(typing.Any, mode), self.offset, self.shape)
+            try:
+                yield memmap
+            finally:
+                if mode != "r":
+                    memmap.flush()
+        else:
+            block = shared_memory.SharedMemory(name=self.shared_memory_name)
+            array: typing.Optional[numpy.ndarray] = numpy.ndarray(self.shape, dtype=self.dtype, buffer=block.buf)
+            try:
+                yield typing.cast(numpy.ndarray, array)
+            finally:
+                array = None  # release the buffer before closing the block
+                block.close()
+
+
+def share_array(array: numpy.ndarray, exit_stack: contextlib.ExitStack, copy_data: bool) -> typing.Tuple[typing.Optional[SharedArray], numpy.ndarray]:
+    """Return a SharedArray for array along with a local view of the shared data, or None if array cannot be shared.
+
+    A memmap that maps a whole contiguous file region is shared directly by its filename. Other arrays are placed in a shared
+    memory block, copying their contents one navigation row at a time if copy_data is True. The block is released by exit_stack,
+    so the local view must be released before exit_stack closes.
+    """
+    if isinstance(array, numpy.memmap) and isinstance(array.base, mmap.mmap) and array.filename and array.flags.c_contiguous:
+        return SharedArray(array.shape, array.dtype, filename=array.filename, offset=array.offset), array
+    if shared_memory is None:
+        return None, array
+    dtype = numpy.dtype(array.dtype)
+    block = shared_memory.SharedMemory(create=True, size=max(1, int(numpy.prod(array.shape, dtype=numpy.int64)) * dtype.itemsize))
+    exit_stack.callback(block.unlink)
+    exit_stack.callback(block.close)
+    shared: numpy.ndarray = numpy.ndarray(array.shape, dtype=dtype, buffer=block.buf)
+    if copy_data:
+        for row in range(array.shape[0]):
+            shared[row] = array[row]
+    return SharedArray(array.shape, dtype, shared_memory_name=block.name), shared
+
+
+def _map_rows(model: AbstractBackgroundModel, method_name: str, data: SharedArray, out: SharedArray, rows: slice, args: typing.Tuple,
+              kwargs: typing.Mapping[str, typing.Any], outputs: typing.Mapping[str, SharedArray], inputs: typing.Mapping[str, numpy.ndarray]) -> None:
+    # worker process entry point; run the serial method on a block of rows, writing directly into the shared outputs.
+    with contextlib.ExitStack() as exit_stack:
+        data_array = exit_stack.enter_context(data.open("r"))
+        out_array = exit_stack.enter_context(out.open("r+"))
+        output_arrays = {name: exit_stack.enter_context(output.open("r+"))[rows] for name, output in outputs.items()}
+        getattr(model, method_name)(data_array[rows], *args, out=out_array[rows], **kwargs, **output_arrays, **inputs)
+        del data_array, out_array, output_arrays
+
+
+def map_rows_in_pool(model: AbstractBackgroundModel, method_name: str, data: numpy.ndarray, out: numpy.ndarray, args: typing.Tuple,
+                     kwargs: typing.Mapping[str, typing.Any], workers: typing.Optional[int],
+                     outputs: typing.Optional[typing.Mapping[str, typing.Optional[numpy.ndarray]]] = None,
+                     inputs: typing.Optional[typing.Mapping[str, typing.Optional[numpy.ndarray]]] = None) -> bool:
+    """Run model.method_name(data, *args, out=out, **kwargs) on blocks of rows of data in a process pool.
+
+    outputs are additional output arrays with the same leading axis as data, passed as keyword arguments; None entries are skipped.
+    inputs are additional small input arrays with the same leading axis as data (e.g. per spectrum offsets), passed to each task as
+    keyword arguments sliced to its rows; None entries are skipped.
+
+    The data and outputs are shared with the worker processes through memmap files or shared memory rather than pickled.
+    Return False without doing anything if the work should be done serially, i.e. if workers is not more than one, the data has
+    fewer than PARALLEL_MINIMUM_SIZE elements or a single row, or shared memory is unavailable.
+    """
+    if not workers or workers <= 1 or data.ndim < 2 or data.shape[0] < 2 or numpy.prod(data.shape, dtype=numpy.int64) < PARALLEL_MINIMUM_SIZE:
+        return False
+    with contextlib.ExitStack() as exit_stack:
+        shared_data, data_view = share_array(data, exit_stack, True)
+        shared_out, out_view = share_array(out, exit_stack, False)
+        shared_outputs = {name: share_array(output, exit_stack, False) for name, output in (outputs or dict()).items() if output is not None}
+        del data_view
+        shared_output_arrays = {name: shared_output for name, (shared_output, output_view) in shared_outputs.items() if shared_output is not None}
+        if shared_data is None or shared_out is None or len(shared_output_arrays) != len(shared_outputs):
+            return False
+        row_count = data.shape[0]
+        task_count = min(row_count, workers * 4)
+        bounds = numpy.linspace(0, row_count, task_count + 1).astype(int)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            row_inputs = {name: values for name, values in (inputs or dict()).items() if values is not None}
+            futures = [executor.submit(_map_rows, model, method_name, shared_data, shared_out, slice(start, stop), args, kwargs, shared_output_arrays,
+                                       {name: values[start:stop] for name, values in row_inputs.items()})
+                       for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+            for future in futures:
+                future.result()
+        if out_view is not out:
+            out[...] = out_view
+        for name, (shared_output, output_view) in shared_outputs.items():
+            output = typing.cast(typing.Mapping[str, numpy.ndarray], outputs)[name]
+            if output_view is not output:
+                output[...] = output_view
+        del out_view, shared_outputs
+    return True
+
+
 class AbstractBackgroundModel:
     def __init__(self, background_model_id: str, title: str = None):
         self.background_model_id = background_model_id
@@ -27,61 +333,414 @@ class AbstractBackgroundModel:
 
     def fit_background(self, *, spectrum_xdata: DataAndMetadata.DataAndMetadata,
                        fit_intervals: typing.Sequence[Calibration.CalibratedInterval],
-                       background_interval: Calibration.CalibratedInterval, **kwargs) -> typing.Dict:
+                       background_interval: Calibration.CalibratedInterval,
+                       chunk_size: typing.Optional[int] = None, out: typing.Optional[numpy.ndarray] = None,
+                       workers: typing.Optional[int] = None, dtype: numpy.dtype = None, lazy: bool = False, cache: bool = False,
+                       data_version: typing.Any = None, **kwargs) -> typing.Dict:
+        # cache returns the result of an earlier call with identical spectrum data, calibrations, intervals and options from
+        # background_result_cache, so re-executing a computation whose inputs have not changed returns immediately. it is off by
+        # default because the key digests the whole spectrum data, which costs a full read of it on every call. it is not used
+        # when out is supplied.
+        # data_version is an optional hashable token identifying the contents of the spectrum data (e.g. the data item uuid and
+        # modified timestamp), which must change whenever the data changes. the cache key uses it instead of the data digest.
+        key = self.__get_result_key("fit_background", spectrum_xdata, fit_intervals, [background_interval],
+                                    dict(kwargs, dtype=dtype, lazy=lazy), data_version) if cache and out is None else None
+        if key is not None:
+            return background_result_cache.get_result(key, lambda: self.fit_background(
+                spectrum_xdata=spectrum_xdata, fit_intervals=fit_intervals, background_interval=background_interval, chunk_size=chunk_size,
+                workers=workers, dtype=dtype, lazy=lazy, cache=False, data_version=data_version, **kwargs))
+        # lazy returns the background of a navigable spectrum as a LazyBackground, which stores the fit parameters of each spectrum
+        # and evaluates the background of the requested spectra on demand, instead of as xdata of the full background.
+        # chunk_size limits the number of spectra fit at once when the spectrum is navigable.
+        # out is an optional array (or memmap) with shape navigation shape + (n,) to receive the background.
+        # workers is the number of processes used to fit navigable spectra; the default fits in this process.
+        # dtype is the working precision of the fit data and background, float64 by default; pass numpy.float32 to halve memory.
+        # binning fits navigable spectra averaged over binning x binning blocks and upsamples with interpolation ("nearest" or "bilinear").
+        # channel_offsets fits navigable spectra whose energy axis drifts as if aligned, given the channel offset of each spectrum (e.g.
+        # the data of the shifts from AlignZLP), without resampling the data; the background is on the aligned energy axis.
+        # data_version and other keyword arguments are passed to fit_background_data as model specific options (e.g. cumulative_sums).
+        # for navigable spectra, validity is a boolean map which is False where the background could not be fit and is zero.
+        validity = numpy.empty(spectrum_xdata.navigation_dimension_shape, dtype=bool) if spectrum_xdata.is_navigable else None
+        if lazy and validity is not None:
+            xs, fit_slices, background_slice, fs, calibration = self.__get_fit_domains(spectrum_xdata, fit_intervals, background_interval)
+            params = self.fit_background_params(spectrum_xdata.data, fit_slices, xs, chunk_size=chunk_size, out=out, workers=workers, dtype=dtype,
+                                                validity=validity, data_version=data_version, **kwargs)
+            return {
+                "background_model": LazyBackground(self, xs, fs, params, validity, dtype=dtype,
+                                                   dimensional_calibrations=list(spectrum_xdata.navigation_dimensional_calibrations) + [calibration],
+                                                   intensity_calibration=spectrum_xdata.intensity_calibration),
+                "validity": DataAndMetadata.new_data_and_metadata(validity, dimensional_calibrations=spectrum_xdata.navigation_dimensional_calibrations),
+            }
+        background_xdata = self.__fit_background(spectrum_xdata, fit_intervals, background_interval, chunk_size=chunk_size, out=out,
+                                                 workers=workers, dtype=dtype, validity=validity, data_version=data_version, **kwargs)
+        if validity is None:
+            return {
+                "background_model": background_xdata,
+            }
         return {
-            "background_model": self.__fit_background(spectrum_xdata, fit_intervals, background_interval),
+            "background_model": background_xdata,
+            "validity": DataAndMetadata.new_data_and_metadata(validity, dimensional_calibrations=spectrum_xdata.navigation_dimensional_calibrations),
         }
 
     def integrate_signal(self, *, spectrum_xdata: DataAndMetadata.DataAndMetadata,
                          fit_intervals: typing.Sequence[Calibration.CalibratedInterval],
-                         signal_interval: Calibration.CalibratedInterval, **kwargs) -> typing.Dict:
-        # set up initial values
-        subtracted_xdata = Core.calibrated_subtract_spectrum(spectrum_xdata, self.__fit_background(spectrum_xdata, fit_intervals, signal_interval))
+                         signal_interval: Calibration.CalibratedInterval = None,
+                         chunk_size: typing.Optional[int] = None, out: typing.Optional[numpy.ndarray] = None,
+                         workers: typing.Optional[int] = None, dtype: numpy.dtype = None,
+                         signal_intervals: typing.Optional[typing.Sequence[Calibration.CalibratedInterval]] = None, cache: bool = False,
+                         data_version: typing.Any = None, **kwargs) -> typing.Dict:
+        # cache returns the result of an earlier call with identical inputs from background_result_cache, keyed on data_version
+        # if supplied (see fit_background).
+        key = self.__get_result_key("integrate_signal", spectrum_xdata, fit_intervals,
+                                    signal_intervals if signal_intervals is not None else [signal_interval],
+                                    dict(kwargs, dtype=dtype), data_version) if cache and out is None else None
+        if key is not None:
+            return background_result_cache.get_result(key, lambda: self.integrate_signal(
+                spectrum_xdata=spectrum_xdata, fit_intervals=fit_intervals, signal_interval=signal_interval, chunk_size=chunk_size,
+                workers=workers, dtype=dtype, signal_intervals=signal_intervals, cache=False, data_version=data_version, **kwargs))
+        # signal_intervals integrates several signal intervals using one background fit and one pass over the data, instead of
+        # signal_interval. the integrated result is then a sequence of maps (or an array of values) in the order of the intervals.
+        # for navigable spectra, both integrate the background at the x-values of the signal channels (see get_channel_domain).
+        # chunk_size limits the number of spectra fit at once when the spectrum is navigable.
+        # out is an optional array (or memmap) with the navigation shape to receive the integrated signal, or with the navigation
+        # shape + (number of signal intervals,) when integrating signal_intervals.
+        # workers is the number of processes used to fit navigable spectra; the default fits in this process.
+        # dtype is the working precision of the fit data and background, float64 by default; integrals are always float64.
+        # binning fits navigable spectra averaged over binning x binning blocks and upsamples with interpolation ("nearest" or "bilinear").
+        # channel_offsets reads the fit and signal intervals of each navigable spectrum shifted by its channel offset (see fit_background).
+        # data_version and other keyword arguments are passed to integrate_signal_data as model specific options (e.g. cumulative_sums).
+        # for navigable spectra, validity is a boolean map which is False where the background could not be fit and is not subtracted.
+        if signal_intervals is not None:
+            return self.__integrate_signals(spectrum_xdata, fit_intervals, signal_intervals, chunk_size=chunk_size, out=out, workers=workers,
+                                            dtype=dtype, data_version=data_version, **kwargs)
+        assert signal_interval is not None
         if spectrum_xdata.is_navigable:
+            xs, fit_slices, signal_slice, signal_fs, calibration = self.__get_fit_domains(spectrum_xdata, fit_intervals, signal_interval)
+            fs = get_channel_domain(spectrum_xdata.datum_dimensional_calibrations[0], signal_slice)
+            validity = numpy.empty(spectrum_xdata.navigation_dimension_shape, dtype=bool)
+            integrated = self.integrate_signal_data(spectrum_xdata.data, fit_slices, xs, signal_slice, fs, chunk_size=chunk_size, out=out,
+                                                    workers=workers, dtype=dtype, validity=validity, data_version=data_version, **kwargs)
             return {
                 "integrated": DataAndMetadata.new_data_and_metadata(
-                    numpy.trapz(subtracted_xdata.data),
-                    dimensional_calibrations=spectrum_xdata.navigation_dimensional_calibrations)
+                    integrated,
+                    dimensional_calibrations=spectrum_xdata.navigation_dimensional_calibrations),
+                "validity": DataAndMetadata.new_data_and_metadata(
+                    validity,
+                    dimensional_calibrations=spectrum_xdata.navigation_dimensional_calibrations),
             }
         else:
+            subtracted_xdata = Core.calibrated_subtract_spectrum(spectrum_xdata, self.__fit_background(spectrum_xdata, fit_intervals, signal_interval,
+                                                                                                       dtype=dtype))
             return {
                 "integrated_value": numpy.trapz(subtracted_xdata.data),
             }
 
-    def __fit_background(self, spectrum_xdata: DataAndMetadata.DataAndMetadata,
+    def fit_background_data(self, data: numpy.ndarray, fit_slices: typing.Sequence[slice], xs: numpy.ndarray, fs: numpy.ndarray, *,
+                            chunk_size: typing.Optional[int] = None, out: typing.Optional[numpy.ndarray] = None,
+                            workers: typing.Optional[int] = None, dtype: numpy.dtype = None, binning: int = 1, interpolation: str = "nearest",
+                            validity: typing.Optional[numpy.ndarray] = None,
+                            channel_offsets: typing.Optional[numpy.ndarray] = None, **kwargs) -> numpy.ndarray:
+        """Fit the background of each spectrum in data and return it evaluated at fs, with shape data.shape[:-1] + fs.shape.
+
+        data may be any array supporting basic slicing (e.g. numpy.memmap); it is read one chunk of at most chunk_size spectra at a
+        time so that peak memory scales with the chunk size. The background is written into out if supplied.
+
+        If workers is more than one, rows of the first navigation axis are fit in a pool of worker processes (see map_rows_in_pool).
+
+        Each chunk of fit data is converted to dtype (float64 by default) and the background is computed and returned in that dtype.
+        Using float32 halves the memory traffic and footprint of the background; reductions are still accumulated in float64.
+
+        If binning is more than one, the fit data is averaged over binning x binning blocks of the navigation axes (see
+        bin_navigation_fit_data), the averages are fit, and the binned backgrounds are upsampled to every spectrum with interpolation
+        "nearest" or "bilinear" (see upsample_navigation). This reduces the number of fits by binning squared for 2D navigation and
+        makes the fits of noisy spectra more robust, at the cost of spatial resolution in the background.
+
+        Backgrounds that cannot be fit (non-finite results from _perform_fits) are zeroed. If validity is supplied, a boolean array
+        with the navigation shape, it is set to False for those spectra and True for the others.
+
+        If channel_offsets is supplied, an array with the navigation shape of fractional channel offsets (e.g. the ZLP shifts of
+        AlignZLP), the fit channels of each spectrum are read shifted by its offset (see gather_fit_data), so spectra with a drifting
+        energy axis are fit as if aligned, without resampling data. The backgrounds are then on the aligned energy axis. Spectra with any
+        fit channel shifted beyond the spectrum are invalid, for every model. Offsets cannot be combined with binning.
+
+        Subclasses may accept model specific options through kwargs; they are ignored here.
+        """
+        dtype = numpy.dtype(dtype or numpy.float64)
+        navigation_shape = tuple(data.shape[:-1])
+        if out is None:
+            out = numpy.empty(navigation_shape + fs.shape, dtype=dtype)
+        assert out.shape == navigation_shape + fs.shape
+        check_channel_offsets(channel_offsets, navigation_shape, binning)
+        if binning > 1 and navigation_shape:
+            binned = bin_navigation_fit_data(data, fit_slices, binning, dtype)
+            binned_validity = numpy.empty(binned.shape[:-1], dtype=bool)
+            binned_fit_data = self.fit_background_data(binned, [slice(0, binned.shape[-1])], xs, fs, chunk_size=chunk_size, workers=workers,
+                                                       dtype=dtype, validity=binned_validity, **kwargs)
+            for chunk in iterate_navigation_chunks(navigation_shape, chunk_size):
+                out[chunk] = upsample_navigation(binned_fit_data, navigation_shape, chunk, binning, interpolation)
+                if validity is not None:
+                    validity[chunk] = upsample_validity(binned_validity, navigation_shape, chunk, binning, interpolation)
+            return out
+        if map_rows_in_pool(self, "fit_background_data", data, out, (fit_slices, xs, fs), dict(kwargs, chunk_size=chunk_size, dtype=dtype), workers,
+                            {"validity": validity}, {"channel_offsets": channel_offsets}):
+            return out
+        for chunk in iterate_navigation_chunks(navigation_shape, chunk_size):
+            ys = gather_fit_data(data, chunk, fit_slices, dtype, channel_offsets)
+            fit_data = numpy.reshape(self._perform_fits(xs, numpy.reshape(ys, (-1, ys.shape[-1])), fs), ys.shape[:-1] + fs.shape)
+            is_valid = mask_invalid(fit_data, fs.shape)
+            out[chunk] = fit_data
+            if validity is not None:
+                validity[chunk] = is_valid
+        return out
+
+    def fit_background_params(self, data: numpy.ndarray, fit_slices: typing.Sequence[slice], xs: numpy.ndarray, *,
+                              chunk_size: typing.Optional[int] = None, out: typing.Optional[numpy.ndarray] = None,
+                              workers: typing.Optional[int] = None, dtype: numpy.dtype = None, binning: int = 1, interpolation: str = "nearest",
+                              validity: typing.Optional[numpy.ndarray] = None,
+                              channel_offsets: typing.Optional[numpy.ndarray] = None, **kwargs) -> numpy.ndarray:
+        """Fit the background of each spectrum in data and return the float64 fit parameters, with shape data.shape[:-1] + (p,).
+
+        The parameters are those of _fit_params, from which _evaluate_params evaluates the background at any x-values (see
+        LazyBackground). A polynomial background is stored as deg + 1 coefficients per spectrum instead of the n background channels.
+
+        Chunks, workers, dtype, validity and channel_offsets are as described in fit_background_data; the parameters of spectra that
+        cannot be fit are nan. Binning supports "nearest" interpolation only, which copies the parameters of each block to its spectra.
+        """
+        dtype = numpy.dtype(dtype or numpy.float64)
+        navigation_shape = tuple(data.shape[:-1])
+        check_channel_offsets(channel_offsets, navigation_shape, binning)
+        if out is None:
+            # the number of parameters may depend on the model options, so fit a single spectrum to find it.
+            first_ys = gather_fit_data(data, tuple(slice(0, 1) for _ in navigation_shape), fit_slices, dtype, channel_offsets)
+            with numpy.errstate(divide="ignore", invalid="ignore"):
+                param_count = self._fit_params(xs, numpy.reshape(first_ys, (1, -1))).shape[-1]
+            out = numpy.empty(navigation_shape + (param_count,))
+        assert out.shape[:-1] == navigation_shape
+        if binning > 1 and navigation_shape:
+            if interpolation != "nearest":
+                raise ValueError(f"Background parameters can only be upsampled with nearest interpolation, not {interpolation}.")
+            binned = bin_navigation_fit_data(data, fit_slices, binning, dtype)
+            binned_validity = numpy.empty(binned.shape[:-1], dtype=bool)
+            binned_params = self.fit_background_params(binned, [slice(0, binned.shape[-1])], xs, chunk_size=chunk_size, workers=workers,
+                                                       dtype=dtype, validity=binned_validity, **kwargs)
+            for chunk in iterate_navigation_chunks(navigation_shape, chunk_size):
+                out[chunk] = upsample_navigation(binned_params, navigation_shape, chunk, binning)
+                if validity is not None:
+                    validity[chunk] = upsample_validity(binned_validity, navigation_shape, chunk, binning, interpolation)
+            return out
+        if map_rows_in_pool(self, "fit_background_params", data, out, (fit_slices, xs), dict(kwargs, chunk_size=chunk_size, dtype=dtype), workers,
+                            {"validity": validity}, {"channel_offsets": channel_offsets}):
+            return out
+        for chunk in iterate_navigation_chunks(navigation_shape, chunk_size):
+            ys = gather_fit_data(data, chunk, fit_slices, dtype, channel_offsets)
+            params = numpy.reshape(self._fit_params(xs, numpy.reshape(ys, (-1, ys.shape[-1]))), ys.shape[:-1] + out.shape[-1:])
+            is_valid = numpy.all(numpy.isfinite(params), axis=-1)
+            params[~is_valid] = numpy.nan
+            out[chunk] = params
+            if validity is not None:
+                validity[chunk] = is_valid
+        return out
+
+    def integrate_signal_data(self, data: numpy.ndarray, fit_slices: typing.Sequence[slice], xs: numpy.ndarray, signal_slice: slice,
+                              fs: numpy.ndarray, *, chunk_size: typing.Optional[int] = None,
+                              out: typing.Optional[numpy.ndarray] = None, workers: typing.Optional[int] = None,
+                              dtype: numpy.dtype = None, binning: int = 1, interpolation: str = "nearest",
+                              validity: typing.Optional[numpy.ndarray] = None,
+                              channel_offsets: typing.Optional[numpy.ndarray] = None, **kwargs) -> numpy.ndarray:
+        """Integrate the background subtracted signal over signal_slice for each spectrum in data, with shape data.shape[:-1].
+
+        The integral is the channel sum of the data minus the background integral from _integrate_fits, so the background is
+        never evaluated over the signal channels unless the model has no integral shortcut.
+        fs are the x-values of the channels in signal_slice. data is read in chunks and optionally in worker processes as described
+        in fit_background_data, using dtype as the working precision of the fit. The integrated signal is written into out if supplied.
+
+        If binning is more than one, the background integrals are computed from binned fit data and upsampled as described in
+        fit_background_data, while the signal is still integrated for every spectrum.
+
+        Spectra whose background cannot be fit are integrated without subtracting a background and flagged in validity, as
+        described in fit_background_data.
+
+        If channel_offsets is supplied, the fit and signal channels of each spectrum are read shifted by its offset as described in
+        fit_background_data; the signal of spectra whose signal channels leave the data is nan.
+        """
+        dtype = numpy.dtype(dtype or numpy.float64)
+        navigation_shape = tuple(data.shape[:-1])
+        if out is None:
+            out = numpy.empty(navigation_shape)
+        assert out.shape == navigation_shape
+        check_channel_offsets(channel_offsets, navigation_shape, binning)
+        if binning > 1 and navigation_shape:
+            binned = bin_navigation_fit_data(data, fit_slices, binning, dtype)
+            binned_fit_integrals = numpy.reshape(self._integrate_fits(xs, numpy.reshape(binned, (-1, binned.shape[-1])), fs), binned.shape[:-1])
+            binned_validity = mask_invalid(binned_fit_integrals)
+            for chunk in iterate_navigation_chunks(navigation_shape, chunk_size):
+                fit_integrals = upsample_navigation(binned_fit_integrals, navigation_shape, chunk, binning, interpolation)
+                out[chunk] = trapz_channels(data[chunk + (signal_slice,)]) - fit_integrals
+                if validity is not None:
+                    validity[chunk] = upsample_validity(binned_validity, navigation_shape, chunk, binning, interpolation)
+            return out
+        if map_rows_in_pool(self, "integrate_signal_data", data, out, (fit_slices, xs, signal_slice, fs), dict(kwargs, chunk_size=chunk_size, dtype=dtype),
+                            workers, {"validity": validity}, {"channel_offsets": channel_offsets}):
+            return out
+        for chunk in iterate_navigation_chunks(navigation_shape, chunk_size):
+            ys = gather_fit_data(data, chunk, fit_slices, dtype, channel_offsets)
+            fit_integrals = numpy.reshape(self._integrate_fits(xs, numpy.reshape(ys, (-1, ys.shape[-1])), fs), ys.shape[:-1])
+            is_valid = mask_invalid(fit_integrals)
+            signal_data = data[chunk + (signal_slice,)] if channel_offsets is None else gather_fit_data(data, chunk, [signal_slice], None, channel_offsets)
+            out[chunk] = trapz_channels(signal_data) - fit_integrals
+            if validity is not None:
+                validity[chunk] = is_valid
+        return out
+
+    def integrate_signals_data(self, data: numpy.ndarray, fit_slices: typing.Sequence[slice], xs: numpy.ndarray, signal_slices: typing.Sequence[slice],
+                               fs: numpy.ndarray, *, chunk_size: typing.Optional[int] = None,
+                               out: typing.Optional[numpy.ndarray] = None, workers: typing.Optional[int] = None,
+                               dtype: numpy.dtype = None, binning: int = 1, interpolation: str = "nearest",
+                               validity: typing.Optional[numpy.ndarray] = None,
+                               channel_offsets: typing.Optional[numpy.ndarray] = None, **kwargs) -> numpy.ndarray:
+        """Integrate the background subtracted signal over each of signal_slices for each spectrum in data.
+
+        Returns an array with shape data.shape[:-1] + (len(signal_slices),). fs are the x-values of the channels from the start of the
+        first to the end of the last signal slice. The background of each chunk is fit once and integrated over every signal slice
+        (see _integrate_fits_over_windows), and the signal channels are read once, so mapping several windows (e.g. an ELNES series)
+        costs one pass over the data. Chunks, workers, dtype, binning, validity and channel_offsets are as described in integrate_signal_data.
+        """
+        dtype = numpy.dtype(dtype or numpy.float64)
+        navigation_shape = tuple(data.shape[:-1])
+        if out is None:
+            out = numpy.empty(navigation_shape + (len(signal_slices),))
+        assert out.shape == navigation_shape + (len(signal_slices),)
+        check_channel_offsets(channel_offsets, navigation_shape, binning)
+        signals_start = min(signal_slice.start for signal_slice in signal_slices)
+        signals_slice = slice(signals_start, max(signal_slice.stop for signal_slice in signal_slices))
+        assert len(fs) == signals_slice.stop - signals_slice.start
+        windows = [slice(signal_slice.start - signals_start, signal_slice.stop - signals_start) for signal_slice in signal_slices]
+        if binning > 1 and navigation_shape:
+            binned = bin_navigation_fit_data(data, fit_slices, binning, dtype)
+            binned_fit_integrals = numpy.reshape(self._integrate_fits_over_windows(xs, numpy.reshape(binned, (-1, binned.shape[-1])), fs, windows),
+                                                 binned.shape[:-1] + (len(windows),))
+            binned_validity = mask_invalid(binned_fit_integrals, (len(windows),))
+            for chunk in iterate_navigation_chunks(navigation_shape, chunk_size):
+                fit_integrals = upsample_navigation(binned_fit_integrals, navigation_shape, chunk, binning, interpolation)
+                out[chunk] = self.__integrate_windows(data[chunk + (signals_slice,)], windows) - fit_integrals
+                if validity is not None:
+                    validity[chunk] = upsample_validity(binned_validity, navigation_shape, chunk, binning, interpolation)
+            return out
+        if map_rows_in_pool(self, "integrate_signals_data", data, out, (fit_slices, xs, signal_slices, fs), dict(kwargs, chunk_size=chunk_size, dtype=dtype),
+                            workers, {"validity": validity}, {"channel_offsets": channel_offsets}):
+            return out
+        for chunk in iterate_navigation_chunks(navigation_shape, chunk_size):
+            ys = gather_fit_data(data, chunk, fit_slices, dtype, channel_offsets)
+            fit_integrals = numpy.reshape(self._integrate_fits_over_windows(xs, numpy.reshape(ys, (-1, ys.shape[-1])), fs, windows),
+                                          ys.shape[:-1] + (len(windows),))
+            is_valid = mask_invalid(fit_integrals, (len(windows),))
+            signal_data = data[chunk + (signals_slice,)] if channel_offsets is None else gather_fit_data(data, chunk, [signals_slice], None, channel_offsets)
+            out[chunk] = self.__integrate_windows(signal_data, windows) - fit_integrals
+            if validity is not None:
+                validity[chunk] = is_valid
+        return out
+
+    def __integrate_windows(self, signal_data: numpy.ndarray, windows: typing.Sequence[slice]) -> numpy.ndarray:
+        return numpy.stack([trapz_channels(signal_data[..., window]) for window in windows], axis=-1)
+
+    def __integrate_signals(self, spectrum_xdata: DataAndMetadata.DataAndMetadata,
+                            fit_intervals: typing.Sequence[Calibration.CalibratedInterval],
+                            signal_intervals: typing.Sequence[Calibration.CalibratedInterval],
+                            **kwargs) -> typing.Dict:
+        signal_slices = list()
+        for signal_interval in signal_intervals:
+            xs, fit_slices, signal_slice, signal_fs, calibration = self.__get_fit_domains(spectrum_xdata, fit_intervals, signal_interval)
+            signal_slices.append(signal_slice)
+        signals_slice = slice(min(signal_slice.start for signal_slice in signal_slices), max(signal_slice.stop for signal_slice in signal_slices))
+        fs = get_channel_domain(spectrum_xdata.datum_dimensional_calibrations[0], signals_slice)
+        if spectrum_xdata.is_navigable:
+            validity = numpy.empty(spectrum_xdata.navigation_dimension_shape, dtype=bool)
+            integrated = self.integrate_signals_data(spectrum_xdata.data, fit_slices, xs, signal_slices, fs, validity=validity, **kwargs)
+            # the maps are the sequence axis of the result.
+            data_descriptor = DataAndMetadata.DataDescriptor(True, 0, spectrum_xdata.navigation_dimension_count)
+            return {
+                "integrated": DataAndMetadata.new_data_and_metadata(
+                    numpy.moveaxis(integrated, -1, 0),
+                    data_descriptor=data_descriptor,
+                    dimensional_calibrations=[Calibration.Calibration()] + list(spectrum_xdata.navigation_dimensional_calibrations)),
+                "validity": DataAndMetadata.new_data_and_metadata(
+                    validity,
+                    dimensional_calibrations=spectrum_xdata.navigation_dimensional_calibrations),
+            }
+        kwargs.pop("out", None)
+        return {
+            "integrated_values": self.integrate_signals_data(spectrum_xdata.data[numpy.newaxis, :], fit_slices, xs, signal_slices, fs, **kwargs)[0],
+        }
+
+    def __get_result_key(self, operation: str, spectrum_xdata: DataAndMetadata.DataAndMetadata,
                          fit_intervals: typing.Sequence[Calibration.CalibratedInterval],
-                         background_interval: Calibration.CalibratedInterval) -> DataAndMetadata.DataAndMetadata:
+                         intervals: typing.Sequence[typing.Optional[Calibration.CalibratedInterval]],
+                         options: typing.Mapping[str, typing.Any], data_version: typing.Any = None) -> typing.Optional[typing.Tuple]:
+        # return the result cache key for the inputs, or None if an option or the data version cannot be part of a key (e.g. an array).
+        # the data is identified by data_version with its shape and dtype if supplied, otherwise by its digest.
+        def get_interval_key(interval: typing.Optional[Calibration.CalibratedInterval]) -> typing.Optional[typing.Tuple]:
+            if interval is None:
+                return None
+            return (interval.start.coordinate_type, interval.start.value, interval.end.coordinate_type, interval.end.value)
+
+        def get_calibration_key(calibration: Calibration.Calibration) -> typing.Tuple:
+            return calibration.offset, calibration.scale, calibration.units
+
+        options_key = tuple(sorted((name, numpy.dtype(value).str if name == "dtype" and value is not None else value) for name, value in options.items()))
+        data = spectrum_xdata.data
+        data_key = (data.shape, data.dtype.str, data_version) if data_version is not None else None
+        try:
+            hash((options_key, data_key))
+        except TypeError:
+            return None
+        data_descriptor = spectrum_xdata.data_descriptor
+        return (self, operation, options_key,
+                tuple(get_interval_key(interval) for interval in fit_intervals), tuple(get_interval_key(interval) for interval in intervals),
+                (data_descriptor.is_sequence, data_descriptor.collection_dimension_count, data_descriptor.datum_dimension_count),
+                tuple(get_calibration_key(calibration) for calibration in spectrum_xdata.dimensional_calibrations),
+                get_calibration_key(spectrum_xdata.intensity_calibration), data_key if data_key is not None else get_data_digest(data))
+
+    def __get_fit_domains(self, spectrum_xdata: DataAndMetadata.DataAndMetadata,
+                          fit_intervals: typing.Sequence[Calibration.CalibratedInterval],
+                          background_interval: Calibration.CalibratedInterval
+                          ) -> typing.Tuple[numpy.ndarray, typing.List[slice], slice, numpy.ndarray, Calibration.Calibration]:
+        # return the fit x-values, the fit slices, the background slice, the background x-values and the background calibration.
         reference_frame = Calibration.ReferenceFrameAxis(spectrum_xdata.datum_dimensional_calibrations[0], spectrum_xdata.datum_dimension_shape[0])
-        # fit polynomial to the data
         xs = numpy.concatenate(
             [Core.get_calibrated_interval_domain(reference_frame, fit_interval) for fit_interval in fit_intervals])
-        if len(fit_intervals) > 1:
-            ys = numpy.concatenate(
-                [Core.get_calibrated_interval_slice(spectrum_xdata, reference_frame, fit_interval).data for fit_interval in
-                 fit_intervals])
-        else:
-            ys = Core.get_calibrated_interval_slice(spectrum_xdata, reference_frame, fit_intervals[0]).data
+        fit_slices = [get_interval_slice(reference_frame, fit_interval) for fit_interval in fit_intervals]
         # generate background model data from the series
-        n = reference_frame.convert_to_pixel(background_interval.end).int_value - reference_frame.convert_to_pixel(
-            background_interval.start).int_value
+        background_slice = get_interval_slice(reference_frame, background_interval)
+        n = background_slice.stop - background_slice.start
         interval_start = reference_frame.convert_to_calibrated(background_interval.start).value
         interval_end = reference_frame.convert_to_calibrated(background_interval.end).value
         interval_end -= (interval_end - interval_start) / n  # n samples at the left edges of each pixel
         calibration = copy.deepcopy(spectrum_xdata.datum_dimensional_calibrations[0])
         calibration.offset = reference_frame.convert_to_calibrated(background_interval.start).value
         fs = numpy.linspace(interval_start, interval_end, n)
+        return xs, fit_slices, background_slice, fs, calibration
+
+    def __fit_background(self, spectrum_xdata: DataAndMetadata.DataAndMetadata,
+                         fit_intervals: typing.Sequence[Calibration.CalibratedInterval],
+                         background_interval: Calibration.CalibratedInterval,
+                         chunk_size: typing.Optional[int] = None, out: typing.Optional[numpy.ndarray] = None,
+                         workers: typing.Optional[int] = None, dtype: numpy.dtype = None, validity: typing.Optional[numpy.ndarray] = None,
+                         **kwargs) -> DataAndMetadata.DataAndMetadata:
+        xs, fit_slices, background_slice, fs, calibration = self.__get_fit_domains(spectrum_xdata, fit_intervals, background_interval)
         if spectrum_xdata.is_navigable:
             calibrations = list(copy.deepcopy(spectrum_xdata.navigation_dimensional_calibrations)) + [calibration]
-            yss = numpy.reshape(ys, (numpy.product(ys.shape[:-1]),) + (ys.shape[-1],))
-            fit_data = self._perform_fits(xs, yss, fs)
+            fit_data = self.fit_background_data(spectrum_xdata.data, fit_slices, xs, fs, chunk_size=chunk_size, out=out, workers=workers,
+                                                dtype=dtype, validity=validity, **kwargs)
             data_descriptor = DataAndMetadata.DataDescriptor(False, spectrum_xdata.navigation_dimension_count,
                                                              spectrum_xdata.datum_dimension_count)
-            background_xdata = DataAndMetadata.new_data_and_metadata(numpy.reshape(fit_data, ys.shape[:-1] + (n,)),
+            background_xdata = DataAndMetadata.new_data_and_metadata(fit_data,
                                                                      data_descriptor=data_descriptor,
                                                                      dimensional_calibrations=calibrations,
                                                                      intensity_calibration=spectrum_xdata.intensity_calibration)
         else:
+            ys = gather_fit_data(spectrum_xdata.data, (), fit_slices, dtype)
             poly_data = self._perform_fit(xs, ys, fs)
+            mask_invalid(poly_data, fs.shape)
             background_xdata = DataAndMetadata.new_data_and_metadata(poly_data, dimensional_calibrations=[calibration],
                                                                      intensity_calibration=spectrum_xdata.intensity_calibration)
         return background_xdata
@@ -90,9 +749,10 @@ class AbstractBackgroundModel:
         # xs will be a set of x-values with shape (L) representing the energies at which to fit
         # ys will be an array of y-values with shape (m,L)
         # fs will be an array of x-values with shape (n) representing energies at which to generate fitted data
-        # return an ndarray of the fit with shape (m,n)
+        # return an ndarray of the fit with shape (m,n), preferably with the floating point dtype of yss
+        # spectra that cannot be fit should have non-finite (e.g. nan) fits; the caller zeros them and flags them as invalid.
         # implement at least one of _perform_fits and _perform_fit
-        fit = numpy.empty(yss.shape[:-1] + fs.shape)
+        fit = numpy.empty(yss.shape[:-1] + fs.shape, dtype=numpy.promote_types(yss.dtype, numpy.float32))
         for index in numpy.ndindex(yss.shape[:-1]):
             fit[index] = self._perform_fit(xs, yss[index], fs)
         return fit
@@ -105,20 +765,477 @@ class AbstractBackgroundModel:
         # implement at least one of _perform_fits and _perform_fit
         return numpy.reshape(self._perform_fits(xs, numpy.reshape(ys, (1,) + ys.shape), fs), fs.shape)
 
+    def _integrate_fits(self, xs: numpy.ndarray, yss: numpy.ndarray, fs: numpy.ndarray) -> numpy.ndarray:
+        # xs will be a set of x-values with shape (L) representing the energies at which to fit
+        # ys will be an array of y-values with shape (m,L)
+        # fs will be an array of equally spaced x-values with shape (n) representing the energies of the signal channels
+        # return an ndarray with shape (m) of the trapezoidal integral of the fit over fs, in units of channels, nan if it cannot be fit
+        # override to integrate directly from the fit parameters; the default evaluates the fit.
+        return trapz_channels(self._perform_fits(xs, yss, fs))
+
+    def _integrate_fits_over_windows(self, xs: numpy.ndarray, yss: numpy.ndarray, fs: numpy.ndarray,
+                                     windows: typing.Sequence[slice]) -> numpy.ndarray:
+        # xs and yss are as in _integrate_fits
+        # fs will be an array of equally spaced x-values with shape (n) spanning all the windows
+        # windows will be a sequence of k slices into fs
+        # return an ndarray with shape (m, k) of the trapezoidal integrals of a single fit over each window, in units of channels
+        # override to integrate directly from the fit parameters; the default evaluates the fit over fs once.
+        fits = self._perform_fits(xs, yss, fs)
+        return numpy.stack([trapz_channels(fits[..., window]) for window in windows], axis=-1)
+
+    def _fit_params(self, xs: numpy.ndarray, yss: numpy.ndarray) -> numpy.ndarray:
+        # xs and yss are as in _perform_fits
+        # return an ndarray with shape (m, p) of the parameters of each fit, from which _evaluate_params evaluates it, nan if it
+        # cannot be fit. implement both _fit_params and _evaluate_params to support lazy backgrounds (see LazyBackground).
+        raise NotImplementedError(f"{self.background_model_id} does not support lazy backgrounds.")
+
+    def _evaluate_params(self, xs: numpy.ndarray, params: numpy.ndarray, fs: numpy.ndarray) -> numpy.ndarray:
+        # xs will be the x-values of the fit as passed to _fit_params
+        # params will be an array of fit parameters with shape (m, p) as returned by _fit_params
+        # fs will be an array of x-values with shape (n) representing energies at which to generate fitted data
+        # return an ndarray of the fits with shape (m, n)
+        raise NotImplementedError(f"{self.background_model_id} does not support lazy backgrounds.")
+
+
+class LazyBackground:
+    """The background of a navigable spectrum, stored as the fit parameters of each spectrum and evaluated on demand.
+
+    Indexing evaluates the background of the selected spectra only, with the same indexes as the full background array of shape
+    navigation shape + (n,), e.g. background[y, x] for the spectrum at a pixel or background[y0:y1, x0:x1, 10:20] for channels of a
+    region. The background of spectra that could not be fit (False in validity) is zero. Storage is the p parameters per spectrum of
+    the model (e.g. deg + 1 polynomial coefficients) instead of the n background channels.
+    """
+
+    def __init__(self, model: AbstractBackgroundModel, xs: numpy.ndarray, fs: numpy.ndarray, params: numpy.ndarray,
+                 validity: typing.Optional[numpy.ndarray] = None, *, dtype: numpy.dtype = None,
+                 dimensional_calibrations: typing.Optional[typing.Sequence[Calibration.Calibration]] = None,
+                 intensity_calibration: typing.Optional[Calibration.Calibration] = None):
+        self.model = model
+        self.xs = xs
+        self.fs = fs
+        self.params = params
+        self.validity = validity if validity is not None else numpy.all(numpy.isfinite(params), axis=-1)
+        self.dtype = numpy.dtype(dtype or numpy.float64)
+        self.dimensional_calibrations = dimensional_calibrations
+        self.intensity_calibration = intensity_calibration
+
+    @property
+    def shape(self) -> typing.Tuple[int, ...]:
+        return tuple(self.params.shape[:-1]) + self.fs.shape
+
+    @property
+    def navigation_shape(self) -> typing.Tuple[int, ...]:
+        return tuple(self.params.shape[:-1])
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.params.nbytes)
+
+    def __getitem__(self, key: typing.Any) -> numpy.ndarray:
+        # index broadcast views of the flat spectrum and channel indexes with key to find the selected elements without evaluating
+        # the background, then evaluate each selected spectrum once.
+        navigation_size = int(numpy.prod(self.navigation_shape, dtype=numpy.int64))
+        spectrum_indexes = numpy.broadcast_to(numpy.reshape(numpy.arange(navigation_size), self.navigation_shape + (1,)), self.shape)[key]
+        channel_indexes = numpy.broadcast_to(numpy.arange(len(self.fs)), self.shape)[key]
+        unique_indexes, inverse = numpy.unique(spectrum_indexes, return_inverse=True)
+        fits = self.evaluate_spectra(unique_indexes)
+        return typing.cast(numpy.ndarray, fits[numpy.reshape(inverse, numpy.shape(spectrum_indexes)), channel_indexes])
+
+    def __array__(self, dtype: numpy.dtype = None) -> numpy.ndarray:
+        return numpy.asarray(self.evaluate(), dtype=dtype)
+
+    def evaluate_spectra(self, indexes: numpy.ndarray) -> numpy.ndarray:
+        """Return the backgrounds with shape (len(indexes), n) of the spectra at the flat navigation indexes."""
+        flat_params = numpy.reshape(self.params, (-1, self.params.shape[-1]))[indexes]
+        is_valid = numpy.reshape(self.validity, (-1,))[indexes]
+        with numpy.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            fits = numpy.asarray(self.model._evaluate_params(self.xs, numpy.where(is_valid[:, numpy.newaxis], flat_params, 0), self.fs),
+                                 dtype=self.dtype)
+        fits[~is_valid] = 0
+        return fits
+
+    def evaluate(self, chunk_size: typing.Optional[int] = None, out: typing.Optional[numpy.ndarray] = None) -> numpy.ndarray:
+        """Evaluate the full background into out (or a new array), at most chunk_size spectra at a time."""
+        if out is None:
+            out = numpy.empty(self.shape, dtype=self.dtype)
+        assert out.shape == self.shape
+        for chunk in iterate_navigation_chunks(self.navigation_shape, chunk_size):
+            out[chunk] = self[chunk]
+        return out
+
+    def get_spectrum_xdata(self, navigation_index: typing.Sequence[int]) -> DataAndMetadata.DataAndMetadata:
+        """Return the background of the spectrum at navigation_index as calibrated xdata."""
+        dimensional_calibrations = self.dimensional_calibrations[-1:] if self.dimensional_calibrations else None
+        return DataAndMetadata.new_data_and_metadata(self[tuple(navigation_index)], dimensional_calibrations=dimensional_calibrations,
+                                                     intensity_calibration=self.intensity_calibration)
+
+    @property
+    def xdata(self) -> DataAndMetadata.DataAndMetadata:
+        """Return the full evaluated background as calibrated xdata."""
+        data_descriptor = DataAndMetadata.DataDescriptor(False, len(self.navigation_shape), 1)
+        return DataAndMetadata.new_data_and_metadata(self.evaluate(), data_descriptor=data_descriptor,
+                                                     dimensional_calibrations=self.dimensional_calibrations,
+                                                     intensity_calibration=self.intensity_calibration)
+
+
+def solve_weighted_normal_equations(design: numpy.ndarray, design_products: typing.Optional[numpy.ndarray], weights: numpy.ndarray,
+                                    values: numpy.ndarray) -> numpy.ndarray:
+    """Solve the weighted linear least squares problem of each row of values (m, L) for the coefficients (m, k) of design (L, k).
+
+    Rows of weights (m, L) give the per-channel weights of each problem, so the normal matrices differ per row. They are built with a
+    single GEMM of the weights with design_products, the (L, k * k) pairwise products of the design columns (computed if None), and
+    solved with one batched solve. Rows with fewer than k positively weighted channels get nan coefficients.
+    """
+    k = design.shape[-1]
+    if design_products is None:
+        design_products = numpy.reshape(design[:, :, numpy.newaxis] * design[:, numpy.newaxis, :], (len(design), -1))
+    normal_matrices = numpy.reshape(numpy.dot(weights, design_products), (-1, k, k))
+    normal_vectors = numpy.dot(weights * values, design)
+    is_valid = numpy.count_nonzero(weights > 0, axis=-1) >= k
+    normal_matrices[~is_valid] = numpy.identity(k)
+    coefficients = numpy.linalg.solve(normal_matrices, normal_vectors[..., numpy.newaxis])[..., 0]
+    coefficients[~is_valid] = numpy.nan
+    return coefficients
+
+
+class PolynomialFitPlan:
+    """Precomputed least squares projector and evaluation matrix for fitting a polynomial of degree deg.
+
+    The design matrix depends only on the fit x-values (xs), the degree (deg) and the x-values at which the fit is evaluated (fs),
+    so a plan can be shared by every spectrum in a spectrum image and by repeated fits with unchanged intervals.
+
+    The x-values are mapped onto [-1, 1] over the fit domain before building the Vandermonde matrices, which keeps the projector
+    well-conditioned on eV axes in the thousands.
+
+    projector has shape (deg + 1, L) and maps fit data to polynomial coefficients.
+    evaluator has shape (n, deg + 1) and maps polynomial coefficients to evaluated fit data.
+    fit_matrix has shape (L, n) and maps fit data directly to evaluated fit data, so fitting m spectra is a single GEMM.
+    integration_vector has shape (L) and maps fit data directly to the trapezoidal integral of the evaluated fit data.
+
+    For weighted fits, where the normal equations differ per spectrum, the plan also holds the column scaled design matrix with
+    shape (L, deg + 1), its pairwise column products with shape (L, (deg + 1) ** 2) so that the normal matrices of m spectra are a
+    single GEMM with the weights, and the matching scaled evaluator and evaluator integrals. scaled_projector with shape
+    (deg + 1, L) maps fit data to the coefficients of the scaled design matrix.
+    """
+
+    def __init__(self, xs: numpy.ndarray, deg: int, fs: numpy.ndarray):
+        x_min = numpy.amin(xs)
+        x_max = numpy.amax(xs)
+        x_center = (x_max + x_min) / 2
+        x_half_width = (x_max - x_min) / 2 if x_max > x_min else 1.0
+        vander = numpy.polynomial.polynomial.polyvander((xs - x_center) / x_half_width, deg)
+        # scale the columns and use the same singular value cutoff as numpy.polynomial.polynomial.polyfit.
+        scale = numpy.sqrt(numpy.sum(vander * vander, axis=0))
+        scale[scale == 0] = 1
+        rcond = len(xs) * numpy.finfo(vander.dtype).eps
+        self.scaled_projector = numpy.linalg.pinv(vander / scale, rcond=rcond)
+        self.projector = self.scaled_projector / scale[:, numpy.newaxis]
+        self.evaluator = numpy.polynomial.polynomial.polyvander((fs - x_center) / x_half_width, deg)
+        self.fit_matrix = numpy.ascontiguousarray(numpy.dot(self.evaluator, self.projector).T)
+        self.integration_vector = trapz_channels(self.fit_matrix)
+        self.design = vander / scale
+        self.design_products = numpy.reshape(self.design[:, :, numpy.newaxis] * self.design[:, numpy.newaxis, :], (len(xs), -1))
+        self.scaled_evaluator = self.evaluator / scale
+        self.scaled_evaluator_integrals = trapz_channels(self.scaled_evaluator.T)
+        self.__cast_matrices: typing.Dict[typing.Tuple[str, str], numpy.ndarray] = dict()
+
+    def get_matrix(self, name: str, dtype: numpy.dtype) -> numpy.ndarray:
+        """Return the named matrix attribute converted to dtype, caching the conversion."""
+        matrix = getattr(self, name)
+        key = (name, numpy.dtype(dtype).str)
+        if matrix.dtype == dtype:
+            return matrix
+        if key not in self.__cast_matrices:
+            self.__cast_matrices[key] = numpy.ascontiguousarray(matrix, dtype=dtype)
+        return self.__cast_matrices[key]
+
+
+class FitPlanCache:
+    """A thread safe cache of fit plans with least recently used eviction.
+
+    Keys are built from the contents of the numpy arrays passed to get_plan, so equal inputs share a plan.
+    """
+
+    def __init__(self, max_count: int):
+        self.max_count = max_count
+        self.__plans: typing.MutableMapping[typing.Tuple, typing.Any] = collections.OrderedDict()
+        self.__lock = threading.RLock()
+
+    def get_plan(self, plan_class: typing.Callable, *args: typing.Any) -> typing.Any:
+        key = (plan_class,) + tuple((arg.dtype.str, arg.shape, arg.tobytes()) if isinstance(arg, numpy.ndarray) else arg for arg in args)
+        with self.__lock:
+            plan = self.__plans.pop(key, None)
+            if plan is None:
+                plan = plan_class(*args)
+            self.__plans[key] = plan
+            while len(self.__plans) > self.max_count:
+                self.__plans.pop(next(iter(self.__plans)))
+            return plan
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__plans.clear()
+
+    def __len__(self) -> int:
+        return len(self.__plans)
+
+
+fit_plan_cache = FitPlanCache(8)
+
+
+class CumulativeSumTable:
+    """Cumulative sums of (optionally transformed) spectra along the energy axis, with a leading zero channel.
+
+    Once built, the sum, end values and trapezoidal integral of any window of channels are O(1) per spectrum. Channels where the
+    transform is not finite (e.g. the log of non-positive counts) contribute zero to the sums and are counted separately, so that
+    windows containing them can be reported as nan without affecting other windows.
+
+    The table is built in chunks of at most chunk_size spectra and stored in float64, so it takes as much memory as a float64
+    copy of the data.
+    """
+
+    def __init__(self, data: numpy.ndarray, transform: typing.Optional[typing.Callable[[numpy.ndarray], numpy.ndarray]] = None,
+                 chunk_size: typing.Optional[int] = None):
+        navigation_shape = tuple(data.shape[:-1])
+        self.sums = numpy.zeros(navigation_shape + (data.shape[-1] + 1,))
+        self.invalid_counts = numpy.zeros(navigation_shape + (data.shape[-1] + 1,), dtype=numpy.int32) if transform else None
+        for chunk in iterate_navigation_chunks(navigation_shape, chunk_size):
+            values = numpy.asarray(data[chunk], dtype=numpy.float64)
+            if transform:
+                with numpy.errstate(divide="ignore", invalid="ignore"):
+                    values = transform(values)
+                is_invalid = ~numpy.isfinite(values)
+                values[is_invalid] = 0
+                invalid_counts = typing.cast(numpy.ndarray, self.invalid_counts)
+                numpy.cumsum(is_invalid, axis=-1, out=invalid_counts[chunk + (slice(1, None),)])
+            numpy.cumsum(values, axis=-1, out=self.sums[chunk + (slice(1, None),)])
+
+    def window_sums(self, chunk: typing.Tuple, window: slice) -> numpy.ndarray:
+        window_sums = self.sums[chunk + (window.stop,)] - self.sums[chunk + (window.start,)]
+        if self.invalid_counts is not None:
+            window_sums[self.invalid_counts[chunk + (window.stop,)] != self.invalid_counts[chunk + (window.start,)]] = numpy.nan
+        return window_sums
+
+    def values(self, chunk: typing.Tuple, index: int) -> numpy.ndarray:
+        return self.window_sums(chunk, slice(index, index + 1))
+
+    def window_trapz(self, chunk: typing.Tuple, window: slice) -> numpy.ndarray:
+        # the trapezoidal integral over the window with unit channel spacing, matching trapz_channels.
+        if window.stop - window.start < 2:
+            return numpy.zeros(self.sums[chunk + (0,)].shape)
+        return self.window_sums(chunk, window) - 0.5 * (self.values(chunk, window.start) + self.values(chunk, window.stop - 1))
+
+
+class CumulativeSumTableCache:
+    """A thread safe cache of cumulative sum tables for the most recently used data arrays.
+
+    Tables are keyed by the transform and a version of the data contents. If the caller supplies data_version (e.g. the uuid and
+    modified timestamp of the data item, which must change whenever the data is modified), the table is reused for any array with
+    the same version and shape, so a new array of unchanged data (e.g. from a new xdata of the same data item) does not rebuild it.
+    Otherwise tables are keyed by the identity of the data array and the digest of the data (see get_data_digest), which costs a
+    read of the data but no float64 copy of it. Each table takes as much memory as a float64 copy of its data.
+    """
+
+    def __init__(self, max_count: int):
+        self.max_count = max_count
+        self.__entries: typing.List[typing.Tuple[typing.Optional[weakref.ref], typing.Any, typing.Any, CumulativeSumTable]] = list()
+        self.__lock = threading.RLock()
+
+    def get_table(self, data: numpy.ndarray, transform: typing.Optional[typing.Callable[[numpy.ndarray], numpy.ndarray]] = None,
+                  chunk_size: typing.Optional[int] = None, data_version: typing.Any = None) -> CumulativeSumTable:
+        # entries keyed on a data version hold no reference to the data; the others hold a weak reference to it.
+        data_ref = weakref.ref(data) if data_version is None else None
+        version = (data.shape, data_version) if data_version is not None else get_data_digest(data)
+        with self.__lock:
+            self.__entries = [entry for entry in self.__entries if entry[0] is None or entry[0]() is not None]
+            for entry in self.__entries:
+                if (entry[0] is None) == (data_ref is None) and (entry[0] is None or entry[0]() is data) and entry[1] is transform and entry[2] == version:
+                    self.__entries.remove(entry)
+                    self.__entries.append(entry)
+                    return entry[3]
+            if data_ref is not None:
+                # drop the tables of earlier versions of the data before building a new one
+                self.__entries = [entry for entry in self.__entries if not (entry[0] is not None and entry[0]() is data and entry[1] is transform)]
+            table = CumulativeSumTable(data, transform, chunk_size)
+            self.__entries.append((data_ref, transform, version, table))
+            del self.__entries[:-self.max_count]
+            return table
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__entries.clear()
+
+
+cumulative_sum_tables = CumulativeSumTableCache(1)
+
+
+def get_data_digest(data: numpy.ndarray) -> bytes:
+    """Return a digest of the dtype, shape and contents of data, reading it one row of the first axis at a time if not contiguous."""
+    digest = hashlib.sha256()
+    digest.update(f"{data.dtype.str}{data.shape}".encode())
+    if data.flags.c_contiguous:
+        digest.update(data.data.cast("B"))
+    else:
+        for row in data:
+            digest.update(numpy.ascontiguousarray(row).data.cast("B"))
+    return digest.digest()
+
+
+def get_result_nbytes(result: typing.Mapping[str, typing.Any]) -> int:
+    # the size of the arrays, xdata and lazy backgrounds of a result.
+    nbytes = 0
+    for value in result.values():
+        if isinstance(value, DataAndMetadata.DataAndMetadata):
+            value = value.data
+        nbytes += int(getattr(value, "nbytes", 0))
+    return nbytes
+
+
+class BackgroundResultCache:
+    """A thread safe cache of background model results with least recently used eviction by size.
+
+    Keys are built by the caller from a digest of the input data (see get_data_digest) and the model, intervals and options, so
+    identical inputs share a result even if they are passed as new xdata. The total size of the cached results (see
+    get_result_nbytes) is kept below max_bytes; a result larger than max_bytes is returned without being cached. Cached results are
+    shared with every caller and must not be modified.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.__results: typing.MutableMapping[typing.Tuple, typing.Tuple[typing.Dict[str, typing.Any], int]] = collections.OrderedDict()
+        self.__nbytes = 0
+        self.__lock = threading.RLock()
+
+    def get_result(self, key: typing.Tuple, compute: typing.Callable[[], typing.Dict[str, typing.Any]]) -> typing.Dict[str, typing.Any]:
+        with self.__lock:
+            entry = self.__results.pop(key, None)
+            if entry is not None:
+                self.__results[key] = entry
+                return dict(entry[0])
+        # compute outside the lock so that other results can be read while a long fit runs.
+        result = compute()
+        nbytes = get_result_nbytes(result)
+        if nbytes <= self.max_bytes:
+            with self.__lock:
+                previous_entry = self.__results.pop(key, None)
+                if previous_entry is not None:
+                    self.__nbytes -= previous_entry[1]
+                self.__results[key] = (result, nbytes)
+                self.__nbytes += nbytes
+                while self.__nbytes > self.max_bytes:
+                    self.__nbytes -= self.__results.pop(next(iter(self.__results)))[1]
+        return dict(result)
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__results.clear()
+            self.__nbytes = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self.__nbytes
+
+    def __len__(self) -> int:
+        return len(self.__results)
+
+
+background_result_cache = BackgroundResultCache(256 * 2 ** 20)
+
 
 class PolynomialBackgroundModel(AbstractBackgroundModel):
 
-    def __init__(self, background_model_id: str, deg: int, transform=None, untransform=None, title: str = None):
+    def __init__(self, background_model_id: str, deg: int, transform=None, untransform=None, title: str = None, weight=None):
+        # weight is an optional function returning the per-channel least squares weights for an array of fit data; channels with
+        # zero weight are excluded from the fit, so invalid data (e.g. non-positive counts for a log transform) can be ignored.
         super().__init__(background_model_id, title)
         self.deg = deg
         self.transform = transform
         self.untransform = untransform
+        self.weight = weight
 
     def _perform_fits(self, xs: numpy.ndarray, yss: numpy.ndarray, fs: numpy.ndarray) -> numpy.ndarray:
-        transform_data = self.transform or (lambda x: x)
         untransform_data = self.untransform or (lambda x: x)
-        fit = untransform_data(numpy.polynomial.polynomial.polyval(fs, numpy.polynomial.polynomial.polyfit(xs, transform_data(yss.transpose()), self.deg)))
-        return numpy.where(numpy.isfinite(fit), fit, 0)
+        plan = fit_plan_cache.get_plan(PolynomialFitPlan, xs, self.deg, fs)
+        fit_inputs, fit_matrix, integration_vector = self.__get_fit_inputs(plan, yss)
+        return untransform_data(numpy.dot(fit_inputs, fit_matrix))
+
+    def _integrate_fits(self, xs: numpy.ndarray, yss: numpy.ndarray, fs: numpy.ndarray) -> numpy.ndarray:
+        plan = fit_plan_cache.get_plan(PolynomialFitPlan, xs, self.deg, fs)
+        if not self.untransform:
+            fit_inputs, fit_matrix, integration_vector = self.__get_fit_inputs(plan, yss)
+            return numpy.dot(fit_inputs, integration_vector)
+        elif self.untransform is numpy.exp and self.deg <= 1 and len(fs) > 1:
+            # the log of the fit is linear in the channel index, so the integral is a geometric series.
+            fit_inputs, fit_matrix, integration_vector = self.__get_fit_inputs(plan, yss)
+            fit_start = numpy.dot(fit_inputs, fit_matrix[:, 0])
+            fit_step = numpy.dot(fit_inputs, fit_matrix[:, 1] - fit_matrix[:, 0])
+            return exponential_trapz(fit_start, fit_step, len(fs))
+        return super()._integrate_fits(xs, yss, fs)
+
+    def _integrate_fits_over_windows(self, xs: numpy.ndarray, yss: numpy.ndarray, fs: numpy.ndarray,
+                                     windows: typing.Sequence[slice]) -> numpy.ndarray:
+        plan = fit_plan_cache.get_plan(PolynomialFitPlan, xs, self.deg, fs)
+        if not self.untransform:
+            # the fit is linear in the fit inputs, so the integrals over all windows are a single product.
+            fit_inputs, fit_matrix, integration_vector = self.__get_fit_inputs(plan, yss)
+            integration_matrix = numpy.stack([trapz_channels(fit_matrix[:, window].astype(numpy.float64)) for window in windows], axis=-1)
+            return numpy.dot(fit_inputs, integration_matrix)
+        elif self.untransform is numpy.exp and self.deg <= 1 and len(fs) > 1:
+            fit_inputs, fit_matrix, integration_vector = self.__get_fit_inputs(plan, yss)
+            fit_start = numpy.dot(fit_inputs, fit_matrix[:, 0])
+            fit_step = numpy.dot(fit_inputs, fit_matrix[:, 1] - fit_matrix[:, 0])
+            return numpy.stack([exponential_trapz(fit_start + window.start * fit_step, fit_step, window.stop - window.start) for window in windows],
+                               axis=-1)
+        return super()._integrate_fits_over_windows(xs, yss, fs, windows)
+
+    def _fit_params(self, xs: numpy.ndarray, yss: numpy.ndarray) -> numpy.ndarray:
+        # the parameters are the coefficients of the scaled design matrix of the plan, which depend only on xs.
+        plan = fit_plan_cache.get_plan(PolynomialFitPlan, xs, self.deg, xs)
+        if self.weight:
+            return self.__fit_weighted_coefficients(plan, yss)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            transformed_yss = numpy.asarray(self.transform(yss) if self.transform else yss, dtype=numpy.float64)
+        return self.__fit_masked_coefficients(plan, transformed_yss, numpy.isfinite(transformed_yss))
+
+    def _evaluate_params(self, xs: numpy.ndarray, params: numpy.ndarray, fs: numpy.ndarray) -> numpy.ndarray:
+        untransform_data = self.untransform or (lambda x: x)
+        plan = fit_plan_cache.get_plan(PolynomialFitPlan, xs, self.deg, fs)
+        return untransform_data(numpy.dot(params, plan.scaled_evaluator.T))
+
+    def __get_fit_inputs(self, plan: PolynomialFitPlan, yss: numpy.ndarray) -> typing.Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        # return an (m, k) array and a (k, n) matrix whose product is the transformed fit evaluated at fs, and the (k) vector that
+        # maps the array to the integral of the transformed fit. for unweighted fits of valid data these are the transformed data,
+        # the plan fit matrix and integration vector; for weighted fits, or when any channel is invalid (e.g. non-positive counts for
+        # a log transform), they are the per-spectrum scaled coefficients, the scaled evaluator and the scaled evaluator integrals.
+        dtype = numpy.promote_types(yss.dtype, numpy.float32)
+        if self.weight:
+            return (self.__fit_weighted_coefficients(plan, yss).astype(dtype, copy=False), plan.get_matrix("scaled_evaluator", dtype).T,
+                    plan.scaled_evaluator_integrals)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            transformed_yss = self.transform(yss) if self.transform else yss
+        is_valid = numpy.isfinite(transformed_yss)
+        if numpy.all(is_valid):
+            return transformed_yss.astype(dtype, copy=False), plan.get_matrix("fit_matrix", dtype), plan.integration_vector
+        return (self.__fit_masked_coefficients(plan, transformed_yss, is_valid).astype(dtype, copy=False), plan.get_matrix("scaled_evaluator", dtype).T,
+                plan.scaled_evaluator_integrals)
+
+    def __fit_masked_coefficients(self, plan: PolynomialFitPlan, transformed_yss: numpy.ndarray, is_valid: numpy.ndarray) -> numpy.ndarray:
+        # fit spectra with invalid channels to their valid channels only, by solving their normal equations with zero weights on the
+        # invalid channels; the other spectra are projected directly. spectra with fewer valid channels than coefficients get nan.
+        valid_yss = numpy.where(is_valid, transformed_yss, 0)
+        coefficients = numpy.dot(valid_yss, plan.scaled_projector.T)
+        is_masked = ~numpy.all(is_valid, axis=-1)
+        coefficients[is_masked] = solve_weighted_normal_equations(plan.design, plan.design_products, is_valid[is_masked].astype(numpy.float64),
+                                                                  valid_yss[is_masked])
+        return coefficients
+
+    def __fit_weighted_coefficients(self, plan: PolynomialFitPlan, yss: numpy.ndarray) -> numpy.ndarray:
+        # solve the weighted normal equations of all spectra at once. spectra with fewer weighted channels than coefficients
+        # cannot be fit and get nan coefficients, which are flagged as invalid by the caller.
+        weights = numpy.asarray(self.weight(yss), dtype=numpy.float64)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            transformed_yss = numpy.where(weights > 0, self.transform(yss) if self.transform else yss, 0)
+        return solve_weighted_normal_equations(plan.design, plan.design_products, weights, transformed_yss)
 
     def __unused_perform_fit(self, xs: numpy.ndarray, ys: numpy.ndarray, fs: numpy.ndarray) -> numpy.ndarray:
         # here an an example of using numpy.polynomial.polynomial.Polynomial.fit for when it supports evaluating arrays
@@ -128,6 +1245,232 @@ class PolynomialBackgroundModel(AbstractBackgroundModel):
         return untransform_data(series(fs))
 
 
+class NonlinearPowerLawBackgroundModel(AbstractBackgroundModel):
+    # Fit a power law A * E ** -r by nonlinear least squares, which avoids the low count bias of fitting the log of the data.
+    # The fit is seeded from the log-log linear fit and refined with Levenberg-Marquardt steps applied to all spectra at once.
+
+    def __init__(self, background_model_id: str, title: str = None, max_iterations: int = 20, tolerance: float = 1E-6):
+        super().__init__(background_model_id, title)
+        self.max_iterations = max_iterations
+        self.tolerance = tolerance
+
+    def _perform_fits(self, xs: numpy.ndarray, yss: numpy.ndarray, fs: numpy.ndarray) -> numpy.ndarray:
+        x_reference = numpy.sqrt(numpy.amin(xs) * numpy.amax(xs))
+        amplitudes, exponents = self.__fit_params(xs, yss, x_reference)
+        dtype = numpy.promote_types(yss.dtype, numpy.float32)
+        log_fs = numpy.log(fs / x_reference).astype(dtype)
+        return numpy.exp(-exponents.astype(dtype)[:, numpy.newaxis] * log_fs) * amplitudes.astype(dtype)[:, numpy.newaxis]
+
+    def _integrate_fits(self, xs: numpy.ndarray, yss: numpy.ndarray, fs: numpy.ndarray) -> numpy.ndarray:
+        if len(fs) < 2:
+            return super()._integrate_fits(xs, yss, fs)
+        x_reference = numpy.sqrt(numpy.amin(xs) * numpy.amax(xs))
+        amplitudes, exponents = self.__fit_params(xs, yss, x_reference)
+        return power_law_integral(fs / x_reference, amplitudes, exponents)
+
+    def _integrate_fits_over_windows(self, xs: numpy.ndarray, yss: numpy.ndarray, fs: numpy.ndarray,
+                                     windows: typing.Sequence[slice]) -> numpy.ndarray:
+        x_reference = numpy.sqrt(numpy.amin(xs) * numpy.amax(xs))
+        amplitudes, exponents = self.__fit_params(xs, yss, x_reference)
+        return numpy.stack([power_law_integral(fs[window] / x_reference, amplitudes, exponents) if window.stop - window.start > 1
+                            else numpy.zeros(len(yss)) for window in windows], axis=-1)
+
+    def _fit_params(self, xs: numpy.ndarray, yss: numpy.ndarray) -> numpy.ndarray:
+        x_reference = numpy.sqrt(numpy.amin(xs) * numpy.amax(xs))
+        return numpy.stack(self.__fit_params(xs, yss, x_reference), axis=-1)
+
+    def _evaluate_params(self, xs: numpy.ndarray, params: numpy.ndarray, fs: numpy.ndarray) -> numpy.ndarray:
+        x_reference = numpy.sqrt(numpy.amin(xs) * numpy.amax(xs))
+        return power_law_func(fs[numpy.newaxis, :] / x_reference, params[:, 0:1], params[:, 1:2])
+
+    def __fit_params(self, xs: numpy.ndarray, yss: numpy.ndarray, x_reference: float) -> typing.Tuple[numpy.ndarray, numpy.ndarray]:
+        amplitudes, exponents, iterations, converged = power_law_least_squares_params(xs, yss, x_reference, self.max_iterations, self.tolerance)
+        # spectra whose fit did not converge within max_iterations get a nan amplitude, so they are masked invalid like failed fits.
+        return numpy.where(converged, amplitudes, numpy.nan), exponents
+
+
+def power_law_least_squares_params(xs: numpy.ndarray, yss: numpy.ndarray, x_reference: float, max_iterations: int = 20,
+                                   tolerance: float = 1E-6) -> typing.Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """Fit A * (x / x_reference) ** -r to each row of yss (m, L) sampled at xs (L) by nonlinear least squares.
+
+    The fit is seeded by a log-log linear fit over the positive channels of each row, then refined by Levenberg-Marquardt steps.
+    Each step solves the 2x2 damped normal equations of all active rows in closed form; rows converge and leave the active set
+    once an accepted parameter update falls below tolerance (relative) or their damping grows too large to make progress.
+
+    Returns the amplitudes A and exponents r with shape (m), the number of iterations taken by each row and a mask of the rows
+    that converged within max_iterations. Rows without positive data get a nan amplitude.
+    """
+    yss = numpy.asarray(yss, dtype=numpy.float64)
+    log_xs = numpy.log(xs / x_reference)
+    # seed the fit from the log-log linear fit, which excludes channels with non-positive counts.
+    design = numpy.stack([numpy.ones_like(log_xs), -log_xs], axis=-1)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        seed = solve_weighted_normal_equations(design, None, (yss > 0).astype(numpy.float64), numpy.where(yss > 0, numpy.log(yss), 0))
+    amplitudes = numpy.exp(seed[:, 0])
+    exponents = numpy.where(numpy.isfinite(seed[:, 1]), seed[:, 1], 0)
+    damping = numpy.full(len(yss), 1E-3)
+    iterations = numpy.zeros(len(yss), dtype=int)
+    converged = numpy.zeros(len(yss), dtype=bool)
+    sse = numpy.sum(numpy.square(yss - amplitudes[:, numpy.newaxis] * numpy.exp(-exponents[:, numpy.newaxis] * log_xs)), axis=-1)
+    active = numpy.isfinite(sse)
+    for _ in range(max_iterations):
+        indexes = numpy.flatnonzero(active)
+        if len(indexes) == 0:
+            break
+        ys = yss[indexes]
+        amplitude = amplitudes[indexes]
+        exponent = exponents[indexes]
+        damping_factor = 1 + damping[indexes]
+        basis = numpy.exp(-exponent[:, numpy.newaxis] * log_xs)
+        residuals = ys - amplitude[:, numpy.newaxis] * basis
+        # jacobian columns are the derivatives of the model with respect to the amplitude and the exponent.
+        jacobian_a = basis
+        jacobian_r = -amplitude[:, numpy.newaxis] * basis * log_xs
+        normal_aa = numpy.sum(jacobian_a * jacobian_a, axis=-1)
+        normal_ar = numpy.sum(jacobian_a * jacobian_r, axis=-1)
+        normal_rr = numpy.sum(jacobian_r * jacobian_r, axis=-1)
+        gradient_a = numpy.sum(jacobian_a * residuals, axis=-1)
+        gradient_r = numpy.sum(jacobian_r * residuals, axis=-1)
+        with numpy.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            determinant = normal_aa * normal_rr * damping_factor * damping_factor - normal_ar * normal_ar
+            delta_a = (normal_rr * damping_factor * gradient_a - normal_ar * gradient_r) / determinant
+            delta_r = (normal_aa * damping_factor * gradient_r - normal_ar * gradient_a) / determinant
+            new_amplitude = amplitude + delta_a
+            new_exponent = exponent + delta_r
+            new_sse = numpy.sum(numpy.square(ys - new_amplitude[:, numpy.newaxis] * numpy.exp(-new_exponent[:, numpy.newaxis] * log_xs)), axis=-1)
+        improved = new_sse < sse[indexes]
+        improved_indexes = indexes[improved]
+        amplitudes[improved_indexes] = new_amplitude[improved]
+        exponents[improved_indexes] = new_exponent[improved]
+        sse[improved_indexes] = new_sse[improved]
+        damping[indexes] = numpy.where(improved, damping[indexes] / 10, damping[indexes] * 10)
+        iterations[indexes] += 1
+        is_small_step = (numpy.abs(delta_r) <= tolerance * (1 + numpy.abs(exponent))) & (numpy.abs(delta_a) <= tolerance * numpy.abs(amplitude))
+        # a row whose damping has grown this large is at a minimum to within floating point precision.
+        is_done = (improved & is_small_step) | (damping[indexes] > 1E10)
+        converged[indexes[is_done]] = True
+        active[indexes[is_done]] = False
+    return amplitudes, exponents, iterations, converged
+
+
+class PowerLawCombinationFitPlan:
+    """Precomputed least squares solution for fitting nonnegative amplitudes of power laws with fixed exponents.
+
+    The design matrix of the power laws (x / x_reference) ** -r for each exponent r depends only on the fit x-values (xs), the
+    exponents and the x-values at which the fit is evaluated (fs), so a plan can be shared by every spectrum in a spectrum image.
+    Fitting m spectra is a single GEMM of the data with the (L, k) design matrix followed by a (k, k) solve of the normal equations.
+
+    The nonnegative solution is exact for two power laws: spectra whose unconstrained solution has a negative amplitude are fit with
+    the single power law that reduces the residual the most.
+    """
+
+    def __init__(self, xs: numpy.ndarray, exponents: numpy.ndarray, fs: numpy.ndarray):
+        self.x_reference = numpy.sqrt(numpy.amin(xs) * numpy.amax(xs))
+        self.design = numpy.power(xs[:, numpy.newaxis] / self.x_reference, -exponents)
+        self.design_norms = numpy.sum(self.design * self.design, axis=0)
+        self.gram_inverse = numpy.linalg.pinv(numpy.dot(self.design.T, self.design))
+        self.evaluator = numpy.power(fs[:, numpy.newaxis] / self.x_reference, -exponents)
+        self.evaluator_integrals = trapz_channels(self.evaluator.T)
+
+    def fit_amplitudes(self, yss: numpy.ndarray) -> numpy.ndarray:
+        # return the nonnegative amplitudes (m, k) of the power laws for each row of yss (m, L).
+        products = numpy.dot(yss, self.design.astype(yss.dtype, copy=False)).astype(numpy.float64)
+        amplitudes = numpy.dot(products, self.gram_inverse)
+        is_negative = numpy.any(amplitudes < 0, axis=-1)
+        if numpy.any(is_negative):
+            single_products = numpy.maximum(products[is_negative], 0)
+            best = numpy.argmax(single_products * single_products / self.design_norms, axis=-1)
+            single_amplitudes = numpy.zeros_like(single_products)
+            rows = numpy.arange(len(best))
+            single_amplitudes[rows, best] = single_products[rows, best] / self.design_norms[best]
+            amplitudes[is_negative] = single_amplitudes
+        return amplitudes
+
+
+class PowerLawCombinationBackgroundModel(AbstractBackgroundModel):
+    # Fit a linear combination of power laws (LCPL) with fixed exponents and nonnegative per-spectrum amplitudes.
+    # The exponents bracket the power law exponent of the sum spectrum of the data by exponent_spread, so each spectrum may follow a
+    # power law of varying local exponent while the fit stays linear. Unless fixed exponents are given, they are determined from
+    # all the data passed to fit_background_data or integrate_signal_data, or from the sum of yss when fitting directly.
+
+    def __init__(self, background_model_id: str, title: str = None, exponent_spread: float = 1.0,
+                 exponents: typing.Optional[typing.Sequence[float]] = None):
+        super().__init__(background_model_id, title)
+        self.exponent_spread = exponent_spread
+        self.exponents = exponents
+
+    def fit_background_data(self, data: numpy.ndarray, fit_slices: typing.Sequence[slice], xs: numpy.ndarray, fs: numpy.ndarray, *,
+                            chunk_size: typing.Optional[int] = None, **kwargs) -> numpy.ndarray:
+        model = self.__with_data_exponents(data, fit_slices, xs, chunk_size, kwargs.get("channel_offsets"))
+        return AbstractBackgroundModel.fit_background_data(model, data, fit_slices, xs, fs, chunk_size=chunk_size, **kwargs)
+
+    def integrate_signal_data(self, data: numpy.ndarray, fit_slices: typing.Sequence[slice], xs: numpy.ndarray, signal_slice: slice,
+                              fs: numpy.ndarray, *, chunk_size: typing.Optional[int] = None, **kwargs) -> numpy.ndarray:
+        model = self.__with_data_exponents(data, fit_slices, xs, chunk_size, kwargs.get("channel_offsets"))
+        return AbstractBackgroundModel.integrate_signal_data(model, data, fit_slices, xs, signal_slice, fs, chunk_size=chunk_size, **kwargs)
+
+    def integrate_signals_data(self, data: numpy.ndarray, fit_slices: typing.Sequence[slice], xs: numpy.ndarray, signal_slices: typing.Sequence[slice],
+                               fs: numpy.ndarray, *, chunk_size: typing.Optional[int] = None, **kwargs) -> numpy.ndarray:
+        model = self.__with_data_exponents(data, fit_slices, xs, chunk_size, kwargs.get("channel_offsets"))
+        return AbstractBackgroundModel.integrate_signals_data(model, data, fit_slices, xs, signal_slices, fs, chunk_size=chunk_size, **kwargs)
+
+    def fit_background_params(self, data: numpy.ndarray, fit_slices: typing.Sequence[slice], xs: numpy.ndarray, *,
+                              chunk_size: typing.Optional[int] = None, **kwargs) -> numpy.ndarray:
+        model = self.__with_data_exponents(data, fit_slices, xs, chunk_size, kwargs.get("channel_offsets"))
+        return AbstractBackgroundModel.fit_background_params(model, data, fit_slices, xs, chunk_size=chunk_size, **kwargs)
+
+    def get_exponents(self, xs: numpy.ndarray, sum_ys: numpy.ndarray) -> numpy.ndarray:
+        # return the fixed exponents for a sum spectrum sum_ys sampled at xs.
+        if self.exponents is not None:
+            return numpy.asarray(self.exponents, dtype=numpy.float64)
+        x_reference = numpy.sqrt(numpy.amin(xs) * numpy.amax(xs))
+        amplitudes, exponents, iterations, converged = power_law_least_squares_params(xs, sum_ys[numpy.newaxis, :], x_reference)
+        return exponents[0] + numpy.array([-0.5, 0.5]) * self.exponent_spread
+
+    def _perform_fits(self, xs: numpy.ndarray, yss: numpy.ndarray, fs: numpy.ndarray) -> numpy.ndarray:
+        plan = self.__get_plan(xs, yss, fs)
+        dtype = numpy.promote_types(yss.dtype, numpy.float32)
+        return numpy.dot(plan.fit_amplitudes(yss).astype(dtype), plan.evaluator.T.astype(dtype))
+
+    def _integrate_fits(self, xs: numpy.ndarray, yss: numpy.ndarray, fs: numpy.ndarray) -> numpy.ndarray:
+        plan = self.__get_plan(xs, yss, fs)
+        return numpy.dot(plan.fit_amplitudes(yss), plan.evaluator_integrals)
+
+    def _integrate_fits_over_windows(self, xs: numpy.ndarray, yss: numpy.ndarray, fs: numpy.ndarray,
+                                     windows: typing.Sequence[slice]) -> numpy.ndarray:
+        plan = self.__get_plan(xs, yss, fs)
+        return numpy.dot(plan.fit_amplitudes(yss), numpy.stack([trapz_channels(plan.evaluator[window].T) for window in windows], axis=-1))
+
+    def _fit_params(self, xs: numpy.ndarray, yss: numpy.ndarray) -> numpy.ndarray:
+        # the parameters are the amplitudes followed by the exponents, so they can be evaluated without the data exponents.
+        exponents = self.get_exponents(xs, numpy.nansum(yss, axis=0, dtype=numpy.float64))
+        plan = typing.cast(PowerLawCombinationFitPlan, fit_plan_cache.get_plan(PowerLawCombinationFitPlan, xs, exponents, xs))
+        amplitudes = plan.fit_amplitudes(yss)
+        return numpy.concatenate([amplitudes, numpy.broadcast_to(exponents, amplitudes.shape)], axis=-1)
+
+    def _evaluate_params(self, xs: numpy.ndarray, params: numpy.ndarray, fs: numpy.ndarray) -> numpy.ndarray:
+        x_reference = numpy.sqrt(numpy.amin(xs) * numpy.amax(xs))
+        amplitudes, exponents = numpy.split(params, 2, axis=-1)
+        return numpy.sum(power_law_func(fs / x_reference, amplitudes[..., numpy.newaxis], exponents[..., numpy.newaxis]), axis=-2)
+
+    def __get_plan(self, xs: numpy.ndarray, yss: numpy.ndarray, fs: numpy.ndarray) -> PowerLawCombinationFitPlan:
+        exponents = self.get_exponents(xs, numpy.nansum(yss, axis=0, dtype=numpy.float64))
+        return typing.cast(PowerLawCombinationFitPlan, fit_plan_cache.get_plan(PowerLawCombinationFitPlan, xs, exponents, fs))
+
+    def __with_data_exponents(self, data: numpy.ndarray, fit_slices: typing.Sequence[slice], xs: numpy.ndarray,
+                              chunk_size: typing.Optional[int], channel_offsets: typing.Optional[numpy.ndarray]) -> PowerLawCombinationBackgroundModel:
+        # return a copy of this model with the exponents fixed from the sum spectrum of the fit data, which is read in chunks.
+        if self.exponents is not None:
+            return self
+        sum_ys = numpy.zeros(len(xs))
+        for chunk in iterate_navigation_chunks(data.shape[:-1], chunk_size):
+            ys = gather_fit_data(data, chunk, fit_slices, None, channel_offsets)
+            sum_ys += numpy.nansum(numpy.reshape(ys, (-1, ys.shape[-1])), axis=0)
+        model = copy.copy(self)
+        model.exponents = tuple(self.get_exponents(xs, sum_ys))
+        return model
+
+
 class TwoAreaBackgroundModel(AbstractBackgroundModel):
     # Fit power law or exponential background model using the two-area method described in Egerton chapter 4.
     # This approximation is slightly faster than the polynomial fit for mapping large SI, and may perform better for high-noise spectra.
@@ -137,12 +1480,98 @@ class TwoAreaBackgroundModel(AbstractBackgroundModel):
                  params_func: typing.Callable[[numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray, float, float, float],
                                               typing.Tuple[numpy.ndarray, numpy.ndarray]],
                  model_func: typing.Callable[[numpy.ndarray, numpy.ndarray, numpy.ndarray], numpy.ndarray],
-                 title: str = None):
+                 title: str = None,
+                 integral_func: typing.Optional[typing.Callable[[numpy.ndarray, numpy.ndarray, numpy.ndarray], numpy.ndarray]] = None,
+                 window_params_func: typing.Optional[typing.Callable[..., typing.Tuple[numpy.ndarray, numpy.ndarray]]] = None,
+                 window_transform: typing.Optional[typing.Callable[[numpy.ndarray], numpy.ndarray]] = None):
+        # window_params_func computes the same parameters as params_func from a CumulativeSumTable of window_transform(data),
+        # which makes changing the fit interval O(1) per spectrum when fitting with cumulative_sums=True.
         super().__init__(background_model_id, title)
         self.model_func = model_func
         self.params_func = params_func
+        self.integral_func = integral_func
+        self.window_params_func = window_params_func
+        self.window_transform = window_transform
+
+    def fit_background_data(self, data: numpy.ndarray, fit_slices: typing.Sequence[slice], xs: numpy.ndarray, fs: numpy.ndarray, *,
+                            chunk_size: typing.Optional[int] = None, out: typing.Optional[numpy.ndarray] = None,
+                            workers: typing.Optional[int] = None, dtype: numpy.dtype = None, binning: int = 1, cumulative_sums: bool = False,
+                            validity: typing.Optional[numpy.ndarray] = None, data_version: typing.Any = None, **kwargs) -> numpy.ndarray:
+        # cumulative_sums computes the window areas from a cumulative sum table built once per data array (see CumulativeSumTable),
+        # which pays off when the intervals of a mapping are adjusted repeatedly on the same data. data_version identifies the contents
+        # of data for reusing its table (see CumulativeSumTableCache).
+        if not cumulative_sums or not self.window_params_func or len(fit_slices) != 1 or binning > 1 or kwargs.get("channel_offsets") is not None:
+            return super().fit_background_data(data, fit_slices, xs, fs, chunk_size=chunk_size, out=out, workers=workers, dtype=dtype,
+                                               binning=binning, validity=validity, **kwargs)
+        dtype = numpy.dtype(dtype or numpy.float64)
+        navigation_shape = tuple(data.shape[:-1])
+        if out is None:
+            out = numpy.empty(navigation_shape + fs.shape, dtype=dtype)
+        assert out.shape == navigation_shape + fs.shape
+        table = cumulative_sum_tables.get_table(data, self.window_transform, chunk_size, data_version)
+        for chunk in iterate_navigation_chunks(navigation_shape, chunk_size):
+            params = self.__window_params(table, chunk, fit_slices[0], xs)
+            fit_data = self.model_func(fs.astype(dtype)[numpy.newaxis, :], *[numpy.asarray(param, dtype=dtype)[..., numpy.newaxis] for param in params])
+            fit_data = numpy.reshape(fit_data, out[chunk].shape)
+            is_valid = mask_invalid(fit_data, fs.shape)
+            out[chunk] = fit_data
+            if validity is not None:
+                validity[chunk] = is_valid
+        return out
+
+    def integrate_signal_data(self, data: numpy.ndarray, fit_slices: typing.Sequence[slice], xs: numpy.ndarray, signal_slice: slice,
+                              fs: numpy.ndarray, *, chunk_size: typing.Optional[int] = None,
+                              out: typing.Optional[numpy.ndarray] = None, workers: typing.Optional[int] = None,
+                              dtype: numpy.dtype = None, binning: int = 1, cumulative_sums: bool = False,
+                              validity: typing.Optional[numpy.ndarray] = None, data_version: typing.Any = None, **kwargs) -> numpy.ndarray:
+        # cumulative_sums computes the window areas, and the signal sum if possible, from a cumulative sum table (see fit_background_data).
+        if (not cumulative_sums or not self.window_params_func or not self.integral_func or len(fit_slices) != 1 or len(fs) < 2 or binning > 1 or
+                kwargs.get("channel_offsets") is not None):
+            return super().integrate_signal_data(data, fit_slices, xs, signal_slice, fs, chunk_size=chunk_size, out=out, workers=workers,
+                                                 dtype=dtype, binning=binning, validity=validity, **kwargs)
+        navigation_shape = tuple(data.shape[:-1])
+        if out is None:
+            out = numpy.empty(navigation_shape)
+        assert out.shape == navigation_shape
+        table = cumulative_sum_tables.get_table(data, self.window_transform, chunk_size, data_version)
+        signal_table = table if not self.window_transform else None
+        for chunk in iterate_navigation_chunks(navigation_shape, chunk_size):
+            params = self.__window_params(table, chunk, fit_slices[0], xs)
+            signal_integrals = signal_table.window_trapz(chunk, signal_slice) if signal_table else trapz_channels(data[chunk + (signal_slice,)])
+            fit_integrals = numpy.reshape(self.integral_func(fs, *params), signal_integrals.shape)
+            is_valid = mask_invalid(fit_integrals)
+            out[chunk] = signal_integrals - fit_integrals
+            if validity is not None:
+                validity[chunk] = is_valid
+        return out
 
     def _perform_fits(self, xs: numpy.ndarray, yss: numpy.ndarray, fs: numpy.ndarray) -> numpy.ndarray:
+        # broadcast the parameters against fs rather than tiling fs, producing the (m, n) series directly in the dtype of yss.
+        params = self.__fit_params(xs, yss)
+        dtype = numpy.promote_types(yss.dtype, numpy.float32)
+        series = self.model_func(fs.astype(dtype)[numpy.newaxis, :], *[numpy.asarray(param, dtype=dtype)[..., numpy.newaxis] for param in params])
+        return typing.cast(numpy.ndarray, series)
+
+    def _integrate_fits(self, xs: numpy.ndarray, yss: numpy.ndarray, fs: numpy.ndarray) -> numpy.ndarray:
+        if self.integral_func and len(fs) > 1:
+            return self.integral_func(fs, *self.__fit_params(xs, yss))
+        return super()._integrate_fits(xs, yss, fs)
+
+    def _integrate_fits_over_windows(self, xs: numpy.ndarray, yss: numpy.ndarray, fs: numpy.ndarray,
+                                     windows: typing.Sequence[slice]) -> numpy.ndarray:
+        if not self.integral_func:
+            return super()._integrate_fits_over_windows(xs, yss, fs, windows)
+        params = self.__fit_params(xs, yss)
+        return numpy.stack([self.integral_func(fs[window], *params) if window.stop - window.start > 1 else numpy.zeros(len(yss))
+                            for window in windows], axis=-1)
+
+    def _fit_params(self, xs: numpy.ndarray, yss: numpy.ndarray) -> numpy.ndarray:
+        return numpy.stack([numpy.asarray(param, dtype=numpy.float64) for param in self.__fit_params(xs, yss)], axis=-1)
+
+    def _evaluate_params(self, xs: numpy.ndarray, params: numpy.ndarray, fs: numpy.ndarray) -> numpy.ndarray:
+        return self.model_func(fs[numpy.newaxis, :], *[params[:, i:i + 1] for i in range(params.shape[-1])])
+
+    def __fit_params(self, xs: numpy.ndarray, yss: numpy.ndarray) -> typing.Tuple[numpy.ndarray, numpy.ndarray]:
         half_interval = len(xs) // 2
         x_interval_1 = xs[:half_interval]
         x_interval_2 = xs[half_interval:2 * half_interval]
@@ -151,10 +1580,24 @@ class TwoAreaBackgroundModel(AbstractBackgroundModel):
         x_start = xs[0]
         x_center = xs[half_interval]
         x_end = xs[-1]
-        params = self.params_func(x_interval_1, x_interval_2, y_interval_1, y_interval_2, x_start, x_center, x_end)
-        xs_tiled = numpy.transpose(numpy.tile(fs, (len(yss), 1)))
-        series = typing.cast(typing.Any, numpy.transpose(self.model_func(xs_tiled, *params)))
-        return series
+        return self.params_func(x_interval_1, x_interval_2, y_interval_1, y_interval_2, x_start, x_center, x_end)
+
+    def __window_params(self, table: CumulativeSumTable, chunk: typing.Tuple, fit_slice: slice,
+                        xs: numpy.ndarray) -> typing.Tuple[numpy.ndarray, ...]:
+        # the same windows as __fit_params, for a single contiguous fit slice. returns flattened parameters for the chunk.
+        assert self.window_params_func
+        half_interval = len(xs) // 2
+        window_1 = slice(fit_slice.start, fit_slice.start + half_interval)
+        window_2 = slice(fit_slice.start + half_interval, fit_slice.start + 2 * half_interval)
+        x_step = (xs[-1] - xs[0]) / (len(xs) - 1)
+        params = self.window_params_func(table, chunk, window_1, window_2, x_step, xs[0], xs[half_interval], xs[-1])
+        return tuple(numpy.reshape(param, (-1,)) for param in params)
+
+
+def poisson_log_weights(yss: numpy.ndarray) -> numpy.ndarray:
+    # the variance of the log of Poisson distributed counts y is approximately 1 / y, so the weights are the counts themselves.
+    # non-finite channels get zero weight, so they are excluded rather than making the fit of the spectrum nan.
+    return numpy.where(numpy.isfinite(yss) & (yss > 0), yss, 0)
 
 
 def power_law_params(x_interval_1: numpy.ndarray,
@@ -166,6 +1609,27 @@ def power_law_params(x_interval_1: numpy.ndarray,
                      x_end: float) -> typing.Tuple[numpy.ndarray, numpy.ndarray]:
     areas_1 = typing.cast(numpy.ndarray, numpy.trapz(y_interval_1, x_interval_1, axis=1))
     areas_2 = typing.cast(numpy.ndarray, numpy.trapz(y_interval_2, x_interval_2, axis=1))
+    return power_law_area_params(areas_1, areas_2, x_start, x_center, x_end)
+
+
+def power_law_window_params(table: CumulativeSumTable,
+                            chunk: typing.Tuple,
+                            window_1: slice,
+                            window_2: slice,
+                            x_step: float,
+                            x_start: float,
+                            x_center: float,
+                            x_end: float) -> typing.Tuple[numpy.ndarray, numpy.ndarray]:
+    areas_1 = x_step * table.window_trapz(chunk, window_1)
+    areas_2 = x_step * table.window_trapz(chunk, window_2)
+    return power_law_area_params(areas_1, areas_2, x_start, x_center, x_end)
+
+
+def power_law_area_params(areas_1: numpy.ndarray,
+                          areas_2: numpy.ndarray,
+                          x_start: float,
+                          x_center: float,
+                          x_end: float) -> typing.Tuple[numpy.ndarray, numpy.ndarray]:
     r = 2 * (numpy.log(areas_1) - numpy.log(areas_2)) / (numpy.log(x_end) - numpy.log(x_start))
     k = 1 - r
     A = k * areas_2 / (x_end ** k - x_center ** k)
@@ -176,6 +1640,24 @@ def power_law_func(x: numpy.ndarray, A: numpy.ndarray, r: numpy.ndarray) -> nump
     return A * x ** -r
 
 
+def power_law_integral(x: numpy.ndarray, A: numpy.ndarray, r: numpy.ndarray) -> numpy.ndarray:
+    # the trapezoidal sum over the channels x in units of channels, matching the trapezoidal integral of the evaluated power law.
+    # it is the continuous integral from x[0] to x[-1] plus the Euler-Maclaurin corrections of the trapezoidal rule, which are
+    # exact to floating point precision for the smooth power law when x[0] is at least a few channels from the origin.
+    step = (x[-1] - x[0]) / (len(x) - 1)
+    k = 1 - r
+    is_log = numpy.abs(k) < 1E-12
+    safe_k = numpy.where(is_log, 1, k)
+    integral = numpy.where(is_log, A * (numpy.log(x[-1]) - numpy.log(x[0])), A * (x[-1] ** safe_k - x[0] ** safe_k) / safe_k)
+    # the odd derivatives of A * x ** -r are -A * r (r + 1) ... (r + 2 j) * x ** -(r + 2 j + 1).
+    derivative_factors = -A * r
+    for order, coefficient in enumerate((1 / 12, -1 / 720, 1 / 30240, -1 / 1209600)):
+        if order > 0:
+            derivative_factors = derivative_factors * (r + 2 * order - 1) * (r + 2 * order)
+        integral = integral + coefficient * step ** (2 * order + 2) * derivative_factors * (x[-1] ** (-r - 2 * order - 1) - x[0] ** (-r - 2 * order - 1))
+    return integral / step
+
+
 def exponential_params(x_interval_1: numpy.ndarray,
                        x_interval_2: numpy.ndarray,
                        y_interval_1: numpy.ndarray,
@@ -185,8 +1667,30 @@ def exponential_params(x_interval_1: numpy.ndarray,
                        x_end: float) -> typing.Tuple[numpy.ndarray, numpy.ndarray]:
     y_log_1 = numpy.log(y_interval_1)
     y_log_2 = numpy.log(y_interval_2)
-    geo_mean_1 = numpy.exp(numpy.mean(y_log_1))
-    geo_mean_2 = numpy.exp(numpy.mean(y_log_2))
+    return exponential_log_mean_params(numpy.mean(y_log_1, axis=-1), numpy.mean(y_log_2, axis=-1), x_start, x_center, x_end)
+
+
+def exponential_window_params(table: CumulativeSumTable,
+                              chunk: typing.Tuple,
+                              window_1: slice,
+                              window_2: slice,
+                              x_step: float,
+                              x_start: float,
+                              x_center: float,
+                              x_end: float) -> typing.Tuple[numpy.ndarray, numpy.ndarray]:
+    # table holds cumulative sums of the log of the data.
+    log_means_1 = table.window_sums(chunk, window_1) / (window_1.stop - window_1.start)
+    log_means_2 = table.window_sums(chunk, window_2) / (window_2.stop - window_2.start)
+    return exponential_log_mean_params(log_means_1, log_means_2, x_start, x_center, x_end)
+
+
+def exponential_log_mean_params(log_means_1: numpy.ndarray,
+                                log_means_2: numpy.ndarray,
+                                x_start: float,
+                                x_center: float,
+                                x_end: float) -> typing.Tuple[numpy.ndarray, numpy.ndarray]:
+    geo_mean_1 = numpy.exp(log_means_1)
+    geo_mean_2 = numpy.exp(log_means_2)
     x1 = (x_start + x_center) / 2
     x2 = (x_center + x_end) / 2
     A = numpy.exp((numpy.log(geo_mean_1) - (x1 / x2) * numpy.log(geo_mean_2)) / (1 - x1 / x2))
@@ -198,6 +1702,11 @@ def exponential_func(x: numpy.ndarray, A: numpy.ndarray, tau: numpy.ndarray) ->
     return A * numpy.exp(-x / tau)
 
 
+def exponential_integral(x: numpy.ndarray, A: numpy.ndarray, tau: numpy.ndarray) -> numpy.ndarray:
+    step = (x[-1] - x[0]) / (len(x) - 1)
+    return exponential_trapz(numpy.log(A) - x[0] / tau, -step / tau, len(x))
+
+
 # register background models with the registry.
 Registry.register_component(PolynomialBackgroundModel("constant_background_model", 0,
                                                       title=_("Constant Background")), {"background-model"})
@@ -214,8 +1723,25 @@ Registry.register_component(PolynomialBackgroundModel("poly2_background_model",
 Registry.register_component(PolynomialBackgroundModel("poly2_log_background_model", 2, transform=numpy.log, untransform=numpy.exp,
                                                       title=_("2nd Order Power Law Background")), {"background-model"})
 
+Registry.register_component(PolynomialBackgroundModel("power_law_weighted_background_model", 1, transform=numpy.log, untransform=numpy.exp,
+                                                      weight=poisson_log_weights, title=_("Power Law Background (Poisson Weighted)")),
+                            {"background-model"})
+
+Registry.register_component(PolynomialBackgroundModel("poly2_log_weighted_background_model", 2, transform=numpy.log, untransform=numpy.exp,
+                                                      weight=poisson_log_weights, title=_("2nd Order Power Law Background (Poisson Weighted)")),
+                            {"background-model"})
+
+Registry.register_component(NonlinearPowerLawBackgroundModel("power_law_nonlinear_background_model", title=_("Power Law Background (Nonlinear Fit)")),
+                            {"background-model"})
+
+Registry.register_component(PowerLawCombinationBackgroundModel("power_law_lcpl_background_model",
+                                                               title=_("Power Law Background (Linear Combination of Power Laws)")),
+                            {"background-model"})
+
 Registry.register_component(TwoAreaBackgroundModel("power_law_two_area_background_model", params_func=power_law_params, model_func=power_law_func,
+                                                   integral_func=power_law_integral, window_params_func=power_law_window_params,
                                                    title=_("Power Law Two Area Background")), {"background-model"})
 
 Registry.register_component(TwoAreaBackgroundModel("exponential_two_area_background_model", params_func=exponential_params, model_func=exponential_func,
+                                                   integral_func=exponential_integral, window_params_func=exponential_window_params, window_transform=numpy.log,
                                                    title=_("Exponential Two Area Background")), {"background-model"})
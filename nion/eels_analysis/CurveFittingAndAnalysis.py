@@ -4,8 +4,155 @@
     A library of classes and functions for general curve fitting and analysis techniques applied to arrays of spectra.
 """
 
+import collections
+import hashlib
+import threading
+import typing
+
 import numpy
 
+
+class FitMatrixCache:
+    """A thread safe cache of the normalized model curves and fit matrices of MultipleCurveFit, with least recently used eviction.
+
+    Entries are keyed by the shape, dtype and content digest of the model curves, so fits constructed repeatedly for the same model,
+    e.g. polynomial background fits when mapping on an unchanged energy axis, skip the singular value decomposition entirely.
+    The cached arrays are shared by every fit with the same model curves and are read-only.
+    """
+
+    def __init__(self, max_count: int):
+        self.max_count = max_count
+        self._entries = collections.OrderedDict()
+        self._lock = threading.RLock()
+
+    def get_fit_matrices(self, model_curves: numpy.ndarray) -> tuple:
+        """Return the model RMS values, normalized model curves, normalized model integrals and normalized fit matrix for model_curves.
+        """
+        model_curves = numpy.ascontiguousarray(model_curves)
+        key = (model_curves.shape, model_curves.dtype.str, hashlib.sha256(model_curves.data.cast('B')).digest())
+        with self._lock:
+            fit_matrices = self._entries.pop(key, None)
+            if fit_matrices is None:
+                fit_matrices = _compute_fit_matrices(model_curves)
+                for fit_matrix in fit_matrices:
+                    fit_matrix.flags.writeable = False
+            self._entries[key] = fit_matrices
+            while len(self._entries) > self.max_count:
+                self._entries.popitem(last = False)
+            return fit_matrices
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def _compute_fit_matrices(model_curves: numpy.ndarray) -> typing.Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    sample_count = model_curves.shape[-1]
+
+    # Determine the RMS value of each model curve and normalize by this factor to help ensure a well-conditioned solution matrix
+    # Note that a model curve with RMS value 0 is meaningless and results in a failed assertion
+    model_rms_values = numpy.sqrt(numpy.sum(numpy.square(model_curves), -1, keepdims = True) / sample_count)
+    assert numpy.amin(model_rms_values) > 0
+    normalized_model_curves = model_curves / model_rms_values
+    normalized_model_integrals = normalized_model_curves.sum(-1, keepdims = True)
+
+    # Generate singular value decomposition of normalized model curve matrix
+    u, s, v = numpy.linalg.svd(normalized_model_curves.T, full_matrices = False)
+
+    # Invert singular values, zeroing out any that are smaller than 1e-6 times the largest to yield a well-conditioned fit matrix
+    s_min = 1e-6 * numpy.amax(s)
+    s_inv = numpy.zeros_like(s)
+    s_inv[s > s_min] = 1 / s[s > s_min]
+
+    # Generate normalized fit matrix, i.e. the pseudo-inverse V S^-1 U^T, where numpy.linalg.svd returns V transposed
+    normalized_fit_matrix = numpy.dot(v.T, numpy.dot(numpy.diag(s_inv), u.T))
+    return model_rms_values, normalized_model_curves, normalized_model_integrals, normalized_fit_matrix
+
+
+fit_matrix_cache = FitMatrixCache(16)
+
+
+def floating_point_type(dtype: numpy.dtype) -> numpy.dtype:
+    """Returns the floating point type in which data of dtype is fit and returned, e.g. by SignalExtractionPlan.
+
+    Single and double precision data keep their type, while integer detector counts and half precision data are converted to the
+    smallest floating point type that represents them (float32 up to 16 bit integers and for float16, float64 for wider integers).
+    Only the working buffers of the fits are converted, so the data itself (e.g. a numpy.memmap) stays in its compact native type.
+    """
+    return numpy.result_type(dtype, numpy.float32)
+
+
+def solve_nonnegative_least_squares(normal_matrices: numpy.ndarray, normal_vectors: numpy.ndarray, tolerance: float = 1e-10,
+                                    max_iterations: typing.Optional[int] = None) -> tuple:
+    """Solves many nonnegative least squares problems, given by their normal equations, at once.
+
+    normal_matrices - (k, k) normal matrix shared by all problems, or (m, k, k) array with one normal matrix per problem
+    normal_vectors - (m, k) array with one normal vector (model curves dotted with data curve) per problem
+
+    This is the Lawson-Hanson active set method applied to all problems together: each iteration frees the constrained coefficient
+    with the largest gradient in every problem that has one above tolerance (relative to the largest normal vector entry), then
+    solves the normal equations restricted to the free coefficients of all those problems with one batched solve, stepping back
+    towards the previous solution wherever a free coefficient would become negative. Problems stop iterating independently.
+
+    Returns the nonnegative coefficients with shape (m, k) and the number of iterations taken by each problem, at most max_iterations
+    (3 * k by default). Problems with non-finite inputs get NaN coefficients.
+    """
+    problem_count, model_count = normal_vectors.shape
+    if max_iterations is None:
+        max_iterations = 3 * model_count
+    normal_matrices = numpy.broadcast_to(normal_matrices, (problem_count, model_count, model_count))
+    is_finite = numpy.all(numpy.isfinite(normal_vectors), -1) & numpy.all(numpy.isfinite(normal_matrices), (-2, -1))
+    normal_vectors = numpy.where(is_finite[:, numpy.newaxis], normal_vectors, 0)
+    normal_matrices = numpy.where(is_finite[:, numpy.newaxis, numpy.newaxis], normal_matrices, numpy.eye(model_count))
+    thresholds = tolerance * numpy.amax(numpy.abs(normal_vectors), -1)
+    identity = numpy.eye(model_count, dtype = bool)
+
+    def solve_free_coefficients(problems: numpy.ndarray, is_free: numpy.ndarray) -> numpy.ndarray:
+        # Solve the normal equations of the free coefficients, with the constrained coefficients fixed at 0 via identity rows
+        is_free_pair = is_free[:, :, numpy.newaxis] & is_free[:, numpy.newaxis, :]
+        restricted_matrices = numpy.where(is_free_pair, normal_matrices[problems], 0) + identity * ~is_free[:, numpy.newaxis, :]
+        restricted_vectors = numpy.where(is_free, normal_vectors[problems], 0)
+        return numpy.einsum('mij, mj -> mi', numpy.linalg.pinv(restricted_matrices), restricted_vectors)
+
+    coefficients = numpy.zeros((problem_count, model_count))
+    is_free = numpy.zeros((problem_count, model_count), dtype = bool)
+    iteration_counts = numpy.zeros(problem_count, dtype = int)
+    gradients = normal_vectors.copy()
+    for iteration in range(max_iterations):
+        can_free = ~is_free & (gradients > thresholds[:, numpy.newaxis])
+        problems = numpy.flatnonzero(numpy.any(can_free, -1))
+        if problems.size == 0:
+            break
+        iteration_counts[problems] += 1
+        freed_index = numpy.argmax(numpy.where(can_free[problems], gradients[problems], -numpy.inf), -1)
+        is_free[problems, freed_index] = True
+        solutions = solve_free_coefficients(problems, is_free[problems])
+        for step in range(model_count):
+            is_negative = is_free[problems] & (solutions <= 0)
+            stepping = numpy.any(is_negative, -1)
+            if not numpy.any(stepping):
+                break
+            # Step from the previous solution towards the new one until the first free coefficient reaches 0, and constrain it
+            stepping_problems = problems[stepping]
+            previous = coefficients[stepping_problems]
+            with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+                step_ratios = numpy.where(is_negative[stepping], previous / (previous - solutions[stepping]), numpy.inf)
+            constrained_index = numpy.argmin(step_ratios, -1)
+            step_sizes = step_ratios[numpy.arange(stepping_problems.size), constrained_index]
+            previous = previous + step_sizes[:, numpy.newaxis] * (solutions[stepping] - previous)
+            is_free[stepping_problems, constrained_index] = False
+            is_free[stepping_problems] &= previous > 0
+            coefficients[stepping_problems] = numpy.where(is_free[stepping_problems], previous, 0)
+            solutions[stepping] = solve_free_coefficients(stepping_problems, is_free[stepping_problems])
+        coefficients[problems] = numpy.where(is_free[problems], solutions, 0)
+        gradients[problems] = normal_vectors[problems] - numpy.einsum('mij, mj -> mi', normal_matrices[problems], coefficients[problems])
+    coefficients[~is_finite] = numpy.nan
+    return coefficients, iteration_counts
+
+
 class MultipleCurveFit:
     """A class for performing multiple linear regression on arrays of 1D data (i.e. curves or spectra).
 
@@ -17,11 +164,22 @@ class MultipleCurveFit:
     In order to ensure a well-conditioned fit matrix, each model curve is normalized so that its RMS value is 1.  The inverse scaling factors
     are applied to any fit-coefficient vector returned for external use (see below).
 
+    The normalized model curves and fit matrix are memoized by fit_matrix_cache (see FitMatrixCache), so constructing a fit for
+    model curves that have been fit recently does not repeat the decomposition.
+
     The fit for a given input data set is generated via the compute_fit_for_data function, which updates the normalized fit coefficients array.
+    Invalid data samples (e.g. the log of non-positive counts) can be excluded from the fit of their curve via a validity mask.
     The fit object can then be queried for specific fit results via the following methods:
         get_fit_coefficients - fit coefficient array (with respect to original, non-normalized model curves)
         get_fit_integrals - fit integral array (e.g. edge count line profiles and maps)
         get_fit_curves - fit curve array (for direct comparison with input data curves)
+        get_fit_validity - boolean array that is False for curves with too few valid samples to be fit (with NaN fit results)
+        get_fit_iteration_counts - number of nonnegative fit iterations of each curve (0 unless fit with nonnegative coefficients)
+        get_fit_statistics - chi-square (sum of squared residuals), reduced chi-square (per degree of freedom) and R^2 arrays of the
+                             fits over their valid samples (only if computed, see compute_fit_for_data)
+
+    For data sets larger than memory (e.g. memmapped spectrum images), compute_fit_for_data_in_chunks streams the data in chunks of
+    curves and writes the fit coefficients, integrals and optionally curves into preallocated output arrays instead.
     """
 
     def __init__(self, model_curves: numpy.ndarray):
@@ -31,35 +189,197 @@ class MultipleCurveFit:
         assert model_curves.ndim == 2
         self.sample_count = model_curves.shape[-1]
 
-        # Determine the RMS value of each model curve and normalize by this factor to help ensure a well-conditioned solution matrix
-        # Note that a model curve with RMS value 0 is meaningless and results in a failed assertion
-        self._model_rms_values = numpy.sqrt(numpy.sum(numpy.square(model_curves), -1, keepdims = True) / self.sample_count)
-        assert numpy.amin(self._model_rms_values) > 0
-        self._normalized_model_curves = model_curves / self._model_rms_values
-        self._normalized_model_integrals = self._normalized_model_curves.sum(-1, keepdims = True)
-
-        # Generate singular value decomposition of normalized model curve matrix
-        u, s, v = numpy.linalg.svd(self._normalized_model_curves.T, full_matrices = False)
-
-        # Invert singular values, zeroing out any that are smaller than 1e-6 times the largest to yield a well-conditioned fit matrix
-        s_min = 1e-6 * numpy.amax(s)
-        s_inv = numpy.zeros_like(s)
-        s_inv[s > s_min] = 1 / s[s > s_min]
-
-        # Generate normalized fit matrix
-        self._normalized_fit_matrix = numpy.dot(v, numpy.dot(numpy.diag(s_inv), u.T))
+        # Normalize the model curves by their RMS values and generate the normalized fit matrix via SVD, or reuse them from the cache
+        (self._model_rms_values, self._normalized_model_curves, self._normalized_model_integrals,
+         self._normalized_fit_matrix) = fit_matrix_cache.get_fit_matrices(model_curves)
 
         # Track whether a fit has been computed for a specific data set
         self._have_computed_fit_for_data = False
 
-    def compute_fit_for_data(self, data_values: numpy.ndarray) -> numpy.ndarray:
+    def compute_fit_for_data(self, data_values: numpy.ndarray, valid_values: typing.Optional[numpy.ndarray] = None, nonnegative: bool = False,
+                             tolerance: float = 1e-10, max_iterations: typing.Optional[int] = None, compute_statistics: bool = False) -> numpy.ndarray:
         """
             data_values - array of 1D data curves (single spectrum, line scan, or area scan), at x values matching those of the model curves.
+            valid_values - optional boolean array with the shape of data_values that is False for samples to be excluded from the fit.
+                           Excluded samples may have any value, including NaN or infinity.
+            nonnegative - pass True to constrain all fit coefficients to be nonnegative (e.g. reference spectrum amplitudes).
+                           Curves whose unconstrained fit has a negative coefficient are refit with solve_nonnegative_least_squares,
+                           using tolerance and max_iterations; get_fit_iteration_counts returns the iterations taken per curve.
+            compute_statistics - pass True to also compute the goodness of fit of each curve, as returned by get_fit_statistics.
         """
         assert data_values.shape[-1] == self.sample_count
-        self._normalized_fit_coefficients = numpy.einsum('ij, ...j', self._normalized_fit_matrix, data_values)
+        assert valid_values is None or valid_values.shape == data_values.shape
+        self._normalized_fit_coefficients, self._fit_iteration_counts = self._compute_normalized_fit_coefficients(
+            data_values, valid_values, nonnegative, tolerance, max_iterations)
+        self._fit_statistics = None
+        if compute_statistics:
+            self._fit_statistics = self._compute_fit_statistics(data_values, valid_values, self._normalized_fit_coefficients)
         self._have_computed_fit_for_data = True
 
+    def compute_fit_for_data_in_chunks(self, data_values: numpy.ndarray, valid_values: typing.Optional[numpy.ndarray] = None,
+                                       chunk_size: typing.Optional[int] = None,
+                                       coefficients_out: typing.Optional[numpy.ndarray] = None, integrals_out: typing.Optional[numpy.ndarray] = None,
+                                       curves_out: typing.Optional[numpy.ndarray] = None, transform: typing.Optional[typing.Callable] = None,
+                                       residuals_out: typing.Optional[numpy.ndarray] = None, nonnegative: bool = False, tolerance: float = 1e-10,
+                                       max_iterations: typing.Optional[int] = None, iteration_counts_out: typing.Optional[numpy.ndarray] = None,
+                                       chi_squares_out: typing.Optional[numpy.ndarray] = None, reduced_chi_squares_out: typing.Optional[numpy.ndarray] = None,
+                                       r_squares_out: typing.Optional[numpy.ndarray] = None) -> tuple:
+        """
+            data_values - array of 1D data curves at x values matching those of the model curves, e.g. a numpy.memmap of a spectrum image.
+            valid_values - optional boolean array with the shape of data_values that is False for samples to be excluded from the fit.
+            chunk_size - maximum number of curves fit at once; chunks are whole rows of the first array dimension (at least one row).
+            coefficients_out, integrals_out, curves_out - optional output arrays (e.g. numpy.memmap) with the data array shape
+                           and a last dimension of the model curve count, without the last dimension, and with the data array shape.
+            transform - optional function applied to each chunk of data values before fitting, e.g. numpy.log. Samples that it maps
+                           to non-finite values are excluded from the fit.
+            residuals_out - optional output array with the data array shape without the last dimension, which receives the RMS
+                           residual of each fit over its valid samples.
+            nonnegative, tolerance, max_iterations - nonnegative fit options, as for compute_fit_for_data.
+            iteration_counts_out - optional output array with the data array shape without the last dimension, which receives the
+                           number of nonnegative fit iterations of each curve.
+            chi_squares_out, reduced_chi_squares_out, r_squares_out - optional output arrays with the data array shape without the last
+                           dimension, which receive the goodness of fit of each curve (see get_fit_statistics).
+
+        Returns the fit coefficients (with respect to the original model curves), fit integrals, fit curves and fit residuals (None
+        unless curves_out or residuals_out is supplied, respectively). Only one chunk of data and fit temporaries is held in memory at a
+        time; the results are not kept on the fit object, so the get_fit methods do not apply to them.
+        """
+        assert data_values.shape[-1] == self.sample_count
+        model_count = self._normalized_model_curves.shape[0]
+        navigation_shape = data_values.shape[:-1]
+        if coefficients_out is None:
+            coefficients_out = numpy.empty(navigation_shape + (model_count,))
+        if integrals_out is None:
+            integrals_out = numpy.empty(navigation_shape)
+        assert coefficients_out.shape == navigation_shape + (model_count,)
+        assert integrals_out.shape == navigation_shape
+        assert curves_out is None or curves_out.shape == data_values.shape
+        assert residuals_out is None or residuals_out.shape == navigation_shape
+        statistics_outs = (chi_squares_out, reduced_chi_squares_out, r_squares_out)
+        assert all(statistics_out is None or statistics_out.shape == navigation_shape for statistics_out in statistics_outs)
+        if navigation_shape:
+            row_size = max(1, int(numpy.prod(navigation_shape[1:], dtype = numpy.int64)))
+            row_step = max(1, (chunk_size or navigation_shape[0] * row_size) // row_size)
+            chunks = [(slice(start, start + row_step),) for start in range(0, navigation_shape[0], row_step)]
+        else:
+            chunks = [()]
+        for chunk in chunks:
+            chunk_values = numpy.asarray(data_values[chunk], dtype = floating_point_type(data_values.dtype))
+            chunk_valid_values = None if valid_values is None else valid_values[chunk]
+            if transform is not None:
+                with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+                    chunk_values = transform(chunk_values)
+                is_finite = numpy.isfinite(chunk_values)
+                chunk_valid_values = is_finite if chunk_valid_values is None else chunk_valid_values & is_finite
+            normalized_fit_coefficients, iteration_counts = self._compute_normalized_fit_coefficients(
+                chunk_values, chunk_valid_values, nonnegative, tolerance, max_iterations)
+            if iteration_counts_out is not None:
+                iteration_counts_out[chunk] = iteration_counts
+            if any(statistics_out is not None for statistics_out in statistics_outs):
+                fit_statistics = self._compute_fit_statistics(chunk_values, chunk_valid_values, normalized_fit_coefficients)
+                for statistics_out, statistics in zip(statistics_outs, fit_statistics):
+                    if statistics_out is not None:
+                        statistics_out[chunk] = statistics
+            coefficients_out[chunk] = normalized_fit_coefficients / self._model_rms_values.T
+            integrals_out[chunk] = numpy.einsum('i, ...i', self._normalized_model_integrals[:, 0], normalized_fit_coefficients)
+            if curves_out is not None or residuals_out is not None:
+                fit_curves = numpy.einsum('ij, ...i', self._normalized_model_curves, normalized_fit_coefficients)
+                if curves_out is not None:
+                    curves_out[chunk] = fit_curves
+                if residuals_out is not None:
+                    squared_residuals = numpy.square(chunk_values - fit_curves)
+                    if chunk_valid_values is None:
+                        residuals_out[chunk] = numpy.sqrt(numpy.mean(squared_residuals, -1))
+                    else:
+                        with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+                            residuals_out[chunk] = numpy.sqrt(numpy.sum(numpy.where(chunk_valid_values, squared_residuals, 0), -1) /
+                                                              numpy.count_nonzero(chunk_valid_values, -1))
+        return coefficients_out, integrals_out, curves_out, residuals_out
+
+    def _compute_normalized_fit_coefficients(self, data_values: numpy.ndarray, valid_values: typing.Optional[numpy.ndarray], nonnegative: bool,
+                                             tolerance: float, max_iterations: typing.Optional[int]) -> tuple:
+        """Compute normalized fit coefficients and nonnegative fit iteration counts, excluding invalid samples if valid_values is given.
+        """
+        if valid_values is None or numpy.all(valid_values):
+            valid_values = None
+            fit_coefficients = numpy.einsum('ij, ...j', self._normalized_fit_matrix, data_values)
+        else:
+            fit_coefficients = self._compute_masked_fit_coefficients(data_values, valid_values)
+        iteration_counts = numpy.zeros(fit_coefficients.shape[:-1], dtype = int)
+        if nonnegative:
+            # Only curves whose unconstrained fit has a negative coefficient need to be refit
+            is_negative = numpy.any(fit_coefficients < 0, -1)
+            if numpy.any(is_negative):
+                model_curves = self._normalized_model_curves
+                if valid_values is None:
+                    normal_matrices = numpy.dot(model_curves, model_curves.T)
+                    normal_vectors = numpy.einsum('ij, mj -> mi', model_curves, data_values[is_negative])
+                else:
+                    weights = valid_values[is_negative].astype(numpy.float64)
+                    normal_matrices = numpy.einsum('ij, kj, mj -> mik', model_curves, model_curves, weights)
+                    normal_vectors = numpy.einsum('ij, mj -> mi', model_curves, numpy.where(valid_values[is_negative], data_values[is_negative], 0))
+                fit_coefficients[is_negative], iteration_counts[is_negative] = solve_nonnegative_least_squares(
+                    normal_matrices, normal_vectors, tolerance, max_iterations)
+        return fit_coefficients, iteration_counts
+
+    def _compute_fit_statistics(self, data_values: numpy.ndarray, valid_values: typing.Optional[numpy.ndarray],
+                                normalized_fit_coefficients: numpy.ndarray) -> typing.Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        """Compute the chi-square, reduced chi-square and R^2 of each fit over its valid samples, without evaluating the fit curves.
+
+        The sum of squared residuals is |y|^2 - 2 c^T b + c^T G c for data curve y, normalized fit coefficients c, normal vector
+        b = A y and normal matrix G = A A^T of the normalized model curves A (over the valid samples of each curve). For least squares
+        (and nonnegative least squares) fits, c^T b = c^T G c and this is the squared norm of the data curve minus that of its projection,
+        but the expanded form stays accurate for coefficients from single precision fit matrices.
+        """
+        model_curves = self._normalized_model_curves.astype(numpy.float64)
+        model_count = model_curves.shape[0]
+        if valid_values is not None and numpy.all(valid_values):
+            valid_values = None
+        if valid_values is None:
+            masked_values = data_values
+            sample_counts = numpy.full(data_values.shape[:-1], self.sample_count)
+        else:
+            masked_values = numpy.where(valid_values, data_values, 0)
+            sample_counts = numpy.count_nonzero(valid_values, -1)
+        # Accumulate in float64, so that integer data does not overflow
+        squared_norms = numpy.einsum('...j, ...j', masked_values, masked_values, dtype = numpy.float64)
+        sums = numpy.sum(masked_values, -1, dtype = numpy.float64)
+        fitted_products = numpy.einsum('...i, ij, ...j', normalized_fit_coefficients, model_curves, masked_values)
+        projected_squared_norms = numpy.einsum('...i, ij, ...j', normalized_fit_coefficients, numpy.dot(model_curves, model_curves.T),
+                                               normalized_fit_coefficients)
+        if valid_values is not None:
+            is_masked = ~numpy.all(valid_values, -1)
+            if numpy.any(is_masked):
+                weights = valid_values[is_masked].astype(numpy.float64)
+                normal_matrices = numpy.einsum('ij, kj, mj -> mik', model_curves, model_curves, weights)
+                masked_coefficients = normalized_fit_coefficients[is_masked]
+                projected_squared_norms[is_masked] = numpy.einsum('mi, mij, mj -> m', masked_coefficients, normal_matrices, masked_coefficients)
+        # Rounding may leave a small negative difference for curves that are fit exactly
+        chi_squares = numpy.maximum(squared_norms - 2 * fitted_products + projected_squared_norms, 0)
+        with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+            reduced_chi_squares = numpy.where(sample_counts > model_count, chi_squares / (sample_counts - model_count), numpy.nan)
+            r_squares = 1 - chi_squares / (squared_norms - numpy.square(sums) / sample_counts)
+        return chi_squares, reduced_chi_squares, r_squares
+
+    def _compute_masked_fit_coefficients(self, data_values: numpy.ndarray, valid_values: numpy.ndarray) -> numpy.ndarray:
+        """Compute normalized fit coefficients using only the valid samples of each curve.
+
+        Curves with all samples valid are fit with the fit matrix. The others are fit by solving their normal equations, weighting the
+        invalid samples by zero, in one batched solve over just those curves. Curves with fewer valid samples than model curves get NaN.
+        """
+        model_count = self._normalized_model_curves.shape[0]
+        masked_values = numpy.where(valid_values, data_values, 0)
+        fit_coefficients = numpy.einsum('ij, ...j', self._normalized_fit_matrix, masked_values)
+        is_masked = ~numpy.all(valid_values, -1)
+        if numpy.any(is_masked):
+            weights = valid_values[is_masked].astype(numpy.float64)
+            normal_matrices = numpy.einsum('ij, kj, mj -> mik', self._normalized_model_curves, self._normalized_model_curves, weights)
+            normal_vectors = numpy.einsum('ij, mj -> mi', self._normalized_model_curves, masked_values[is_masked])
+            masked_coefficients = numpy.einsum('mij, mj -> mi', numpy.linalg.pinv(normal_matrices, rcond = 1e-12), normal_vectors)
+            masked_coefficients[numpy.count_nonzero(weights, -1) < model_count] = numpy.nan
+            fit_coefficients[is_masked] = masked_coefficients
+        return fit_coefficients
+
     def get_fit_coefficients(self) -> numpy.ndarray:
         assert self._have_computed_fit_for_data
         fit_coefficients = self._normalized_fit_coefficients / self._model_rms_values.T
@@ -75,6 +395,27 @@ class MultipleCurveFit:
         fit_curves = numpy.einsum('ij, ...i', self._normalized_model_curves, self._normalized_fit_coefficients)
         return fit_curves
 
+    def get_fit_validity(self) -> numpy.ndarray:
+        assert self._have_computed_fit_for_data
+        fit_validity = numpy.all(numpy.isfinite(self._normalized_fit_coefficients), -1)
+        return fit_validity
+
+    def get_fit_iteration_counts(self) -> numpy.ndarray:
+        assert self._have_computed_fit_for_data
+        return self._fit_iteration_counts
+
+    def get_fit_statistics(self) -> typing.Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        assert self._have_computed_fit_for_data
+        assert self._fit_statistics is not None
+        return self._fit_statistics
+
+
+# Vandermonde matrix functions of the orthogonal polynomial bases of PolynomialCurveFit
+polynomial_vander_functions = {
+    "chebyshev": numpy.polynomial.chebyshev.chebvander,
+    "legendre": numpy.polynomial.legendre.legvander,
+}
+
 
 class PolynomialCurveFit:
     """A class for fitting 1D polynomials to arrays of 1D data (i.e. curves or spectra).
@@ -87,44 +428,51 @@ class PolynomialCurveFit:
     Linear fitting is done by default, but higher order polynomial fitting can be specified via the polynomial_order parameter.
     Polynomial fits to curves plotted against a logarithmic x axis (e.g. power laws) are specified by setting fit_log_x to True.
     In this case, the x values must all be strictly greater than 0.
+    Higher order fits over wide x ranges are better conditioned with a Chebyshev or Legendre basis (see polynomial_basis), in which case
+    the fit coefficients are those of the orthogonal polynomials of x mapped from the range of the fit x values onto [-1, 1].
 
     For a given set of x values, multiple data sets can be fitted with the same fit object via the compute_fit_for_data method.
     Data sets that follow a polynomial model when plotted against a logarithmic y (intensity) axis, e.g. exponential, Gaussian,
     and power-law models, can be fitted by passing True for the fit_log_data parameter of this method.
-    In this case, all the data values must be strictly greater than 0.
+    In this case, data values that are not strictly greater than 0 are excluded from the fit of their curve, and curves with
+    too few positive values to be fit are flagged as False by get_fit_validity and evaluate to NaN.
     """
 
     def _compute_polynomial_model(self, x_values: numpy.ndarray) -> numpy.ndarray:
-        """Prepare polynomial model array for the current polynomial order and log-scale settings.
+        """Prepare polynomial model array for the current polynomial order, basis and log-scale settings.
         """
-        polynomial_model = numpy.ones([self._polynomial_order + 1, x_values.size], x_values.dtype)
-        if self._polynomial_order > 0:
-            if self._fit_log_x:
-                # For log x fit, all x values must be positive
-                assert numpy.amin(x_values) > 0
-                polynomial_model[1, :] = numpy.log(x_values)
-            else:
-                polynomial_model[1, :] = x_values
-
-            power = 2
-            while power <= self._polynomial_order:
-                polynomial_model[power:self._polynomial_order, :] *= polynomial_model[1, :]
-                power += 1
-
-        return polynomial_model
+        if self._fit_log_x:
+            # For log x fit, all x values must be positive
+            assert numpy.amin(x_values) > 0
+            x_values = numpy.log(x_values)
+        if self._polynomial_basis == "power":
+            polynomial_model = numpy.power(x_values, numpy.arange(self._polynomial_order + 1)[:, numpy.newaxis])
+        else:
+            # Map the x values of the fit onto [-1, 1], where the orthogonal polynomials are well-conditioned
+            mapped_x_values = (x_values - self._x_center) / self._x_half_width
+            polynomial_model = polynomial_vander_functions[self._polynomial_basis](mapped_x_values, self._polynomial_order).T
+        return polynomial_model.astype(x_values.dtype, copy = False)
 
-    def __init__(self, x_values: numpy.ndarray, polynomial_order: int = 1, fit_log_x: bool = False):
+    def __init__(self, x_values: numpy.ndarray, polynomial_order: int = 1, fit_log_x: bool = False, polynomial_basis: str = "power"):
         """
             x_values - a 1D NumPy array containing the x coordinates corresponding to each entry in the data arrays passed to compute_fit_for_data.
             polynomial_order - non-negative integer value specifying fit polynomial order, e.g. 0 = constant, 1 = line, 2 = parabola, etc.
             fit_log_x - boolean value specifying whether fit should be versus log of x values, e.g. logarithmic curve or power-law.
+            polynomial_basis - "power" (default) for powers of x, or "chebyshev" or "legendre" for orthogonal polynomials of x mapped
+                               from the range of the fit x values onto [-1, 1], which stay well-conditioned for higher orders and wide ranges.
         """
         assert x_values.ndim == 1
         assert x_values.var() > 0
         assert x_values.size >= polynomial_order + 1
+        assert polynomial_basis == "power" or polynomial_basis in polynomial_vander_functions
 
         self._polynomial_order = polynomial_order
         self._fit_log_x = fit_log_x
+        self._polynomial_basis = polynomial_basis
+
+        fit_x_values = numpy.log(x_values) if fit_log_x else x_values
+        self._x_center = (numpy.amax(fit_x_values) + numpy.amin(fit_x_values)) / 2
+        self._x_half_width = (numpy.amax(fit_x_values) - numpy.amin(fit_x_values)) / 2
 
         self._multicurve_fit = MultipleCurveFit(self._compute_polynomial_model(x_values))
 
@@ -137,17 +485,21 @@ class PolynomialCurveFit:
 
         self._fit_log_y = fit_log_data
 
-        y_values = data_values.copy()
         if self._fit_log_y:
-            # For log y fit, all values must be positive
-            assert numpy.amin(y_values) > 0
-            y_values = numpy.log(y_values)
-
-        self._multicurve_fit.compute_fit_for_data(y_values)
+            # For log y fit, only positive values are valid
+            with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+                y_values = numpy.log(data_values, dtype = floating_point_type(data_values.dtype))
+            valid_values = numpy.isfinite(y_values)
+            self._multicurve_fit.compute_fit_for_data(y_values, None if numpy.all(valid_values) else valid_values)
+        else:
+            self._multicurve_fit.compute_fit_for_data(data_values)
 
     def get_fit_coefficients(self) -> numpy.ndarray:
         return self._multicurve_fit.get_fit_coefficients()
 
+    def get_fit_validity(self) -> numpy.ndarray:
+        return self._multicurve_fit.get_fit_validity()
+
     def evaluate_fit_at(self, x_values) -> numpy.ndarray:
         evaluated_fit = numpy.einsum('ij, ...i', self._compute_polynomial_model(x_values), self._multicurve_fit.get_fit_coefficients())
         if self._fit_log_y:
@@ -155,6 +507,38 @@ class PolynomialCurveFit:
         return evaluated_fit
 
 
+def gather_shifted_channels(data_values: numpy.ndarray, channel_indices: numpy.ndarray, channel_offsets: numpy.ndarray) -> numpy.ndarray:
+    """Returns the values of the data curves at the channel indices shifted by a fractional channel offset per curve, as float64.
+
+        data_values - array of 1D data curves, e.g. a spectrum image or a numpy.memmap of one, of which only the span of the shifted
+                      channels is read
+        channel_indices - 1D integer array of the channels to gather, e.g. the fit channels of a SignalExtractionPlan
+        channel_offsets - array of channel offsets broadcastable to data_values.shape[:-1], e.g. the ZLP shifts of AlignZLP
+
+    Channel c of each curve is read at channel c + offset by linear interpolation between the neighboring channels, so the gathered
+    values are those of the curves aligned by their offsets, without resampling the data. Channels shifted beyond the ends of the
+    curves are NaN. The result has shape data_values.shape[:-1] + channel_indices.shape.
+    """
+    sample_count = data_values.shape[-1]
+    channel_offsets = numpy.broadcast_to(numpy.asarray(channel_offsets, dtype = numpy.float64), data_values.shape[:-1])[..., numpy.newaxis]
+    whole_offsets = numpy.floor(channel_offsets)
+    fractions = channel_offsets - whole_offsets
+    lower_channels = channel_indices + whole_offsets.astype(int)
+    upper_channels = lower_channels + (fractions > 0)
+    if lower_channels.size == 0:
+        return numpy.zeros(lower_channels.shape)
+    # Read only the span of channels needed by any curve, then pick the neighboring channels of each curve from it
+    span_start = int(numpy.clip(numpy.amin(lower_channels), 0, sample_count - 1))
+    span_stop = int(numpy.clip(numpy.amax(upper_channels) + 1, span_start + 1, sample_count))
+    span_values = numpy.asarray(data_values[..., span_start:span_stop], dtype = numpy.float64)
+    lower_values = numpy.take_along_axis(span_values, numpy.clip(lower_channels - span_start, 0, span_stop - span_start - 1), -1)
+    upper_values = numpy.take_along_axis(span_values, numpy.clip(upper_channels - span_start, 0, span_stop - span_start - 1), -1)
+    with numpy.errstate(invalid = 'ignore'):
+        shifted_values = lower_values + fractions * (upper_values - lower_values)
+    shifted_values[(lower_channels < 0) | (upper_channels >= sample_count)] = numpy.nan
+    return shifted_values
+
+
 class RangeSliceConverter:
     """A class for converting between calibrated ranges and slices on equispaced 1D data arrays.
 
@@ -185,9 +569,254 @@ class RangeSliceConverter:
         return numpy.array([range_start, range_end])
 
 
+class SignalExtractionPlan:
+    """A class for extracting signals from polynomial backgrounds with fixed ranges from any number of data arrays.
+
+    The plan must be initialized with the number of samples of the 1D data curves and the ranges and options of
+    signal_from_polynomial_background. The fit ranges are ordered and consolidated, the sample indices of the fit ranges and the slices
+    of the profile and signal ranges are determined, and the polynomial fit and its evaluation over the profile range are combined into one
+    background matrix, all at initialization. The apply method then extracts the signal from each data array with one gather of the fit
+    samples and one matrix product, except for the curves with non-positive values when fitting the log of the data values,
+    which are fit excluding those values (see MultipleCurveFit). Plans hold no fit results, so one plan can be applied from several threads.
+    """
+
+    def __init__(self, sample_count: int, data_x_range: numpy.ndarray, signal_x_range: numpy.ndarray, background_fit_x_ranges: numpy.ndarray,
+                 polynomial_order: int = 1, fit_log_data: bool = False, fit_log_x: bool = False, polynomial_basis: str = "power"):
+        """
+            sample_count - number of samples of the 1D data curves, i.e. the size of the last dimension of the data arrays.
+            data_x_range, signal_x_range, background_fit_x_ranges, polynomial_order, fit_log_data, fit_log_x, polynomial_basis - see
+                                           signal_from_polynomial_background.
+        """
+        assert data_x_range.ndim == 1
+        assert data_x_range.size == 2
+        assert data_x_range[0] < data_x_range[1]
+
+        assert signal_x_range.ndim == 1
+        assert signal_x_range.size == 2
+        assert signal_x_range[0] <= signal_x_range[1]
+        assert signal_x_range[0] >= data_x_range[0]
+        assert signal_x_range[1] <= data_x_range[1]
+
+        assert background_fit_x_ranges.ndim <= 2
+        assert background_fit_x_ranges.shape[-1] == 2
+        assert numpy.all(background_fit_x_ranges[..., 0] <= background_fit_x_ranges[..., 1])
+        assert background_fit_x_ranges.min() >= data_x_range[0]
+        assert background_fit_x_ranges.max() <= data_x_range[1]
+
+        self.sample_count = sample_count
+        self._fit_log_data = fit_log_data
+
+        # Distill the fit ranges so that they are ordered, consolidated, and non-overlapping
+        sorted_fit_ranges = numpy.atleast_2d(background_fit_x_ranges)
+        sorted_fit_ranges = sorted_fit_ranges[numpy.argsort(sorted_fit_ranges[:, 0], kind = 'stable')]
+        clean_fit_ranges = [sorted_fit_ranges[0].copy()]
+        for fit_range in sorted_fit_ranges[1:]:
+            if clean_fit_ranges[-1][1] > fit_range[0]:
+                clean_fit_ranges[-1][1] = max(clean_fit_ranges[-1][1], fit_range[1])
+            else:
+                clean_fit_ranges.append(fit_range.copy())
+        self.fit_ranges = numpy.array(clean_fit_ranges)
+
+        # Determine the sample indices of all fit ranges, so that the fit samples are gathered from the data in one step
+        x_origin = data_x_range[0]
+        self.x_step = (data_x_range[1] - x_origin) / sample_count
+        data_range_converter = RangeSliceConverter(x_origin, self.x_step)
+        x_values = numpy.arange(x_origin, data_x_range[1], self.x_step, dtype=numpy.float32)
+        fit_slices = [data_range_converter.get_slice(fit_range) for fit_range in self.fit_ranges]
+        self.fit_indices = numpy.concatenate([numpy.arange(sample_count)[fit_slice] for fit_slice in fit_slices])
+
+        # Establish the net profile range, i.e. the contiguous union of fit and signal ranges, and the signal slice within it
+        self.profile_range = numpy.zeros_like(signal_x_range)
+        self.profile_range[0] = min(signal_x_range[0], self.fit_ranges.min())
+        self.profile_range[1] = max(signal_x_range[1], self.fit_ranges.max())
+        self.profile_slice = data_range_converter.get_slice(self.profile_range)
+        self.signal_slice = RangeSliceConverter(self.profile_range[0], self.x_step).get_slice(signal_x_range)
+
+        # Combine the polynomial fit and its evaluation over the profile range into one matrix mapping fit samples to background profiles
+        background_fit = PolynomialCurveFit(x_values[self.fit_indices], polynomial_order, fit_log_x, polynomial_basis)
+        self._multicurve_fit = background_fit._multicurve_fit
+        profile_model = background_fit._compute_polynomial_model(x_values[self.profile_slice])
+        self._normalized_profile_model = profile_model / self._multicurve_fit._model_rms_values.astype(numpy.float64)
+        self._background_matrix = numpy.dot(self._multicurve_fit._normalized_fit_matrix.T.astype(numpy.float64), self._normalized_profile_model)
+
+    def apply(self, data_values: numpy.ndarray, return_validity: bool = False, return_statistics: bool = False,
+              energy_offsets: typing.Optional[numpy.ndarray] = None) -> tuple:
+        """Extracts the signal from the data curves, with the same results as signal_from_polynomial_background.
+
+            data_values - a (possibly multi-dimensional) array of 1D data curves with sample_count samples along the last array dimension.
+            return_validity, return_statistics, energy_offsets - see signal_from_polynomial_background.
+        """
+        assert data_values.shape[-1] == self.sample_count
+        # A single data curve gives results for an array of one curve, and the results have the floating point type of the data
+        data_values = numpy.atleast_2d(data_values)
+        result_dtype = floating_point_type(data_values.dtype)
+        if energy_offsets is None:
+            fit_values = numpy.take(data_values, self.fit_indices, -1)
+            profile_values = data_values[..., self.profile_slice]
+        else:
+            # Gather the fit and profile samples of each curve shifted by its offset
+            channel_offsets = numpy.asarray(energy_offsets) / self.x_step
+            fit_values = gather_shifted_channels(data_values, self.fit_indices, channel_offsets)
+            profile_values = gather_shifted_channels(data_values, numpy.arange(self.sample_count)[self.profile_slice], channel_offsets)
+            profile_values = profile_values.astype(result_dtype, copy = False)
+        fit_values, valid_values = self._prepare_fit_values(fit_values, energy_offsets is not None)
+        background_model = numpy.dot(fit_values, self._background_matrix)
+        return self._extract_signal(fit_values, valid_values, background_model, profile_values, result_dtype, return_validity, return_statistics)
+
+    def _prepare_fit_values(self, fit_values: numpy.ndarray, exclude_non_finite: bool) -> tuple:
+        """Returns the fit samples as fitted, i.e. in their floating point type (see floating_point_type) and their log when fitting the
+        log of the data values, with the samples excluded from the fit set to zero, and the boolean array of the samples included in the
+        fit (None if all samples are).
+
+            fit_values - array of the fit samples of the data curves, e.g. as gathered by apply.
+            exclude_non_finite - pass True to exclude non-finite samples, e.g. samples shifted beyond the data, from the fit.
+        """
+        fit_values = numpy.asarray(fit_values, dtype = floating_point_type(fit_values.dtype))
+        valid_values = None
+        if exclude_non_finite:
+            valid_values = numpy.isfinite(fit_values)
+            fit_values = numpy.where(valid_values, fit_values, 0)
+        if self._fit_log_data:
+            with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+                fit_values = numpy.log(fit_values)
+            valid_values = numpy.isfinite(fit_values) if valid_values is None else valid_values & numpy.isfinite(fit_values)
+            fit_values = numpy.where(valid_values, fit_values, 0)
+        return fit_values, valid_values
+
+    def _extract_signal(self, fit_values: numpy.ndarray, valid_values: typing.Optional[numpy.ndarray], background_model: numpy.ndarray,
+                        profile_values: numpy.ndarray, result_dtype: numpy.dtype, return_validity: bool, return_statistics: bool) -> tuple:
+        """Returns the results of apply from the prepared fit samples (see _prepare_fit_values), their product with the background
+        matrix, and the profile samples of the data curves.
+        """
+        fit_validity = numpy.all(numpy.isfinite(background_model), -1)
+        normalized_fit_coefficients = None
+        if return_statistics:
+            normalized_fit_coefficients = numpy.dot(fit_values, self._multicurve_fit._normalized_fit_matrix.T.astype(numpy.float64))
+        if valid_values is not None and not numpy.all(valid_values):
+            # Curves with excluded samples are fit without them, and are invalid if too few samples remain
+            is_masked = ~numpy.all(valid_values, -1)
+            masked_coefficients = self._multicurve_fit._compute_masked_fit_coefficients(fit_values[is_masked], valid_values[is_masked])
+            background_model[is_masked] = numpy.dot(masked_coefficients, self._normalized_profile_model)
+            fit_validity[is_masked] = numpy.all(numpy.isfinite(masked_coefficients), -1)
+            if normalized_fit_coefficients is not None:
+                normalized_fit_coefficients[is_masked] = masked_coefficients
+        if self._fit_log_data:
+            background_model = numpy.exp(background_model)
+
+        background_model = background_model.astype(result_dtype, copy = False)
+
+        # Compute the net signal profile and its integral over the specified signal range
+        signal_profile = profile_values - background_model
+        signal_integral = numpy.trapz(signal_profile[..., self.signal_slice], dx = self.x_step)
+
+        results = (signal_integral, signal_profile, background_model, self.profile_range.copy())
+        if return_validity:
+            results += (fit_validity,)
+        if return_statistics:
+            # The goodness of fit is that of the fitted (log) values over the fit ranges
+            results += self._multicurve_fit._compute_fit_statistics(fit_values, valid_values, normalized_fit_coefficients)
+        return results
+
+
+class MultipleSignalExtractionPlan:
+    """A class for extracting several signals, each from its own polynomial background, from any number of data arrays in one sweep.
+
+    The plan must be initialized with the number of samples of the 1D data curves, their x range and a sequence of signal
+    specifications, e.g. one for each edge of a multi-element sample. A SignalExtractionPlan is created for each specification.
+    The union of the fit and profile samples of all signals is gathered from each chunk of data curves at once, and the background
+    matrices of all signals fit with the same data transform are combined into one, so all fits of a chunk take one matrix product
+    per transform (log or linear data values) rather than one gather and one product per signal.
+    """
+
+    def __init__(self, sample_count: int, data_x_range: numpy.ndarray, signal_specifications: typing.Sequence[tuple]):
+        """
+            sample_count - number of samples of the 1D data curves, i.e. the size of the last dimension of the data arrays.
+            data_x_range - see signal_from_polynomial_background.
+            signal_specifications - sequence of (signal_x_range, background_fit_x_ranges, background_model) tuples, where background_model
+                                    is a dict of the polynomial_order, fit_log_data, fit_log_x and polynomial_basis options of
+                                    signal_from_polynomial_background (None for the defaults).
+        """
+        self.sample_count = sample_count
+        self.extraction_plans = [SignalExtractionPlan(sample_count, data_x_range, signal_x_range, background_fit_x_ranges, **(background_model or dict()))
+                                 for signal_x_range, background_fit_x_ranges, background_model in signal_specifications]
+        self.x_step = (data_x_range[1] - data_x_range[0]) / sample_count
+
+        # Determine the union of the samples needed by any signal, and the positions of the samples of each signal within it
+        profile_indices = [numpy.arange(sample_count)[plan.profile_slice] for plan in self.extraction_plans]
+        self.sample_indices = numpy.unique(numpy.concatenate([plan.fit_indices for plan in self.extraction_plans] + profile_indices))
+        self._profile_positions = [numpy.searchsorted(self.sample_indices, indices) for indices in profile_indices]
+
+        # Combine the background matrices of the signals of each transform into one matrix mapping the union of their fit samples to
+        # the concatenation of their background profiles
+        self._fit_groups = list()
+        for fit_log_data in (False, True):
+            plan_indices = [index for index, plan in enumerate(self.extraction_plans) if plan._fit_log_data == fit_log_data]
+            if plan_indices:
+                fit_indices = numpy.unique(numpy.concatenate([self.extraction_plans[index].fit_indices for index in plan_indices]))
+                profile_stops = numpy.cumsum([self.extraction_plans[index]._background_matrix.shape[-1] for index in plan_indices])
+                background_matrix = numpy.zeros((fit_indices.size, profile_stops[-1]))
+                fit_positions = list()
+                for plan_index, profile_stop in zip(plan_indices, profile_stops):
+                    plan = self.extraction_plans[plan_index]
+                    plan_fit_positions = numpy.searchsorted(fit_indices, plan.fit_indices)
+                    background_matrix[plan_fit_positions, profile_stop - plan._background_matrix.shape[-1]:profile_stop] = plan._background_matrix
+                    fit_positions.append(plan_fit_positions)
+                self._fit_groups.append((plan_indices, numpy.searchsorted(self.sample_indices, fit_indices), fit_positions,
+                                         profile_stops, background_matrix))
+
+    def apply(self, data_values: numpy.ndarray, chunk_size: typing.Optional[int] = None, return_validity: bool = False,
+              energy_offsets: typing.Optional[numpy.ndarray] = None) -> typing.List[tuple]:
+        """Extracts the signals from the data curves, with the same results as applying the SignalExtractionPlan of each signal.
+
+            data_values - a (possibly multi-dimensional, e.g. memmapped spectrum image) array of 1D data curves with sample_count samples
+                          along the last array dimension.
+            chunk_size - maximum number of curves gathered and fit at once; chunks are whole rows of the first array dimension.
+            return_validity, energy_offsets - see signal_from_polynomial_background.
+
+        Returns a list with the results of each signal, in the order of the signal specifications (see signal_from_polynomial_background).
+        """
+        assert data_values.shape[-1] == self.sample_count
+        data_values = numpy.atleast_2d(data_values)
+        navigation_shape = data_values.shape[:-1]
+        result_dtype = floating_point_type(data_values.dtype)
+        if energy_offsets is not None:
+            energy_offsets = numpy.broadcast_to(numpy.asarray(energy_offsets), navigation_shape)
+        results = list()
+        for plan in self.extraction_plans:
+            profile_shape = navigation_shape + (plan.profile_slice.stop - plan.profile_slice.start,)
+            results.append((numpy.empty(navigation_shape, dtype = result_dtype), numpy.empty(profile_shape, dtype = result_dtype),
+                            numpy.empty(profile_shape, dtype = result_dtype), plan.profile_range.copy()) +
+                           ((numpy.empty(navigation_shape, dtype = bool),) if return_validity else ()))
+        row_size = max(1, int(numpy.prod(navigation_shape[1:], dtype = numpy.int64)))
+        row_step = max(1, (chunk_size or navigation_shape[0] * row_size) // row_size)
+        for start in range(0, navigation_shape[0], row_step):
+            chunk = slice(start, start + row_step)
+            # Gather every sample needed by any signal from the chunk at once
+            if energy_offsets is None:
+                sample_values = numpy.take(data_values[chunk], self.sample_indices, -1)
+            else:
+                sample_values = gather_shifted_channels(data_values[chunk], self.sample_indices, energy_offsets[chunk] / self.x_step)
+            for plan_indices, group_positions, fit_positions, profile_stops, background_matrix in self._fit_groups:
+                group_fit_values, group_valid_values = self.extraction_plans[plan_indices[0]]._prepare_fit_values(
+                    sample_values[..., group_positions], energy_offsets is not None)
+                group_background_model = numpy.dot(group_fit_values, background_matrix)
+                for plan_index, plan_fit_positions, profile_stop in zip(plan_indices, fit_positions, profile_stops):
+                    plan = self.extraction_plans[plan_index]
+                    valid_values = None if group_valid_values is None else group_valid_values[..., plan_fit_positions]
+                    background_model = group_background_model[..., profile_stop - plan._background_matrix.shape[-1]:profile_stop]
+                    profile_values = sample_values[..., self._profile_positions[plan_index]].astype(result_dtype, copy = False)
+                    plan_results = plan._extract_signal(group_fit_values[..., plan_fit_positions], valid_values, background_model,
+                                                        profile_values, result_dtype, return_validity, False)
+                    for result, plan_result in zip(results[plan_index][:3] + results[plan_index][4:], plan_results[:3] + plan_results[4:]):
+                        result[chunk] = plan_result
+        return results
+
+
 def signal_from_polynomial_background(data_values: numpy.ndarray, data_x_range: numpy.ndarray, signal_x_range: numpy.ndarray,
                                                 background_fit_x_ranges: numpy.ndarray, polynomial_order: int = 1,
-                                                fit_log_data: bool = False, fit_log_x: bool = False) -> tuple:
+                                                fit_log_data: bool = False, fit_log_x: bool = False, return_validity: bool = False,
+                                                polynomial_basis: str = "power", return_statistics: bool = False,
+                                                energy_offsets: typing.Optional[numpy.ndarray] = None) -> tuple:
     """Extracts signal from polynomial background fitted to an array of uniformly sampled 1D data curves, returning both the signal and background arrays.
 
     Primary inputs:
@@ -208,75 +837,111 @@ def signal_from_polynomial_background(data_values: numpy.ndarray, data_x_range:
         polynomial_order - order of the polynomial model function (i.e. 0: constant, 1: line (default), 2: parabola, etc).
         fit_log_data - pass True to fit a polynomial to the log of the data values (e.g. exponential, Gaussian tail, or power-law fit)
         fit_log_x - pass True to perform the fit with respect to the log of the x values (e.g. logarithmic or power-law fit)
+        return_validity - pass True to also return the fit validity array (see below)
+        polynomial_basis - "power" (default), "chebyshev" or "legendre" polynomial basis of the fit (see PolynomialCurveFit)
+        return_statistics - pass True to also return the goodness of fit arrays (see below)
+        energy_offsets - x offset of each data curve (an array broadcastable to data_values.shape[:-1]), e.g. the ZLP shifts of AlignZLP
+                         times the energy step, for data curves whose x axis drifts. The ranges are then taken from each curve shifted by
+                         its offset, interpolating linearly between samples (see gather_shifted_channels), instead of from aligned data.
+                         Fit samples shifted beyond the data are excluded from the fit, and profile samples beyond the data are NaN.
+
+    When fitting the log of the data values, values that are not strictly greater than 0 are excluded from the fit of their curve.
+    Curves with too few positive values in the fit ranges cannot be fit; their background and signal are NaN.
 
     Returns:
         signal_integral - net signal integral array after subtraction of background fit over the specified signal range
         signal_profile - net signal profile array after subtraction of background fit over the profile range (see below)
         background_model - background fit profile array over the profile range (see below)
         profile_range - contiguous union of signal and background fit ranges
+        fit_validity - boolean array that is False for curves that could not be fit (only returned if return_validity is True)
+        chi_squares, reduced_chi_squares, r_squares - goodness of fit arrays of the background fits over the fit ranges, computed
+                         for the log of the data values when fitting those (only returned if return_statistics is True)
+
+    To extract signals with the same ranges from many data arrays (e.g. spectrum images or frames), create a SignalExtractionPlan once
+    and apply it to each of them instead.
     """
-    assert data_x_range.ndim == 1
-    assert data_x_range.size == 2
-    assert data_x_range[0] < data_x_range[1]
-
-    assert signal_x_range.ndim == 1
-    assert signal_x_range.size == 2
-    assert signal_x_range[0] <= signal_x_range[1]
-    assert signal_x_range[0] >= data_x_range[0]
-    assert signal_x_range[1] <= data_x_range[1]
-
-    assert background_fit_x_ranges.ndim <= 2
-    assert background_fit_x_ranges.shape[-1] == 2
-    assert numpy.all(background_fit_x_ranges[..., 0] <= background_fit_x_ranges[..., 1])
-    assert background_fit_x_ranges.min() >= data_x_range[0]
-    assert background_fit_x_ranges.max() <= data_x_range[1]
-
-    # Distill the fit ranges so that they are ordered, consolidated, and non-overlapping
-    sorted_fit_ranges = numpy.atleast_2d(background_fit_x_ranges)
-    fit_range_order = numpy.argsort(sorted_fit_ranges, 0)[:, 0]
-    sorted_fit_ranges = sorted_fit_ranges[fit_range_order]
-    clean_fit_ranges = numpy.atleast_2d(sorted_fit_ranges[0])
-    for range_index in range(1, sorted_fit_ranges.shape[0]):
-        if clean_fit_ranges[-1, 1] > sorted_fit_ranges[range_index, 0]:
-            clean_fit_ranges[-1, 1] = max(clean_fit_ranges[-1, 1], sorted_fit_ranges[range_index, 1])
-        else:
-            clean_fit_ranges = numpy.append(clean_fit_ranges, sorted_fit_ranges[range_index])
-    if clean_fit_ranges.shape[0] > 2:
-        clean_fit_ranges = clean_fit_ranges.reshape([clean_fit_ranges.shape[0] // 2, 2])
-
-    # Compile data and x-value arrays over fit ranges for input to the polynomial background fit
-    x_origin = data_x_range[0]
-    x_step = (data_x_range[1] - x_origin) / data_values.shape[-1]
-    data_range_converter = RangeSliceConverter(x_origin, x_step)
-    x_values = numpy.arange(x_origin, data_x_range[1], x_step, dtype=numpy.float32)
-    next_slice = data_range_converter.get_slice(clean_fit_ranges[0])
-    x_values_for_fit = x_values[next_slice]
-    data_values_for_fit = numpy.maximum(data_values[..., next_slice], 1)
-    for range_index in range(1, clean_fit_ranges.shape[0]):
-        next_slice = data_range_converter.get_slice(clean_fit_ranges[range_index])
-        x_values_for_fit = numpy.append(x_values_for_fit, x_values[next_slice])
-        data_values_for_fit = numpy.append(data_values_for_fit, numpy.maximum(data_values[..., next_slice], 1), axis=-1)
-
-    # Generate the requested polynomial fit for the specified fit ranges
-    background_fit = PolynomialCurveFit(x_values_for_fit, polynomial_order, fit_log_x)
-    background_fit.compute_fit_for_data(data_values_for_fit, fit_log_data)
-
-    # Establish the net profile range, i.e. the contiguous union of fit and signal ranges
-    profile_range = numpy.zeros_like(signal_x_range)
-    profile_range[0] = min(signal_x_range[0], clean_fit_ranges.min())
-    profile_range[1] = max(signal_x_range[1], clean_fit_ranges.max())
-    profile_slice = data_range_converter.get_slice(profile_range)
-
-    # Evaluate background model over the net profile range
-    background_model = background_fit.evaluate_fit_at(x_values[profile_slice])
-
-    # Compute the net signal profile
-    signal_profile = data_values[..., profile_slice] - background_model
-
-    # Compute the net signal integral over the specified signal range
-    profile_range_converter = RangeSliceConverter(profile_range[0], x_step)
-    signal_slice = profile_range_converter.get_slice(signal_x_range)
-    signal_integral = numpy.trapz(signal_profile[..., signal_slice], dx = x_step)
-
-    return signal_integral, signal_profile, background_model, profile_range
+    extraction_plan = SignalExtractionPlan(data_values.shape[-1], data_x_range, signal_x_range, background_fit_x_ranges,
+                                           polynomial_order, fit_log_data, fit_log_x, polynomial_basis)
+    return extraction_plan.apply(data_values, return_validity, return_statistics, energy_offsets)
+
+
+def signals_from_polynomial_backgrounds(data_values: numpy.ndarray, data_x_range: numpy.ndarray, signal_specifications: typing.Sequence[tuple],
+                                        chunk_size: typing.Optional[int] = None, return_validity: bool = False,
+                                        energy_offsets: typing.Optional[numpy.ndarray] = None) -> typing.List[tuple]:
+    """Extracts several signals, each from its own polynomial background, from an array of uniformly sampled 1D data curves in one sweep.
+
+        data_values - a (possibly multi-dimensional, e.g. memmapped spectrum image) array of uniformly sampled 1D data sets
+        data_x_range - range of equispaced x coordinates at which all of the 1D data sets are sampled
+        signal_specifications - sequence of (signal_x_range, background_fit_x_ranges, background_model) tuples, e.g. one for each edge
+                                of a multi-element sample, where background_model is a dict of the polynomial_order, fit_log_data,
+                                fit_log_x and polynomial_basis options of signal_from_polynomial_background (None for the defaults)
+        chunk_size - maximum number of curves gathered and fit at once (all by default)
+        return_validity, energy_offsets - see signal_from_polynomial_background
 
+    The samples needed by all signals are gathered from each chunk of data curves at once and all background fits of a chunk are
+    computed together (see MultipleSignalExtractionPlan), so extracting several signals costs about one read of the data.
+
+    Returns a list with the results of signal_from_polynomial_background for each signal specification, in order.
+    """
+    extraction_plan = MultipleSignalExtractionPlan(data_values.shape[-1], data_x_range, signal_specifications)
+    return extraction_plan.apply(data_values, chunk_size, return_validity, energy_offsets)
+
+
+def mlls_background_curves(x_values: numpy.ndarray, polynomial_order: typing.Optional[int] = 1,
+                           power_law_exponents: typing.Optional[typing.Sequence[float]] = None) -> numpy.ndarray:
+    """Returns the background model curves for multiple linear least squares (MLLS) fits, as a 2D array with one curve per row.
+
+    The curves are the powers of the x values, mapped onto [-1, 1], up to polynomial_order (None for no polynomial terms), followed by
+    a power law (x / x_center) ** -r for each exponent r in power_law_exponents. Fitting several power laws with bracketing exponents
+    approximates a power-law background of varying exponent while keeping the fit linear.
+    """
+    x_center = (numpy.amax(x_values) + numpy.amin(x_values)) / 2
+    x_half_width = (numpy.amax(x_values) - numpy.amin(x_values)) / 2
+    background_curves = list()
+    if polynomial_order is not None:
+        background_curves.extend(numpy.polynomial.polynomial.polyvander((x_values - x_center) / x_half_width, polynomial_order).T)
+    if power_law_exponents is not None:
+        # For power laws, all x values must be positive
+        assert numpy.amin(x_values) > 0
+        background_curves.extend(numpy.power(x_values / x_center, -exponent) for exponent in power_law_exponents)
+    return numpy.array(background_curves, dtype = numpy.float64).reshape(-1, x_values.size)
+
+
+def mlls_fit(data_values: numpy.ndarray, x_values: numpy.ndarray, reference_curves: numpy.ndarray, polynomial_order: typing.Optional[int] = 1,
+             power_law_exponents: typing.Optional[typing.Sequence[float]] = None, chunk_size: typing.Optional[int] = None,
+             coefficients_out: typing.Optional[numpy.ndarray] = None, residuals_out: typing.Optional[numpy.ndarray] = None, nonnegative: bool = False) -> tuple:
+    """Fits reference curves plus a polynomial and/or power-law background to an array of 1D data curves by multiple linear least squares.
+
+    Primary inputs:
+        data_values - a (possibly multi-dimensional, e.g. memmapped spectrum image) array of 1D data curves, with samples along the last dimension
+        x_values - 1D array of the x coordinates of the data samples, e.g. the energies of the fit range
+        reference_curves - 2D array of reference curves (e.g. edge spectra from standards or picks) sampled at x_values, one per row
+
+    The background model curves are given by polynomial_order and power_law_exponents (see mlls_background_curves). Overlapping
+    references (e.g. edges within each other's fine structure) are separated by the fit rather than by windows. All model curves share
+    one SVD-based fit matrix (see MultipleCurveFit), so the data is fit with one matrix product per chunk of at most chunk_size curves.
+    Pass nonnegative as True to constrain all coefficients to be nonnegative, e.g. for noisy spectra of weak references with power
+    law backgrounds (see solve_nonnegative_least_squares); polynomial background terms of either sign then need power laws instead.
+
+    Optional outputs:
+        coefficients_out - array with the data array shape and a last dimension of the total model curve count (references first)
+        residuals_out - array with the data array shape without the last dimension
+
+    Returns:
+        reference_coefficients - coefficient of each reference curve for each data curve, as a view of the coefficients
+        background_coefficients - coefficient of each background model curve for each data curve, as a view of the coefficients
+        residuals - RMS residual of the fit of each data curve
+    """
+    reference_curves = numpy.atleast_2d(reference_curves)
+    assert x_values.ndim == 1
+    assert reference_curves.shape[-1] == x_values.size
+    assert data_values.shape[-1] == x_values.size
+
+    background_curves = mlls_background_curves(x_values, polynomial_order, power_law_exponents)
+    multicurve_fit = MultipleCurveFit(numpy.concatenate([reference_curves, background_curves]))
+    if residuals_out is None:
+        residuals_out = numpy.empty(data_values.shape[:-1])
+    coefficients, integrals, curves, residuals = multicurve_fit.compute_fit_for_data_in_chunks(
+        data_values, chunk_size = chunk_size, coefficients_out = coefficients_out, residuals_out = residuals_out, nonnegative = nonnegative)
+    reference_count = reference_curves.shape[0]
+    return coefficients[..., :reference_count], coefficients[..., reference_count:], residuals
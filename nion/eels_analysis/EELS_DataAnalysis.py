@@ -44,6 +44,29 @@ def core_loss_edge(core_loss_spectra: numpy.ndarray, core_loss_range_eV: numpy.n
     return CurveFittingAndAnalysis.signal_from_polynomial_background(core_loss_spectra, core_loss_range_eV, edge_range,
                                                                         background_ranges_eV, poly_order, fit_log_y, fit_log_x)
 
+def core_loss_edges(core_loss_spectra: numpy.ndarray, core_loss_range_eV: numpy.ndarray, edges: list, chunk_size: int = None) -> list:
+    """Isolate several edge signals from background in core-loss spectra with one pass over the spectra.
+
+    Each edge is given as an (edge_onset_eV, edge_delta_eV, background_ranges_eV, background_model_ID) tuple, as for core_loss_edge.
+    The channels of all edges are gathered together and all background fits are computed together for each chunk of at most
+    chunk_size spectra (see CurveFittingAndAnalysis.signals_from_polynomial_backgrounds).
+
+    Returns:
+        edge_data - list with the results of core_loss_edge for each edge, in order
+    """
+    edge_onset_margin_eV = 0
+    signal_specifications = list()
+    for edge_onset_eV, edge_delta_eV, background_ranges_eV, background_model_ID in edges:
+        assert edge_onset_eV > core_loss_range_eV[0] + edge_onset_margin_eV
+
+        edge_range = numpy.full_like(core_loss_range_eV, edge_onset_eV)
+        edge_range[0] -= edge_onset_margin_eV
+        edge_range[1] += edge_delta_eV
+        background_model = {"polynomial_order": 1, "fit_log_data": background_model_ID <= 1, "fit_log_x": background_model_ID == 0}
+        signal_specifications.append((edge_range, background_ranges_eV, background_model))
+
+    return CurveFittingAndAnalysis.signals_from_polynomial_backgrounds(core_loss_spectra, core_loss_range_eV, signal_specifications, chunk_size)
+
 def relative_atomic_abundance(core_loss_spectra: numpy.ndarray, core_loss_range_eV: numpy.ndarray, background_ranges_eV: numpy.ndarray,
                                 atomic_number: int, edge_onset_eV: float, edge_delta_eV: float,
                                 beam_energy_eV: float, convergence_angle_rad: float, collection_angle_rad: float) -> numpy.ndarray:
@@ -0,0 +1,530 @@
+# run this from the command line using:
+# cd EELSAnalysis
+# python -m unittest test/BackgroundModel_test.py
+
+import os
+import sys
+import tempfile
+import typing
+import unittest
+
+import numpy
+
+from nion.data import Calibration
+from nion.utils import Registry
+
+sys.path.append(os.path.dirname(os.path.realpath(os.path.join(__file__, "..", ".."))))
+
+from nion.eels_analysis import BackgroundModel
+
+
+class TestBackgroundModel(unittest.TestCase):
+
+    def setUp(self):
+        """Common code for all tests can go here."""
+        BackgroundModel.fit_plan_cache.clear()
+        BackgroundModel.cumulative_sum_tables.clear()
+        BackgroundModel.background_result_cache.clear()
+
+    def tearDown(self):
+        """Common code for all tests can go here."""
+        pass
+
+    def __power_law_spectra(self, m: int, xs: numpy.ndarray) -> numpy.ndarray:
+        amplitudes = numpy.random.uniform(1E8, 1E9, (m, 1))
+        exponents = numpy.random.uniform(2, 4, (m, 1))
+        return amplitudes * numpy.power(xs, -exponents)
+
+    def test_polynomial_fits_match_polyfit(self):
+        xs = numpy.linspace(400.0, 500.0, 100)
+        fs = numpy.linspace(400.0, 600.0, 200)
+        yss = self.__power_law_spectra(12, xs)
+        for deg in range(3):
+            model = BackgroundModel.PolynomialBackgroundModel("test_model", deg)
+            expected = numpy.polynomial.polynomial.polyval(fs, numpy.polynomial.polynomial.polyfit(xs, yss.T, deg))
+            self.assertTrue(numpy.allclose(model._perform_fits(xs, yss, fs), expected))
+
+    def test_log_polynomial_fits_match_polyfit(self):
+        xs = numpy.linspace(400.0, 500.0, 100)
+        fs = numpy.linspace(400.0, 600.0, 200)
+        yss = self.__power_law_spectra(12, xs)
+        model = BackgroundModel.PolynomialBackgroundModel("test_model", 2, transform=numpy.log, untransform=numpy.exp)
+        expected = numpy.exp(numpy.polynomial.polynomial.polyval(fs, numpy.polynomial.polynomial.polyfit(xs, numpy.log(yss.T), 2)))
+        self.assertTrue(numpy.allclose(model._perform_fits(xs, yss, fs), expected))
+
+    def test_polynomial_fit_plans_are_reused_and_evicted(self):
+        xs = numpy.linspace(400.0, 500.0, 100)
+        fs = numpy.linspace(400.0, 600.0, 200)
+        model = BackgroundModel.PolynomialBackgroundModel("test_model", 1)
+        model._perform_fits(xs, self.__power_law_spectra(4, xs), fs)
+        plan = BackgroundModel.fit_plan_cache.get_plan(BackgroundModel.PolynomialFitPlan, xs, 1, fs)
+        model._perform_fits(xs, self.__power_law_spectra(4, xs), fs)
+        self.assertEqual(1, len(BackgroundModel.fit_plan_cache))
+        self.assertIs(plan, BackgroundModel.fit_plan_cache.get_plan(BackgroundModel.PolynomialFitPlan, xs.copy(), 1, fs.copy()))
+        for i in range(BackgroundModel.fit_plan_cache.max_count):
+            model._perform_fits(xs + i + 1, self.__power_law_spectra(1, xs), fs)
+        self.assertEqual(BackgroundModel.fit_plan_cache.max_count, len(BackgroundModel.fit_plan_cache))
+        self.assertIsNot(plan, BackgroundModel.fit_plan_cache.get_plan(BackgroundModel.PolynomialFitPlan, xs, 1, fs))
+
+    def test_polynomial_fit_with_invalid_log_data_excludes_invalid_channels(self):
+        xs = numpy.linspace(400.0, 500.0, 100)
+        fs = numpy.linspace(400.0, 600.0, 200)
+        yss = self.__power_law_spectra(4, xs)
+        yss[1, 10] = -1
+        yss[2, 20:30] = 0
+        yss[3, 1:] = 0
+        model = BackgroundModel.PolynomialBackgroundModel("test_model", 1, transform=numpy.log, untransform=numpy.exp)
+        fit = model._perform_fits(xs, yss, fs)
+        for ys, ys_fit in zip(yss[:3], fit[:3]):
+            coefficients = numpy.polynomial.polynomial.polyfit(xs[ys > 0], numpy.log(ys[ys > 0]), 1)
+            self.assertTrue(numpy.allclose(numpy.exp(numpy.polynomial.polynomial.polyval(fs, coefficients)), ys_fit))
+        self.assertTrue(numpy.all(numpy.isnan(fit[3])))
+        integrals = model._integrate_fits(xs, yss, fs)
+        self.assertTrue(numpy.allclose(numpy.trapz(fit), integrals, equal_nan=True))
+
+    def test_invalid_fits_are_zeroed_and_flagged_in_validity(self):
+        xs_all = numpy.linspace(300.0, 700.0, 400)
+        data = self.__power_law_spectra(4 * 3, xs_all).reshape((4, 3, 400))
+        data[1, 2, 51:100] = 0
+        data[3, 0, 50:100] = numpy.nan
+        fit_slices = [slice(50, 100)]
+        xs = xs_all[50:100]
+        fs = xs_all[100:200]
+        expected_validity = numpy.ones((4, 3), dtype=bool)
+        expected_validity[1, 2] = expected_validity[3, 0] = False
+        for model in Registry.get_components_by_type("background-model"):
+            validity = numpy.zeros((4, 3), dtype=bool)
+            with numpy.errstate(divide="ignore", invalid="ignore", over="ignore"):
+                background = model.fit_background_data(data, fit_slices, xs, fs, chunk_size=5, validity=validity)
+            self.assertTrue(numpy.all(numpy.isfinite(background)), model.background_model_id)
+            self.assertTrue(numpy.all(background[~validity] == 0), model.background_model_id)
+            self.assertFalse(validity[3, 0], model.background_model_id)
+            self.assertTrue(numpy.all(validity[expected_validity]), model.background_model_id)
+            validity = numpy.zeros((4, 3), dtype=bool)
+            with numpy.errstate(divide="ignore", invalid="ignore", over="ignore"):
+                integrated = model.integrate_signal_data(data, fit_slices, xs, slice(100, 200), fs, validity=validity)
+            self.assertTrue(numpy.all(numpy.isfinite(integrated)), model.background_model_id)
+            self.assertTrue(numpy.allclose(numpy.trapz(data[~validity][..., 100:200]), integrated[~validity]), model.background_model_id)
+            self.assertFalse(validity[3, 0], model.background_model_id)
+            self.assertTrue(numpy.all(validity[expected_validity]), model.background_model_id)
+
+    def test_weighted_log_fits_match_per_spectrum_weighted_polyfit(self):
+        xs = numpy.linspace(400.0, 500.0, 100)
+        fs = numpy.linspace(400.0, 600.0, 200)
+        yss = numpy.random.RandomState(1).poisson(50 * numpy.power(xs / xs[0], -3), (8, len(xs))).astype(numpy.float64)
+        model = BackgroundModel.PolynomialBackgroundModel("test_model", 2, transform=numpy.log, untransform=numpy.exp,
+                                                          weight=BackgroundModel.poisson_log_weights)
+        fit = model._perform_fits(xs, yss, fs)
+        for ys, ys_fit in zip(yss, fit):
+            valid = ys > 0
+            coefficients = numpy.polynomial.polynomial.polyfit(xs[valid], numpy.log(ys[valid]), 2, w=numpy.sqrt(ys[valid]))
+            self.assertTrue(numpy.allclose(numpy.exp(numpy.polynomial.polynomial.polyval(fs, coefficients)), ys_fit))
+
+    def test_weighted_log_fit_excludes_invalid_channels_and_flags_invalid_spectra(self):
+        xs = numpy.linspace(400.0, 500.0, 100)
+        fs = numpy.linspace(400.0, 600.0, 200)
+        yss = self.__power_law_spectra(3, xs)
+        expected = BackgroundModel.PolynomialBackgroundModel("test_model", 1, transform=numpy.log, untransform=numpy.exp)._perform_fits(xs, yss, fs)
+        yss[0, 10:20] = 0
+        yss[1, 30] = numpy.nan
+        yss[2, 1:] = -1
+        model = BackgroundModel.PolynomialBackgroundModel("test_model", 1, transform=numpy.log, untransform=numpy.exp,
+                                                          weight=BackgroundModel.poisson_log_weights)
+        fit = model._perform_fits(xs, yss, fs)
+        self.assertTrue(numpy.allclose(expected[0], fit[0], rtol=1E-2))
+        self.assertTrue(numpy.allclose(expected[1], fit[1], rtol=1E-2))
+        self.assertTrue(numpy.all(numpy.isnan(fit[2])))
+        self.assertTrue(numpy.allclose(numpy.trapz(fit), model._integrate_fits(xs, yss, fs), equal_nan=True))
+
+    def test_nonlinear_power_law_recovers_exact_parameters(self):
+        xs = numpy.linspace(400.0, 500.0, 100)
+        amplitudes = numpy.array([1E8, 5E8, 1E9])
+        exponents = numpy.array([2.0, 3.0, 4.0])
+        yss = amplitudes[:, numpy.newaxis] * numpy.power(xs, -exponents[:, numpy.newaxis])
+        x_reference = 450.0
+        fit_amplitudes, fit_exponents, iterations, converged = BackgroundModel.power_law_least_squares_params(xs, yss, x_reference)
+        self.assertTrue(numpy.all(converged))
+        self.assertTrue(numpy.allclose(exponents, fit_exponents))
+        self.assertTrue(numpy.allclose(amplitudes * x_reference ** -exponents, fit_amplitudes))
+
+    def test_nonlinear_power_law_fits_that_do_not_converge_are_invalid(self):
+        xs = numpy.linspace(400.0, 500.0, 100)
+        fs = numpy.linspace(500.0, 600.0, 100)
+        # the peak on the second spectrum moves the least squares fit far from the log-log seed, which takes more than two iterations.
+        yss = numpy.stack([1E8 * numpy.power(xs, -3), 1E8 * numpy.power(xs, -3) + 1E8 * 400.0 ** -3 * numpy.exp(-numpy.square((xs - 480) / 5))])
+        model = BackgroundModel.NonlinearPowerLawBackgroundModel("test_model", max_iterations=2)
+        validity = numpy.empty(2, dtype=bool)
+        background = model.fit_background_data(yss, [slice(0, 100)], xs, fs, validity=validity)
+        self.assertEqual([True, False], validity.tolist())
+        self.assertTrue(numpy.all(background[1] == 0))
+        model.integrate_signal_data(yss, [slice(0, 100)], xs, slice(0, 100), fs, validity=validity)
+        self.assertEqual([True, False], validity.tolist())
+        self.assertTrue(numpy.all(BackgroundModel.NonlinearPowerLawBackgroundModel("test_model").fit_background_data(
+            yss, [slice(0, 100)], xs, fs, validity=validity) > 0))
+        self.assertTrue(numpy.all(validity))
+
+    def test_nonlinear_power_law_is_less_biased_than_log_fit_at_low_counts(self):
+        xs = numpy.linspace(400.0, 500.0, 100)
+        fs = numpy.linspace(500.0, 600.0, 100)
+        expected = numpy.trapz(5 * numpy.power(fs / 400.0, -3))
+        yss = numpy.random.RandomState(2).poisson(5 * numpy.power(xs / 400.0, -3), (400, len(xs))).astype(numpy.float64)
+        log_model = BackgroundModel.PolynomialBackgroundModel("test_model", 1, transform=numpy.log, untransform=numpy.exp,
+                                                              weight=lambda yss: (yss > 0).astype(numpy.float64))
+        nonlinear_model = BackgroundModel.NonlinearPowerLawBackgroundModel("test_model")
+        log_bias = numpy.mean(log_model._integrate_fits(xs, yss, fs)) - expected
+        nonlinear_bias = numpy.mean(nonlinear_model._integrate_fits(xs, yss, fs)) - expected
+        self.assertLess(abs(nonlinear_bias), abs(log_bias) / 2)
+        self.assertTrue(numpy.allclose(numpy.trapz(nonlinear_model._perform_fits(xs, yss, fs)), nonlinear_model._integrate_fits(xs, yss, fs), rtol=1E-9))
+
+    def test_navigation_chunks_cover_each_spectrum_once(self):
+        for navigation_shape, chunk_size in (((7, 5), 3), ((7, 5), 10), ((3, 4, 5), 7), ((3, 4, 5), 1), ((6,), 4), ((2, 3), None)):
+            counts = numpy.zeros(navigation_shape, dtype=int)
+            for chunk in BackgroundModel.iterate_navigation_chunks(navigation_shape, chunk_size):
+                self.assertLessEqual(counts[chunk].size, max(chunk_size or counts.size, 1))
+                counts[chunk] += 1
+            self.assertTrue(numpy.all(counts == 1))
+
+    def test_chunked_fit_into_memmap_matches_unchunked_fit(self):
+        xs_all = numpy.linspace(300.0, 700.0, 400)
+        data = self.__power_law_spectra(6 * 5, xs_all).reshape((6, 5, 400))
+        fit_slices = [slice(50, 100), slice(120, 150)]
+        xs = numpy.concatenate([xs_all[fit_slice] for fit_slice in fit_slices])
+        fs = xs_all[100:300]
+        model = BackgroundModel.PolynomialBackgroundModel("test_model", 1, transform=numpy.log, untransform=numpy.exp)
+        expected = model.fit_background_data(data, fit_slices, xs, fs)
+        self.assertEqual((6, 5, 200), expected.shape)
+        with tempfile.TemporaryDirectory() as directory:
+            data_memmap = numpy.memmap(os.path.join(directory, "data.bin"), dtype=data.dtype, mode="w+", shape=data.shape)
+            data_memmap[...] = data
+            out = numpy.memmap(os.path.join(directory, "out.bin"), dtype=numpy.float64, mode="w+", shape=expected.shape)
+            result = model.fit_background_data(data_memmap, fit_slices, xs, fs, chunk_size=4, out=out)
+            self.assertIs(out, result)
+            self.assertTrue(numpy.allclose(expected, out))
+            del data_memmap, out, result
+
+    def test_chunked_integrate_signal_matches_subtracted_integral(self):
+        xs_all = numpy.linspace(300.0, 700.0, 400)
+        data = self.__power_law_spectra(4 * 3, xs_all).reshape((4, 3, 400))
+        fit_slices = [slice(50, 100)]
+        model = BackgroundModel.PolynomialBackgroundModel("test_model", 1)
+        background = model.fit_background_data(data, fit_slices, xs_all[50:100], xs_all[100:200])
+        expected = numpy.trapz(data[..., 100:200] - background)
+        integrated = model.integrate_signal_data(data, fit_slices, xs_all[50:100], slice(100, 200), xs_all[100:200], chunk_size=5)
+        self.assertTrue(numpy.allclose(expected, integrated))
+
+    def test_integrated_fits_match_integral_of_evaluated_fits(self):
+        xs_all = numpy.linspace(300.0, 700.0, 400)
+        data = self.__power_law_spectra(4 * 3, xs_all).reshape((4, 3, 400))
+        fit_slices = [slice(50, 100)]
+        xs = xs_all[50:100]
+        fs = xs_all[100:200]
+        for model in Registry.get_components_by_type("background-model"):
+            with self.subTest(model=model.background_model_id):
+                background = model.fit_background_data(data, fit_slices, xs, fs)
+                expected = numpy.trapz(data[..., 100:200] - background)
+                integrated = model.integrate_signal_data(data, fit_slices, xs, slice(100, 200), fs, chunk_size=5)
+                self.assertTrue(numpy.allclose(expected, integrated, rtol=0, atol=1E-9 * numpy.amax(numpy.trapz(background))))
+
+    def test_float32_fits_stay_float32_and_match_float64_fits(self):
+        xs_all = numpy.linspace(300.0, 700.0, 400)
+        data = self.__power_law_spectra(4 * 3, xs_all).reshape((4, 3, 400)).astype(numpy.float32)
+        fit_slices = [slice(50, 100)]
+        xs = xs_all[50:100]
+        fs = xs_all[100:200]
+        for model in Registry.get_components_by_type("background-model"):
+            with self.subTest(model=model.background_model_id):
+                expected = model.fit_background_data(data, fit_slices, xs, fs)
+                background = model.fit_background_data(data, fit_slices, xs, fs, dtype=numpy.float32)
+                self.assertEqual(numpy.float32, background.dtype)
+                self.assertTrue(numpy.allclose(expected, background, rtol=0, atol=1E-4 * numpy.amax(numpy.abs(expected))))
+                expected_integrated = model.integrate_signal_data(data, fit_slices, xs, slice(100, 200), fs)
+                integrated = model.integrate_signal_data(data, fit_slices, xs, slice(100, 200), fs, dtype=numpy.float32)
+                self.assertEqual(numpy.float64, integrated.dtype)
+                self.assertTrue(numpy.allclose(expected_integrated, integrated, rtol=0, atol=1E-4 * numpy.amax(numpy.trapz(expected))))
+
+    def test_exponential_trapz_matches_trapz(self):
+        channels = numpy.arange(50)
+        for a, b in ((1.0, 0.1), (2.0, -0.05), (0.5, 0.0), (-1.0, 1E-14)):
+            self.assertAlmostEqual(numpy.trapz(numpy.exp(a + b * channels)), float(BackgroundModel.exponential_trapz(a, b, len(channels))))
+
+    def test_parallel_fits_match_serial_fits(self):
+        xs_all = numpy.linspace(300.0, 700.0, 400)
+        data = self.__power_law_spectra(6 * 5, xs_all).reshape((6, 5, 400))
+        fit_slices = [slice(50, 100)]
+        xs = xs_all[50:100]
+        fs = xs_all[100:200]
+        model = BackgroundModel.PolynomialBackgroundModel("test_model", 1, transform=numpy.log, untransform=numpy.exp)
+        expected_background = model.fit_background_data(data, fit_slices, xs, fs)
+        expected_integrated = model.integrate_signal_data(data, fit_slices, xs, slice(100, 200), fs)
+        parallel_minimum_size = BackgroundModel.PARALLEL_MINIMUM_SIZE
+        BackgroundModel.PARALLEL_MINIMUM_SIZE = 0
+        try:
+            background = model.fit_background_data(data, fit_slices, xs, fs, workers=2, chunk_size=4)
+            self.assertTrue(numpy.allclose(expected_background, background))
+            with tempfile.TemporaryDirectory() as directory:
+                data_memmap = numpy.memmap(os.path.join(directory, "data.bin"), dtype=data.dtype, mode="w+", shape=data.shape)
+                data_memmap[...] = data
+                data_memmap.flush()
+                integrated = model.integrate_signal_data(data_memmap, fit_slices, xs, slice(100, 200), fs, workers=2)
+                self.assertTrue(numpy.allclose(expected_integrated, integrated))
+                del data_memmap
+        finally:
+            BackgroundModel.PARALLEL_MINIMUM_SIZE = parallel_minimum_size
+
+    def test_channel_offsets_fit_drifting_spectra_as_if_aligned(self):
+        xs_all = numpy.linspace(290.0, 710.0, 420)
+        spectra = self.__power_law_spectra(4 * 3, xs_all).reshape((4, 3, 420))
+        offsets = numpy.random.RandomState(0).randint(-5, 6, (4, 3))
+        # channel c of each drifting spectrum is at channel c + offset of the aligned spectrum, which spans channels 10 to 410.
+        aligned = spectra[..., 10:410]
+        data = numpy.stack([spectra[index + (slice(10 - offset, 410 - offset),)] for index, offset in numpy.ndenumerate(offsets)]).reshape(aligned.shape)
+        fit_slices = [slice(50, 100)]
+        xs = xs_all[60:110]
+        fs = xs_all[110:210]
+        signal_slices = [slice(100, 150), slice(150, 200)]
+        for model in Registry.get_components_by_type("background-model"):
+            with self.subTest(model=model.background_model_id):
+                expected = model.fit_background_data(aligned, fit_slices, xs, fs)
+                background = model.fit_background_data(data, fit_slices, xs, fs, chunk_size=5, channel_offsets=offsets)
+                self.assertTrue(numpy.allclose(expected, background))
+                expected_integrated = model.integrate_signal_data(aligned, fit_slices, xs, slice(100, 200), fs)
+                integrated = model.integrate_signal_data(data, fit_slices, xs, slice(100, 200), fs, channel_offsets=offsets)
+                self.assertTrue(numpy.allclose(expected_integrated, integrated))
+                expected_integrated = model.integrate_signals_data(aligned, fit_slices, xs, signal_slices, fs)
+                integrated = model.integrate_signals_data(data, fit_slices, xs, signal_slices, fs, channel_offsets=offsets)
+                self.assertTrue(numpy.allclose(expected_integrated, integrated))
+        model = BackgroundModel.PolynomialBackgroundModel("test_model", 1, transform=numpy.log, untransform=numpy.exp)
+        with self.assertRaises(ValueError):
+            model.fit_background_data(data, fit_slices, xs, fs, channel_offsets=offsets, binning=2)
+        parallel_minimum_size = BackgroundModel.PARALLEL_MINIMUM_SIZE
+        BackgroundModel.PARALLEL_MINIMUM_SIZE = 0
+        try:
+            expected = model.fit_background_data(aligned, fit_slices, xs, fs)
+            background = model.fit_background_data(data, fit_slices, xs, fs, workers=2, channel_offsets=offsets)
+            self.assertTrue(numpy.allclose(expected, background))
+        finally:
+            BackgroundModel.PARALLEL_MINIMUM_SIZE = parallel_minimum_size
+
+    def test_channel_offsets_beyond_the_data_make_fits_invalid_for_every_model(self):
+        xs_all = numpy.linspace(300.0, 700.0, 400)
+        data = self.__power_law_spectra(3, xs_all)
+        offsets = numpy.array([-5.0, 0.0, 2.5])
+        fit_slices = [slice(2, 60)]
+        xs = xs_all[2:60]
+        fs = xs_all[60:160]
+        for model in Registry.get_components_by_type("background-model"):
+            with self.subTest(model=model.background_model_id):
+                validity = numpy.empty(3, dtype=bool)
+                background = model.fit_background_data(data, fit_slices, xs, fs, channel_offsets=offsets, validity=validity)
+                self.assertEqual([False, True, True], validity.tolist())
+                self.assertTrue(numpy.all(background[0] == 0))
+                model.fit_background_params(data, fit_slices, xs, channel_offsets=offsets, validity=validity)
+                self.assertEqual([False, True, True], validity.tolist())
+                model.integrate_signal_data(data, fit_slices, xs, slice(60, 160), fs, channel_offsets=offsets, validity=validity)
+                self.assertEqual([False, True, True], validity.tolist())
+                model.integrate_signals_data(data, fit_slices, xs, [slice(60, 100), slice(100, 160)], fs, channel_offsets=offsets, validity=validity)
+                self.assertEqual([False, True, True], validity.tolist())
+
+    def test_cumulative_sum_two_area_fits_match_direct_fits(self):
+        xs_all = numpy.linspace(300.0, 700.0, 400)
+        data = self.__power_law_spectra(4 * 3, xs_all).reshape((4, 3, 400))
+        data[0, 0, 10] = 0  # invalid for the exponential model outside of the fit windows
+        fs = xs_all[100:300]
+        for background_model_id in ("power_law_two_area_background_model", "exponential_two_area_background_model"):
+            model = next(model for model in Registry.get_components_by_type("background-model") if model.background_model_id == background_model_id)
+            for fit_slice in (slice(50, 100), slice(61, 100), slice(5, 100)):
+                xs = xs_all[fit_slice]
+                with numpy.errstate(divide="ignore", invalid="ignore"):
+                    expected_background = model.fit_background_data(data, [fit_slice], xs, fs)
+                    expected_integrated = model.integrate_signal_data(data, [fit_slice], xs, slice(100, 300), fs)
+                background = model.fit_background_data(data, [fit_slice], xs, fs, cumulative_sums=True, chunk_size=5)
+                integrated = model.integrate_signal_data(data, [fit_slice], xs, slice(100, 300), fs, cumulative_sums=True)
+                self.assertTrue(numpy.allclose(expected_background, background, equal_nan=True))
+                self.assertTrue(numpy.allclose(expected_integrated, integrated, equal_nan=True))
+            integrated = model.integrate_signal_data(data, [slice(50, 100)], xs_all[50:100], slice(100, 300), fs, cumulative_sums=True)
+            self.assertTrue(numpy.all(numpy.isfinite(integrated)))
+
+    def test_cumulative_sum_table_is_reused_for_same_data(self):
+        data = self.__power_law_spectra(6, numpy.linspace(300.0, 700.0, 40))
+        table = BackgroundModel.cumulative_sum_tables.get_table(data)
+        self.assertIs(table, BackgroundModel.cumulative_sum_tables.get_table(data))
+        self.assertIsNot(table, BackgroundModel.cumulative_sum_tables.get_table(data.copy()))
+        self.assertIsNot(table, BackgroundModel.cumulative_sum_tables.get_table(data, numpy.log))
+        self.assertTrue(numpy.allclose(numpy.trapz(data[:, 7:19], axis=-1), table.window_trapz((slice(None),), slice(7, 19))))
+        # tables are rebuilt when data is modified in place, or when the data version supplied by the caller changes.
+        table = BackgroundModel.cumulative_sum_tables.get_table(data)
+        data[2, 10] += 1
+        table = BackgroundModel.cumulative_sum_tables.get_table(data)
+        self.assertTrue(numpy.allclose(numpy.trapz(data[:, 7:19], axis=-1), table.window_trapz((slice(None),), slice(7, 19))))
+        table = BackgroundModel.cumulative_sum_tables.get_table(data, data_version=1)
+        self.assertIs(table, BackgroundModel.cumulative_sum_tables.get_table(data, data_version=1))
+        self.assertIsNot(table, BackgroundModel.cumulative_sum_tables.get_table(data, data_version=2))
+
+    def test_cumulative_sum_table_with_data_version_is_reused_for_new_arrays_of_same_data(self):
+        xs_all = numpy.linspace(300.0, 700.0, 40)
+        data = self.__power_law_spectra(6, xs_all)
+        table = BackgroundModel.cumulative_sum_tables.get_table(data, data_version=1)
+        # a new array of the same data version (e.g. a new xdata of an unchanged data item) reuses the table without reading the data.
+        self.assertIs(table, BackgroundModel.cumulative_sum_tables.get_table(data.copy(), data_version=1))
+        self.assertIsNot(table, BackgroundModel.cumulative_sum_tables.get_table(data[:3].copy(), data_version=1))
+        model = next(model for model in Registry.get_components_by_type("background-model") if model.background_model_id == "power_law_two_area_background_model")
+        fs = xs_all[20:30]
+        expected = model.integrate_signal_data(data, [slice(5, 15)], xs_all[5:15], slice(20, 30), fs)
+        integrated = model.integrate_signal_data(data.copy(), [slice(5, 15)], xs_all[5:15], slice(20, 30), fs, cumulative_sums=True, data_version=2)
+        self.assertTrue(numpy.allclose(expected, integrated))
+        table = BackgroundModel.cumulative_sum_tables.get_table(data.copy(), model.window_transform, data_version=2)
+        integrated = model.integrate_signal_data(data.copy(), [slice(6, 15)], xs_all[6:15], slice(20, 30), fs, cumulative_sums=True, data_version=2)
+        self.assertIs(table, BackgroundModel.cumulative_sum_tables.get_table(data.copy(), model.window_transform, data_version=2))
+        self.assertTrue(numpy.allclose(model.integrate_signal_data(data, [slice(6, 15)], xs_all[6:15], slice(20, 30), fs), integrated))
+
+    def test_binned_fits_match_fits_of_binned_data(self):
+        xs_all = numpy.linspace(300.0, 700.0, 400)
+        data = self.__power_law_spectra(5 * 7, xs_all).reshape((5, 7, 400))
+        fit_slices = [slice(50, 100)]
+        xs = xs_all[50:100]
+        fs = xs_all[100:200]
+        model = BackgroundModel.PolynomialBackgroundModel("test_model", 1, transform=numpy.log, untransform=numpy.exp)
+        block_background = model.fit_background_data(numpy.mean(data[2:4, 4:6], axis=(0, 1))[numpy.newaxis], fit_slices, xs, fs)[0]
+        edge_background = model.fit_background_data(numpy.mean(data[4:, 6:], axis=(0, 1))[numpy.newaxis], fit_slices, xs, fs)[0]
+        background = model.fit_background_data(data, fit_slices, xs, fs, binning=2, chunk_size=3)
+        self.assertTrue(numpy.allclose(block_background, background[2, 4]))
+        self.assertTrue(numpy.allclose(block_background, background[3, 5]))
+        self.assertTrue(numpy.allclose(edge_background, background[4, 6]))
+        integrated = model.integrate_signal_data(data, fit_slices, xs, slice(100, 200), fs, binning=2)
+        self.assertTrue(numpy.allclose(numpy.trapz(data[..., 100:200] - background), integrated))
+        # bilinear interpolation of identical blocks reproduces the unbinned fit.
+        data[...] = data[0, 0]
+        expected_integrated = model.integrate_signal_data(data, fit_slices, xs, slice(100, 200), fs)
+        integrated = model.integrate_signal_data(data, fit_slices, xs, slice(100, 200), fs, binning=3, interpolation="bilinear")
+        self.assertTrue(numpy.allclose(expected_integrated, integrated))
+
+    def test_power_law_combination_fits_recover_exact_amplitudes(self):
+        xs = numpy.linspace(400.0, 500.0, 100)
+        fs = numpy.linspace(400.0, 600.0, 200)
+        amplitudes = numpy.random.RandomState(0).uniform(0, 1E9, (6, 2))
+        x_reference = numpy.sqrt(400.0 * 500.0)
+        exponents = numpy.array([2.5, 3.5])
+        yss = numpy.dot(amplitudes, numpy.power(xs / x_reference, -exponents[:, numpy.newaxis]))
+        expected = numpy.dot(amplitudes, numpy.power(fs / x_reference, -exponents[:, numpy.newaxis]))
+        model = BackgroundModel.PowerLawCombinationBackgroundModel("test_model", exponents=exponents)
+        self.assertTrue(numpy.allclose(expected, model._perform_fits(xs, yss, fs)))
+        # a power law steeper than both exponents is fit with nonnegative amplitudes.
+        plan = BackgroundModel.fit_plan_cache.get_plan(BackgroundModel.PowerLawCombinationFitPlan, xs, exponents, fs)
+        fit_amplitudes = plan.fit_amplitudes(numpy.power(xs / x_reference, -5.0)[numpy.newaxis, :])
+        self.assertTrue(numpy.all(fit_amplitudes >= 0))
+        self.assertEqual(0, fit_amplitudes[0, 0])
+
+    def test_power_law_combination_exponents_are_taken_from_all_data(self):
+        xs_all = numpy.linspace(300.0, 700.0, 400)
+        data = self.__power_law_spectra(6 * 5, xs_all).reshape((6, 5, 400))
+        fit_slices = [slice(50, 100)]
+        xs = xs_all[50:100]
+        fs = xs_all[100:200]
+        model = BackgroundModel.PowerLawCombinationBackgroundModel("test_model")
+        exponents = model.get_exponents(xs, numpy.sum(data[..., 50:100], axis=(0, 1)))
+        self.assertAlmostEqual(1.0, exponents[1] - exponents[0])
+        expected_background = BackgroundModel.PowerLawCombinationBackgroundModel("test_model", exponents=exponents)._perform_fits(
+            xs, numpy.reshape(data[..., 50:100], (-1, 50)), fs)
+        background = model.fit_background_data(data, fit_slices, xs, fs, chunk_size=4)
+        self.assertTrue(numpy.allclose(numpy.reshape(expected_background, background.shape), background))
+        integrated = model.integrate_signal_data(data, fit_slices, xs, slice(100, 200), fs, chunk_size=7)
+        self.assertTrue(numpy.allclose(numpy.trapz(data[..., 100:200] - background), integrated))
+        self.assertIsNone(model.exponents)
+
+    def test_multiple_signal_windows_match_single_window_integrals(self):
+        xs_all = numpy.linspace(300.0, 700.0, 400)
+        data = self.__power_law_spectra(4 * 3, xs_all).reshape((4, 3, 400))
+        data[1, 2] = numpy.nan
+        fit_slices = [slice(50, 100)]
+        xs = xs_all[50:100]
+        signal_slices = [slice(120, 160), slice(100, 130), slice(200, 201), slice(150, 300)]
+        for model in Registry.get_components_by_type("background-model"):
+            with numpy.errstate(divide="ignore", invalid="ignore"):
+                expected = [model.integrate_signal_data(data, fit_slices, xs, signal_slice, xs_all[signal_slice]) for signal_slice in signal_slices]
+                validity = numpy.empty((4, 3), dtype=bool)
+                integrated = model.integrate_signals_data(data, fit_slices, xs, signal_slices, xs_all[100:300], chunk_size=5, validity=validity)
+            self.assertEqual((4, 3, 4), integrated.shape)
+            for i, expected_integrated in enumerate(expected):
+                self.assertTrue(numpy.allclose(expected_integrated, integrated[..., i], rtol=1E-4, equal_nan=True), model.background_model_id)
+            self.assertFalse(validity[1, 2])
+            self.assertEqual(11, numpy.count_nonzero(validity))
+
+    def test_multiple_signal_windows_match_single_window_integrals_on_channel_domains(self):
+        # an energy axis whose channels are not at whole multiples of the scale, like a signal window that is not channel aligned.
+        calibration = Calibration.Calibration(offset=300.37, scale=0.83, units="eV")
+        xs_all = BackgroundModel.get_channel_domain(calibration, slice(0, 400))
+        data = self.__power_law_spectra(6, xs_all).reshape((2, 3, 400))
+        fit_slices = [slice(50, 100)]
+        xs = xs_all[50:100]
+        signal_slices = [slice(120, 160), slice(100, 130), slice(150, 300)]
+        fs = BackgroundModel.get_channel_domain(calibration, slice(100, 300))
+        for model in Registry.get_components_by_type("background-model"):
+            with self.subTest(model=model.background_model_id):
+                integrated = model.integrate_signals_data(data, fit_slices, xs, signal_slices, fs)
+                for i, signal_slice in enumerate(signal_slices):
+                    signal_fs = BackgroundModel.get_channel_domain(calibration, signal_slice)
+                    self.assertTrue(numpy.array_equal(fs[signal_slice.start - 100:signal_slice.stop - 100], signal_fs))
+                    expected = model.integrate_signal_data(data, fit_slices, xs, signal_slice, signal_fs)
+                    self.assertTrue(numpy.allclose(expected, integrated[..., i], rtol=1E-4))
+
+    def test_lazy_backgrounds_match_evaluated_backgrounds(self):
+        xs_all = numpy.linspace(300.0, 700.0, 400)
+        data = self.__power_law_spectra(4 * 3, xs_all).reshape((4, 3, 400))
+        data[3, 0] = numpy.nan
+        fit_slices = [slice(50, 100)]
+        xs = xs_all[50:100]
+        fs = xs_all[100:300]
+        for model in Registry.get_components_by_type("background-model"):
+            with numpy.errstate(divide="ignore", invalid="ignore"):
+                expected = model.fit_background_data(data, fit_slices, xs, fs)
+                validity = numpy.empty((4, 3), dtype=bool)
+                params = model.fit_background_params(data, fit_slices, xs, chunk_size=5, validity=validity)
+            background = BackgroundModel.LazyBackground(model, xs, fs, params, validity)
+            self.assertEqual(expected.shape, background.shape)
+            self.assertLess(params.shape[-1], len(fs))
+            self.assertFalse(validity[3, 0])
+            for key in ((2, 1), (slice(1, 3),), (Ellipsis, 5), (slice(None), 0, slice(10, 20)), (3, 0), (numpy.array([0, 0, 2]), 1)):
+                self.assertTrue(numpy.allclose(expected[key], background[key], rtol=1E-4), model.background_model_id)
+            self.assertTrue(numpy.allclose(expected, background.evaluate(chunk_size=5), rtol=1E-4))
+        model = BackgroundModel.PolynomialBackgroundModel("test_model", 1, transform=numpy.log, untransform=numpy.exp)
+        params = model.fit_background_params(data, fit_slices, xs, binning=2)
+        background = BackgroundModel.LazyBackground(model, xs, fs, params)
+        self.assertTrue(numpy.allclose(model.fit_background_data(data, fit_slices, xs, fs, binning=2), background.evaluate()))
+
+    def test_data_digest_depends_only_on_contents(self):
+        data = self.__power_law_spectra(6, numpy.linspace(300.0, 700.0, 40)).reshape((2, 3, 40))
+        digest = BackgroundModel.get_data_digest(data)
+        self.assertEqual(digest, BackgroundModel.get_data_digest(data.copy()))
+        self.assertEqual(BackgroundModel.get_data_digest(numpy.ascontiguousarray(data[:, ::2])), BackgroundModel.get_data_digest(data[:, ::2]))
+        self.assertNotEqual(digest, BackgroundModel.get_data_digest(data.astype(numpy.float32)))
+        self.assertNotEqual(digest, BackgroundModel.get_data_digest(data.reshape((3, 2, 40))))
+        data[1, 2, 30] += 1
+        self.assertNotEqual(digest, BackgroundModel.get_data_digest(data))
+
+    def test_result_cache_evicts_least_recently_used_results_by_size(self):
+        cache = BackgroundModel.BackgroundResultCache(3000)
+        computed = list()
+
+        def compute(n: int) -> typing.Dict[str, typing.Any]:
+            computed.append(n)
+            return {"integrated": numpy.zeros(n // 8)}
+
+        result = cache.get_result(("a",), lambda: compute(1000))
+        self.assertIs(result["integrated"], cache.get_result(("a",), lambda: compute(1000))["integrated"])
+        cache.get_result(("b",), lambda: compute(1000))
+        cache.get_result(("a",), lambda: compute(1000))
+        cache.get_result(("c",), lambda: compute(1600))
+        self.assertEqual([1000, 1000, 1600], computed)
+        self.assertEqual(2600, cache.nbytes)
+        cache.get_result(("a",), lambda: compute(1000))
+        cache.get_result(("b",), lambda: compute(1000))
+        self.assertEqual([1000, 1000, 1600, 1000], computed)
+        # results larger than the cache are not cached.
+        cache.get_result(("d",), lambda: compute(4000))
+        cache.get_result(("d",), lambda: compute(4000))
+        self.assertEqual(2, computed.count(4000))
+        self.assertEqual(2, len(cache))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -80,5 +80,22 @@ class TestLibrary(unittest.TestCase):
         self.assertAlmostEqual(numpy.amax(signal_slice), numpy.amax(edge_profile), 2 + log10_scale)  # within 1/100
         self.assertAlmostEqual(numpy.average(signal_slice), numpy.average(edge_profile), 4 + log10_scale)  # within 1/10000
 
+    def test_core_loss_edges_match_core_loss_edge_of_each_edge(self):
+        scale = 1E4
+        background = scale * numpy.power(numpy.linspace(1,10,1000), -3)
+        spectra = background * numpy.random.RandomState(0).uniform(0.9, 1.1, (3, 4, 1000))
+        spectral_range = numpy.array([0, 1000])
+        edges = [(300.0, 80.0, numpy.array([[200.0, 250.0], [260.0, 290.0]]), 0),
+                 (500.0, 100.0, numpy.array([400.0, 500.0]), 1),
+                 (550.0, 50.0, numpy.array([450.0, 540.0]), 2)]
+        edge_data = analyzer.core_loss_edges(spectra, spectral_range, edges, chunk_size=4)
+        self.assertEqual(len(edges), len(edge_data))
+        for (edge_onset, edge_delta, bkgd_range, background_model_ID), results in zip(edges, edge_data):
+            expected_results = analyzer.core_loss_edge(spectra, spectral_range, edge_onset, edge_delta, bkgd_range, background_model_ID)
+            self.assertEqual(len(expected_results), len(results))
+            for expected_result, result in zip(expected_results, results):
+                self.assertEqual(expected_result.shape, result.shape)
+                self.assertTrue(numpy.allclose(expected_result, result))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,269 @@
+# run this from the command line using:
+# python -m unittest nion/eels_analysis/test/CurveFittingAndAnalysis_test.py
+
+import os
+import tempfile
+import unittest
+
+import numpy
+
+from nion.eels_analysis import CurveFittingAndAnalysis
+
+
+class TestCurveFittingAndAnalysis(unittest.TestCase):
+
+    def setUp(self):
+        """Common code for all tests can go here."""
+        CurveFittingAndAnalysis.fit_matrix_cache.clear()
+
+    def tearDown(self):
+        """Common code for all tests can go here."""
+        pass
+
+    def __power_law_spectra(self, m: int, x_values: numpy.ndarray) -> numpy.ndarray:
+        amplitudes = numpy.random.RandomState(0).uniform(1E8, 1E9, (m, 1))
+        exponents = numpy.random.RandomState(1).uniform(2, 4, (m, 1))
+        return amplitudes * numpy.power(x_values, -exponents)
+
+    def test_log_fit_excludes_non_positive_values_and_flags_invalid_curves(self):
+        x_values = numpy.linspace(400.0, 500.0, 100)
+        data_values = self.__power_law_spectra(4, x_values)
+        data_values[1, 10] = -1
+        data_values[2, 20:30] = 0
+        data_values[3, 1:] = 0
+        polynomial_fit = CurveFittingAndAnalysis.PolynomialCurveFit(x_values, 1, fit_log_x=True)
+        polynomial_fit.compute_fit_for_data(data_values, fit_log_data=True)
+        self.assertEqual([True, True, True, False], polynomial_fit.get_fit_validity().tolist())
+        fit_values = polynomial_fit.evaluate_fit_at(x_values)
+        # the spectra are exact power laws, so excluding channels does not change the fit of the valid curves
+        self.assertTrue(numpy.allclose(self.__power_law_spectra(4, x_values)[:3], fit_values[:3]))
+        self.assertTrue(numpy.all(numpy.isnan(fit_values[3])))
+
+    def test_polynomial_fit_of_higher_order_polynomials(self):
+        x_values = numpy.linspace(1000.0, 3000.0, 500)
+        # the power basis includes all powers up to the polynomial order.
+        data_values = 3 + 2 * x_values + 0.01 * numpy.square(x_values)
+        polynomial_fit = CurveFittingAndAnalysis.PolynomialCurveFit(x_values, 2)
+        polynomial_fit.compute_fit_for_data(data_values[numpy.newaxis])
+        self.assertTrue(numpy.allclose([[3, 2, 0.01]], polynomial_fit.get_fit_coefficients()))
+        # orthogonal bases fit polynomials of orders that are ill-conditioned in the power basis.
+        coefficients = numpy.random.RandomState(0).uniform(-1, 1, 8)
+        data_values = numpy.polynomial.legendre.legval((x_values - 2000.0) / 1000.0, coefficients)
+        for polynomial_basis in ("chebyshev", "legendre"):
+            polynomial_fit = CurveFittingAndAnalysis.PolynomialCurveFit(x_values, 7, polynomial_basis=polynomial_basis)
+            polynomial_fit.compute_fit_for_data(data_values[numpy.newaxis])
+            self.assertTrue(numpy.allclose(data_values, polynomial_fit.evaluate_fit_at(x_values)))
+        self.assertTrue(numpy.allclose([coefficients], polynomial_fit.get_fit_coefficients()))
+
+    def test_signal_from_polynomial_background_returns_validity(self):
+        expected_values = self.__power_law_spectra(3, numpy.arange(200.0, 400.0, 1.0))
+        data_values = expected_values.copy()
+        data_values[1, 50:60] = 0
+        data_values[2, 50:100] = 0
+        signal_integral, signal_profile, background_model, profile_range, fit_validity = \
+            CurveFittingAndAnalysis.signal_from_polynomial_background(data_values, numpy.array([200.0, 400.0]), numpy.array([300.0, 350.0]),
+                                                                      numpy.array([250.0, 300.0]), 1, True, True, return_validity=True)
+        self.assertEqual([True, True, False], fit_validity.tolist())
+        self.assertTrue(numpy.allclose(expected_values[:2, 50:150], background_model[:2], rtol=1E-4))
+        self.assertTrue(numpy.all(numpy.isnan(signal_integral[2])))
+
+    def test_signal_extraction_plan_applies_to_many_data_arrays(self):
+        x_values = numpy.arange(200.0, 400.0, 1.0)
+        data_x_range = numpy.array([200.0, 400.0])
+        signal_x_range = numpy.array([300.0, 350.0])
+        # overlapping and separate fit ranges, in any order, are consolidated into three ranges
+        fit_x_ranges = numpy.array([[280.0, 290.0], [210.0, 220.0], [215.0, 230.0], [250.0, 260.0]])
+        extraction_plan = CurveFittingAndAnalysis.SignalExtractionPlan(x_values.size, data_x_range, signal_x_range, fit_x_ranges, 1, True, True)
+        self.assertEqual([[210.0, 230.0], [250.0, 260.0], [280.0, 290.0]], extraction_plan.fit_ranges.tolist())
+        self.assertEqual(40, extraction_plan.fit_indices.size)
+        for m in (3, 5):
+            expected_values = self.__power_law_spectra(m, x_values)
+            data_values = expected_values.copy()
+            data_values[1, 10:15] = 0
+            signal_integral, signal_profile, background_model, profile_range, fit_validity = extraction_plan.apply(data_values, True)
+            self.assertEqual([210.0, 350.0], profile_range.tolist())
+            self.assertTrue(numpy.all(fit_validity))
+            self.assertTrue(numpy.allclose(expected_values[:, 10:150], background_model, rtol=1E-4))
+            expected_results = CurveFittingAndAnalysis.signal_from_polynomial_background(data_values, data_x_range, signal_x_range, fit_x_ranges,
+                                                                                         1, True, True, return_validity=True)
+            for expected_result, result in zip(expected_results, (signal_integral, signal_profile, background_model, profile_range, fit_validity)):
+                self.assertTrue(numpy.array_equal(expected_result, result))
+
+    def test_fit_matrices_are_reused_for_equal_model_curves(self):
+        x_values = numpy.linspace(400.0, 500.0, 100)
+        data_values = self.__power_law_spectra(4, x_values)
+        first_fit = CurveFittingAndAnalysis.PolynomialCurveFit(x_values, 1, fit_log_x=True)
+        second_fit = CurveFittingAndAnalysis.PolynomialCurveFit(x_values.copy(), 1, fit_log_x=True)
+        self.assertEqual(1, len(CurveFittingAndAnalysis.fit_matrix_cache))
+        self.assertIs(first_fit._multicurve_fit._normalized_fit_matrix, second_fit._multicurve_fit._normalized_fit_matrix)
+        CurveFittingAndAnalysis.PolynomialCurveFit(x_values, 2, fit_log_x=True)
+        CurveFittingAndAnalysis.PolynomialCurveFit(x_values[1:], 1, fit_log_x=True)
+        self.assertEqual(3, len(CurveFittingAndAnalysis.fit_matrix_cache))
+        first_fit.compute_fit_for_data(data_values, fit_log_data=True)
+        CurveFittingAndAnalysis.fit_matrix_cache.clear()
+        expected_fit = CurveFittingAndAnalysis.PolynomialCurveFit(x_values, 1, fit_log_x=True)
+        expected_fit.compute_fit_for_data(data_values, fit_log_data=True)
+        self.assertTrue(numpy.array_equal(expected_fit.get_fit_coefficients(), first_fit.get_fit_coefficients()))
+
+    def test_chunked_fit_matches_fit_of_all_data(self):
+        x_values = numpy.linspace(400.0, 500.0, 100)
+        data_values = self.__power_law_spectra(5 * 3, x_values).reshape((5, 3, 100)) * numpy.random.RandomState(2).uniform(0.9, 1.1, (5, 3, 100))
+        data_values[1, 2, 10:20] = 0
+        model_curves = numpy.stack([numpy.ones_like(x_values), numpy.log(x_values)])
+        multicurve_fit = CurveFittingAndAnalysis.MultipleCurveFit(model_curves)
+        with numpy.errstate(divide = 'ignore'):
+            log_values = numpy.log(data_values)
+        multicurve_fit.compute_fit_for_data(log_values, numpy.isfinite(log_values))
+        with tempfile.TemporaryDirectory() as directory:
+            data_memmap = numpy.lib.format.open_memmap(os.path.join(directory, "data.npy"), mode = 'w+', dtype = numpy.float32, shape = data_values.shape)
+            data_memmap[...] = data_values
+            curves_out = numpy.lib.format.open_memmap(os.path.join(directory, "curves.npy"), mode = 'w+', shape = data_values.shape)
+            coefficients, integrals, curves, residuals = multicurve_fit.compute_fit_for_data_in_chunks(
+                data_memmap, chunk_size = 4, curves_out = curves_out, transform = numpy.log)
+            self.assertIsNone(residuals)
+            self.assertIs(curves_out, curves)
+            self.assertTrue(numpy.allclose(multicurve_fit.get_fit_coefficients(), coefficients))
+            self.assertTrue(numpy.allclose(multicurve_fit.get_fit_integrals()[..., 0], integrals))
+            self.assertTrue(numpy.allclose(multicurve_fit.get_fit_curves(), curves))
+            del data_memmap, curves_out, curves
+
+    def test_mlls_fit_separates_overlapping_references(self):
+        x_values = numpy.arange(500.0, 700.0, 1.0)
+        edge_1 = 1 / (1 + numpy.exp(-(x_values - 550.0) / 2.0)) * numpy.power(x_values / 550.0, -2.0)
+        edge_2 = 1 / (1 + numpy.exp(-(x_values - 565.0) / 2.0)) * numpy.power(x_values / 565.0, -2.5) * (1 + numpy.exp(-numpy.square(x_values - 570.0) / 8))
+        reference_curves = numpy.stack([edge_1, edge_2])
+        amplitudes = numpy.random.RandomState(0).uniform(0, 100, (4, 3, 2))
+        background_amplitudes = numpy.random.RandomState(1).uniform(1E3, 2E3, (4, 3, 1))
+        background = background_amplitudes * numpy.power(x_values / 600.0, -3.0)
+        data_values = numpy.einsum('...i, ij', amplitudes, reference_curves) + background
+        reference_coefficients, background_coefficients, residuals = CurveFittingAndAnalysis.mlls_fit(
+            data_values, x_values, reference_curves, polynomial_order = None, power_law_exponents = [3.0], chunk_size = 5)
+        self.assertEqual((4, 3, 2), reference_coefficients.shape)
+        self.assertEqual((4, 3, 1), background_coefficients.shape)
+        self.assertTrue(numpy.allclose(amplitudes, reference_coefficients))
+        # the background curve is normalized to the center of the x values.
+        self.assertTrue(numpy.allclose(background_amplitudes * numpy.power(599.5 / 600.0, -3.0), background_coefficients))
+        self.assertTrue(numpy.all(residuals < 1E-6))
+        # a linear background is fit exactly by a first order polynomial background.
+        data_values = numpy.einsum('...i, ij', amplitudes, reference_curves) + background_amplitudes * (2 - x_values / 600.0)
+        reference_coefficients, background_coefficients, residuals = CurveFittingAndAnalysis.mlls_fit(data_values, x_values, reference_curves, 1)
+        self.assertEqual((4, 3, 2), background_coefficients.shape)
+        self.assertTrue(numpy.allclose(amplitudes, reference_coefficients))
+        self.assertTrue(numpy.all(residuals < 1E-6))
+
+
+    def test_nonnegative_fit_satisfies_optimality_conditions(self):
+        x_values = numpy.linspace(0, 1, 80)
+        model_curves = numpy.stack([numpy.exp(-numpy.square((x_values - center) / 0.15)) for center in (0.2, 0.35, 0.5, 0.65, 0.8)])
+        random_state = numpy.random.RandomState(3)
+        amplitudes = random_state.uniform(0, 1, (10, 5, 5))
+        amplitudes[amplitudes < 0.4] = 0
+        data_values = numpy.einsum('...i, ij', amplitudes, model_curves) + random_state.normal(0, 0.3, (10, 5, 80))
+        multicurve_fit = CurveFittingAndAnalysis.MultipleCurveFit(model_curves)
+        multicurve_fit.compute_fit_for_data(data_values)
+        unconstrained_coefficients = multicurve_fit.get_fit_coefficients()
+        self.assertTrue(numpy.any(unconstrained_coefficients < 0))
+        multicurve_fit.compute_fit_for_data(data_values, nonnegative = True)
+        coefficients = multicurve_fit.get_fit_coefficients()
+        iteration_counts = multicurve_fit.get_fit_iteration_counts()
+        self.assertTrue(numpy.all(coefficients >= 0))
+        # only curves with negative unconstrained coefficients are refit, and those keep their unconstrained coefficients.
+        is_negative = numpy.any(unconstrained_coefficients < 0, -1)
+        self.assertTrue(numpy.array_equal(is_negative, iteration_counts > 0))
+        self.assertTrue(numpy.allclose(unconstrained_coefficients[~is_negative], coefficients[~is_negative]))
+        # gradients of the squared residual vanish for positive coefficients and are nonnegative for zero coefficients.
+        gradients = numpy.einsum('ij, ...j', model_curves, numpy.einsum('...i, ij', coefficients, model_curves) - data_values)
+        self.assertTrue(numpy.all(numpy.abs(gradients[coefficients > 0]) < 1E-8))
+        self.assertTrue(numpy.all(gradients[coefficients == 0] > -1E-8))
+        # chunked fits give the same coefficients and iteration counts.
+        iteration_counts_out = numpy.zeros((10, 5), dtype = int)
+        chunked_coefficients = multicurve_fit.compute_fit_for_data_in_chunks(
+            data_values, chunk_size = 15, nonnegative = True, iteration_counts_out = iteration_counts_out)[0]
+        self.assertTrue(numpy.allclose(coefficients, chunked_coefficients))
+        self.assertTrue(numpy.array_equal(iteration_counts, iteration_counts_out))
+
+
+    def test_fit_statistics_match_residuals_of_fit_curves(self):
+        x_values = numpy.linspace(400.0, 500.0, 100)
+        data_values = self.__power_law_spectra(4 * 3, x_values).reshape((4, 3, 100)) * numpy.random.RandomState(2).uniform(0.9, 1.1, (4, 3, 100))
+        valid_values = numpy.ones(data_values.shape, dtype = bool)
+        valid_values[1, 2, 10:20] = False
+        valid_values[2, 0, 1:] = False
+        model_curves = numpy.stack([numpy.ones_like(x_values), numpy.log(x_values)])
+        multicurve_fit = CurveFittingAndAnalysis.MultipleCurveFit(model_curves)
+        log_values = numpy.log(data_values)
+        multicurve_fit.compute_fit_for_data(log_values, valid_values, compute_statistics = True)
+        chi_squares, reduced_chi_squares, r_squares = multicurve_fit.get_fit_statistics()
+        residuals = numpy.where(valid_values, log_values - multicurve_fit.get_fit_curves(), 0)
+        sample_counts = numpy.count_nonzero(valid_values, -1)
+        mean_values = numpy.sum(numpy.where(valid_values, log_values, 0), -1, keepdims = True) / sample_counts[..., numpy.newaxis]
+        expected_chi_squares = numpy.sum(numpy.square(residuals), -1)
+        expected_r_squares = 1 - expected_chi_squares / numpy.sum(numpy.where(valid_values, numpy.square(log_values - mean_values), 0), -1)
+        self.assertTrue(numpy.allclose(expected_chi_squares, chi_squares, equal_nan = True))
+        self.assertTrue(numpy.allclose(expected_chi_squares / (sample_counts - 2), reduced_chi_squares, equal_nan = True))
+        self.assertTrue(numpy.allclose(expected_r_squares, r_squares, equal_nan = True))
+        # a curve with too few valid samples has no goodness of fit.
+        self.assertTrue(numpy.isnan(chi_squares[2, 0]))
+        statistics_out = numpy.zeros((3, 4, 3))
+        multicurve_fit.compute_fit_for_data_in_chunks(data_values, valid_values, chunk_size = 3, transform = numpy.log, chi_squares_out = statistics_out[0],
+                                                      reduced_chi_squares_out = statistics_out[1], r_squares_out = statistics_out[2])
+        self.assertTrue(numpy.allclose(numpy.stack([chi_squares, reduced_chi_squares, r_squares]), statistics_out, equal_nan = True))
+        # the goodness of fit of the log of exact power laws is perfect.
+        results = CurveFittingAndAnalysis.signal_from_polynomial_background(
+            self.__power_law_spectra(3, numpy.arange(400.0, 500.0, 1.0)), numpy.array([400.0, 500.0]), numpy.array([460.0, 480.0]),
+            numpy.array([[400.0, 420.0], [430.0, 440.0]]),
+            1, True, True, return_validity = True, return_statistics = True)
+        self.assertEqual(8, len(results))
+        self.assertTrue(numpy.all(results[5] < 1E-8))
+        self.assertTrue(numpy.allclose(1, results[7]))
+
+
+    def test_energy_offsets_extract_signal_of_drifting_curves_as_if_aligned(self):
+        x_values = numpy.arange(400.0, 500.0, 1.0)
+        energy_offsets = numpy.random.RandomState(2).uniform(-3, 3, (4, 3))
+        # each drifting curve is the aligned curve shifted by its offset.
+        aligned_values = self.__power_law_spectra(4 * 3, x_values).reshape((4, 3, 100))
+        data_values = self.__power_law_spectra(4 * 3, x_values - energy_offsets.reshape((-1, 1))).reshape((4, 3, 100))
+        ranges = numpy.array([400.0, 500.0]), numpy.array([460.0, 480.0]), numpy.array([[420.0, 440.0], [445.0, 455.0]])
+        expected_results = CurveFittingAndAnalysis.signal_from_polynomial_background(aligned_values, *ranges, 1, True, True)
+        results = CurveFittingAndAnalysis.signal_from_polynomial_background(data_values, *ranges, 1, True, True, return_validity = True,
+                                                                            energy_offsets = energy_offsets)
+        self.assertTrue(numpy.all(results[4]))
+        self.assertTrue(numpy.allclose(expected_results[2], results[2], rtol = 1E-4))
+        self.assertTrue(numpy.allclose(expected_results[1], results[1], rtol = 1E-4, atol = 1E-4 * numpy.amax(aligned_values[..., 20:80])))
+        # profile samples shifted beyond the data are NaN, and fit samples beyond the data are excluded from the fit.
+        results = CurveFittingAndAnalysis.signal_from_polynomial_background(data_values, numpy.array([400.0, 500.0]), numpy.array([480.0, 500.0]),
+                                                                            numpy.array([400.0, 420.0]), 1, True, True, return_validity = True,
+                                                                            energy_offsets = numpy.full((4, 3), -2.0))
+        self.assertTrue(numpy.all(results[4]))
+        self.assertTrue(numpy.all(numpy.isnan(results[1][..., :2])))
+        self.assertTrue(numpy.all(numpy.isfinite(results[1][..., 2:])))
+
+
+    def test_integer_and_half_precision_data_are_fit_as_float_data(self):
+        x_values = numpy.arange(400.0, 500.0, 1.0)
+        data_values = self.__power_law_spectra(4 * 3, x_values).reshape((4, 3, 100)) * numpy.random.RandomState(2).uniform(0.9, 1.1, (4, 3, 100))
+        ranges = numpy.array([400.0, 500.0]), numpy.array([460.0, 480.0]), numpy.array([[400.0, 420.0], [430.0, 440.0]])
+        model_curves = numpy.stack([numpy.ones_like(x_values), numpy.log(x_values)])
+        for dtype in (numpy.uint16, numpy.uint32, numpy.float16):
+            with self.subTest(dtype = dtype.__name__):
+                native_values = numpy.clip(data_values, 1, 60000).astype(dtype)
+                float_values = native_values.astype(numpy.float64)
+                expected_results = CurveFittingAndAnalysis.signal_from_polynomial_background(float_values, *ranges, 1, True, True)
+                results = CurveFittingAndAnalysis.signal_from_polynomial_background(native_values, *ranges, 1, True, True)
+                self.assertEqual(CurveFittingAndAnalysis.floating_point_type(dtype), results[2].dtype)
+                self.assertTrue(numpy.allclose(expected_results[2], results[2], rtol = 1E-5))
+                self.assertTrue(numpy.allclose(expected_results[0], results[0], atol = 1E-5 * numpy.amax(numpy.abs(expected_results[0]))))
+                # sums of squares of the goodness of fit do not overflow the integer type.
+                multicurve_fit = CurveFittingAndAnalysis.MultipleCurveFit(model_curves)
+                expected_coefficients = multicurve_fit.compute_fit_for_data_in_chunks(float_values, chunk_size = 3, transform = numpy.log)[0]
+                coefficients = multicurve_fit.compute_fit_for_data_in_chunks(native_values, chunk_size = 3, transform = numpy.log)[0]
+                self.assertTrue(numpy.allclose(expected_coefficients, coefficients))
+                multicurve_fit.compute_fit_for_data(float_values, compute_statistics = True)
+                expected_chi_squares = multicurve_fit.get_fit_statistics()[0]
+                multicurve_fit.compute_fit_for_data(native_values, compute_statistics = True)
+                self.assertTrue(numpy.allclose(expected_chi_squares, multicurve_fit.get_fit_statistics()[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -18,6 +18,12 @@ from nion.utils import Registry
 _ = gettext.gettext
 
 
+def get_data_version(data_item: Facade.DataItem):
+    # a token identifying the contents of the data item, which changes whenever its data changes; the background models key their
+    # cached results and cumulative sum tables on it instead of digesting the data on every execution.
+    return data_item.uuid, data_item.modified
+
+
 class EELSBackgroundSubtraction:
     label = _("EELS Background Subtraction")
     inputs = {
@@ -61,7 +67,8 @@ class EELSBackgroundSubtraction:
                 entity_id = background_model._data_structure.entity.entity_type.entity_id
                 for component in Registry.get_components_by_type("background-model"):
                     if entity_id == component.background_model_id:
-                        fit_result = component.fit_background(spectrum_xdata=spectrum_xdata, fit_intervals=fit_intervals, background_interval=signal_interval)
+                        fit_result = component.fit_background(spectrum_xdata=spectrum_xdata, fit_intervals=fit_intervals, background_interval=signal_interval,
+                                                              cache=True, cumulative_sums=True, data_version=get_data_version(eels_spectrum_data_item))
                         background_xdata = fit_result["background_model"]
                         # use 'or' to avoid doing subtraction if subtracted_spectrum already present
                         subtracted_xdata = fit_result.get("subtracted_spectrum", None) or Core.calibrated_subtract_spectrum(spectrum_xdata, background_xdata)
@@ -120,7 +127,9 @@ class EELSMapping:
                     if entity_id == component.background_model_id:
                         # import time
                         # t0 = time.perf_counter()
-                        integrate_result = component.integrate_signal(spectrum_xdata=spectrum_image_xdata, fit_intervals=fit_intervals, signal_interval=signal_interval)
+                        integrate_result = component.integrate_signal(spectrum_xdata=spectrum_image_xdata, fit_intervals=fit_intervals,
+                                                                      signal_interval=signal_interval, cache=True, cumulative_sums=True,
+                                                                      data_version=get_data_version(spectrum_image_data_item))
                         # t1 = time.perf_counter()
                         # print(f"{component.background_model_id} {((t1 - t0) * 1000)}ms")
                         mapped_xdata = integrate_result["integrated"]
@@ -137,6 +146,67 @@ class EELSMapping:
         self.computation.set_referenced_xdata("map", self.__mapped_xdata)
 
 
+class EELSMappingStack:
+    label = _("EELS Map Stack")
+    inputs = {
+        "spectrum_image_data_item": {"label": _("EELS Image")},
+        "background_model": {"label": _("Background Model"), "entity_id": "background_model"},
+        "fit_interval_graphics": {"label": _("Fit")},
+        "signal_interval_graphics": {"label": _("Signals")},
+        }
+    outputs = {
+        "map": {"label": _("EELS Map Stack")},
+    }
+
+    def __init__(self, computation, **kwargs):
+        self.computation = computation
+
+    def execute(self, spectrum_image_data_item: Facade.DataItem, background_model, fit_interval_graphics, signal_interval_graphics):
+        try:
+            assert spectrum_image_data_item.xdata.is_datum_1d
+            assert spectrum_image_data_item.xdata.is_navigable
+            assert spectrum_image_data_item.xdata.datum_dimensional_calibrations[0].units == "eV"
+            spectrum_image_xdata = spectrum_image_data_item.xdata
+            # fit_interval_graphics.interval returns normalized coordinates. create calibrated intervals.
+            fit_intervals = list()
+            for fit_interval_graphic in fit_interval_graphics:
+                fit_interval = Calibration.CalibratedInterval(
+                    Calibration.Coordinate(Calibration.CoordinateType.NORMALIZED, fit_interval_graphic.interval[0]),
+                    Calibration.Coordinate(Calibration.CoordinateType.NORMALIZED, fit_interval_graphic.interval[1]))
+                fit_intervals.append(fit_interval)
+            # the maps are ordered by the start of their signal interval.
+            signal_intervals = list()
+            for signal_interval_graphic in sorted(signal_interval_graphics, key=lambda graphic: graphic.interval[0]):
+                signal_interval = Calibration.CalibratedInterval(
+                    Calibration.Coordinate(Calibration.CoordinateType.NORMALIZED, signal_interval_graphic.interval[0]),
+                    Calibration.Coordinate(Calibration.CoordinateType.NORMALIZED, signal_interval_graphic.interval[1]))
+                signal_intervals.append(signal_interval)
+            mapped_xdata = None
+            if background_model._data_structure.entity:
+                entity_id = background_model._data_structure.entity.entity_type.entity_id
+                for component in Registry.get_components_by_type("background-model"):
+                    if entity_id == component.background_model_id:
+                        # one background fit per spectrum is integrated over all of the signal intervals.
+                        integrate_result = component.integrate_signal(spectrum_xdata=spectrum_image_xdata, fit_intervals=fit_intervals,
+                                                                      signal_intervals=signal_intervals, cache=True,
+                                                                      data_version=get_data_version(spectrum_image_data_item))
+                        mapped_xdata = integrate_result["integrated"]
+            if mapped_xdata is None:
+                data_descriptor = DataAndMetadata.DataDescriptor(True, 0, spectrum_image_xdata.navigation_dimension_count)
+                mapped_xdata = DataAndMetadata.new_data_and_metadata(numpy.zeros((len(signal_intervals),) + tuple(spectrum_image_xdata.navigation_dimension_shape)),
+                                                                     data_descriptor=data_descriptor,
+                                                                     dimensional_calibrations=[Calibration.Calibration()] + list(spectrum_image_xdata.navigation_dimensional_calibrations))
+            self.__mapped_xdata = mapped_xdata
+        except Exception as e:
+            import traceback
+            print(traceback.format_exc())
+            print(e)
+            raise
+
+    def commit(self):
+        self.computation.set_referenced_xdata("map", self.__mapped_xdata)
+
+
 async def use_interval_as_background(api: Facade.API_1, window: Facade.DocumentWindow) -> None:
     target_data_item = window.target_data_item
     target_display_item = window.target_display
@@ -174,9 +244,10 @@ async def use_interval_as_background(api: Facade.API_1, window: Facade.DocumentW
 
 def use_signal_for_map(api, window):
     target_display = window.target_display
-    target_graphic = target_display.selected_graphics[0] if target_display and len(target_display.selected_graphics) == 1 else None
-    target_interval = target_graphic if target_graphic and target_graphic.graphic_type == "interval-graphic" else None
-    if target_display and target_interval:
+    target_graphics = target_display.selected_graphics if target_display else list()
+    # several selected intervals are mapped together into a stack of maps.
+    target_intervals = [graphic for graphic in target_graphics if graphic.graphic_type == "interval-graphic"]
+    if target_display and target_intervals and len(target_intervals) == len(target_graphics):
         target_display_item_data_items = target_display._display_item.data_items
         for computation in api.library._document_model.computations:
             if computation.processing_id == "eels.background_subtraction3":
@@ -190,8 +261,25 @@ def use_signal_for_map(api, window):
                     source_data_items = api.library._document_model.get_source_data_items(eels_spectrum_data_item._data_item)
                     if len(source_data_items) == 1 and source_data_items[0].xdata.is_navigable and source_data_items[0].datum_dimension_count == 1:
                         spectrum_image = api._new_api_object(source_data_items[0])
+                        if len(target_intervals) > 1:
+                            map = api.library.create_data_item_from_data(numpy.zeros((len(target_intervals),) + tuple(spectrum_image._data_item.xdata.navigation_dimension_shape)),
+                                                                         title="{} Map Stack".format(spectrum_image.title))
+                            api.library.create_computation(
+                                "eels.mapping_stack",
+                                inputs={
+                                    "spectrum_image_data_item": spectrum_image,
+                                    "fit_interval_graphics": fit_interval_graphics,
+                                    "signal_interval_graphics": target_intervals,
+                                    "background_model": background_model,
+                                },
+                                outputs={
+                                    "map": map
+                                }
+                            )
+                            window.display_data_item(map)
+                            break
                         map = api.library.create_data_item_from_data(numpy.zeros(spectrum_image._data_item.xdata.navigation_dimension_shape), title="{} Map".format(spectrum_image.title))
-                        signal_interval_graphic = target_interval
+                        signal_interval_graphic = target_intervals[0]
                         api.library.create_computation(
                             "eels.mapping3",
                             inputs={
@@ -214,6 +302,7 @@ def subtract_background_from_signal(api, window):
 
 Symbolic.register_computation_type("eels.background_subtraction3", EELSBackgroundSubtraction)
 Symbolic.register_computation_type("eels.mapping3", EELSMapping)
+Symbolic.register_computation_type("eels.mapping_stack", EELSMappingStack)
 
 BackgroundModel = Schema.entity("background_model", None, None, {})
 
@@ -0,0 +1,134 @@
+# imports
+import gettext
+import numpy
+import typing
+
+# local libraries
+from nion.data import Calibration
+from nion.data import DataAndMetadata
+from nion.eels_analysis import CurveFittingAndAnalysis
+from nion.swift import Facade
+from nion.swift.model import Symbolic
+
+_ = gettext.gettext
+
+
+def get_reference_curves(reference_xdatas: typing.Sequence[DataAndMetadata.DataAndMetadata], energies: numpy.ndarray) -> numpy.ndarray:
+    # sample each reference spectrum at the energies of the spectrum image by linear interpolation; picks of the spectrum image
+    # share its energy axis and are used as they are.
+    reference_curves = list()
+    for reference_xdata in reference_xdatas:
+        calibration = reference_xdata.datum_dimensional_calibrations[0]
+        reference_energies = calibration.offset + calibration.scale * numpy.arange(reference_xdata.datum_dimension_shape[0])
+        reference_curves.append(numpy.interp(energies, reference_energies, reference_xdata.data, left=0, right=0))
+    return numpy.array(reference_curves)
+
+
+def get_background_options(background_type: str, background_order: int) -> typing.Tuple[typing.Optional[int], typing.Optional[typing.Sequence[float]]]:
+    # the polynomial order and power law exponents of the MLLS background (see CurveFittingAndAnalysis.mlls_background_curves).
+    # a "polynomial" background is a polynomial of background_order. a "power-law" background is a combination of
+    # background_order + 1 power laws with exponents spread evenly over 2 to 5, bracketing typical core loss backgrounds,
+    # or a single power law with exponent 3 for order 0.
+    if background_type == "polynomial":
+        return background_order, None
+    if background_type == "power-law":
+        return None, list(numpy.linspace(2.0, 5.0, background_order + 1)) if background_order > 0 else [3.0]
+    raise ValueError(f"Background type {background_type} is not supported. Allowed options are 'polynomial' and 'power-law'.")
+
+
+def map_mlls_xdata(spectrum_image_xdata: DataAndMetadata.DataAndMetadata, reference_xdatas: typing.Sequence[DataAndMetadata.DataAndMetadata],
+                   fit_interval: typing.Tuple[float, float], polynomial_order: typing.Optional[int] = 1,
+                   power_law_exponents: typing.Optional[typing.Sequence[float]] = None,
+                   chunk_size: typing.Optional[int] = None) -> typing.Tuple[DataAndMetadata.DataAndMetadata, DataAndMetadata.DataAndMetadata]:
+    """Fit the references plus a background to each spectrum of the spectrum image over fit_interval (normalized) by MLLS.
+
+    Returns a sequence of the coefficient maps of the references and the RMS residual map of the fits.
+    """
+    assert spectrum_image_xdata.is_datum_1d
+    assert spectrum_image_xdata.is_navigable
+    channel_count = spectrum_image_xdata.datum_dimension_shape[0]
+    fit_slice = slice(int(round(fit_interval[0] * channel_count)), int(round(fit_interval[1] * channel_count)))
+    calibration = spectrum_image_xdata.datum_dimensional_calibrations[0]
+    energies = calibration.offset + calibration.scale * numpy.arange(fit_slice.start, fit_slice.stop)
+    reference_curves = get_reference_curves(reference_xdatas, energies)
+    reference_coefficients, background_coefficients, residuals = CurveFittingAndAnalysis.mlls_fit(
+        spectrum_image_xdata.data[..., fit_slice], energies, reference_curves, polynomial_order, power_law_exponents, chunk_size)
+    navigation_calibrations = list(spectrum_image_xdata.navigation_dimensional_calibrations)
+    data_descriptor = DataAndMetadata.DataDescriptor(True, 0, spectrum_image_xdata.navigation_dimension_count)
+    coefficients_xdata = DataAndMetadata.new_data_and_metadata(numpy.moveaxis(reference_coefficients, -1, 0), data_descriptor=data_descriptor,
+                                                               dimensional_calibrations=[Calibration.Calibration()] + navigation_calibrations)
+    residuals_xdata = DataAndMetadata.new_data_and_metadata(residuals, dimensional_calibrations=navigation_calibrations,
+                                                            intensity_calibration=spectrum_image_xdata.intensity_calibration)
+    return coefficients_xdata, residuals_xdata
+
+
+class EELSMLLSMapping:
+    label = _("EELS MLLS Map")
+    inputs = {
+        "spectrum_image_data_item": {"label": _("EELS Image")},
+        "reference_data_items": {"label": _("References")},
+        "fit_interval_graphic": {"label": _("Fit")},
+        "background_type": {"label": _("Background Type (polynomial or power-law)")},
+        "background_order": {"label": _("Background Order")},
+        }
+    outputs = {
+        "map": {"label": _("MLLS Coefficient Maps")},
+        "residual": {"label": _("MLLS Residual Map")},
+    }
+
+    def __init__(self, computation, **kwargs):
+        self.computation = computation
+
+    def execute(self, spectrum_image_data_item: Facade.DataItem, reference_data_items, fit_interval_graphic, background_type, background_order):
+        try:
+            assert spectrum_image_data_item.xdata.datum_dimensional_calibrations[0].units == "eV"
+            # the fit interval is interpreted on the energy axis of the spectrum image, e.g. drawn on a pick of it.
+            reference_xdatas = [reference_data_item.xdata for reference_data_item in reference_data_items]
+            polynomial_order, power_law_exponents = get_background_options(background_type, background_order)
+            self.__coefficients_xdata, self.__residuals_xdata = map_mlls_xdata(spectrum_image_data_item.xdata, reference_xdatas,
+                                                                               fit_interval_graphic.interval, polynomial_order,
+                                                                               power_law_exponents)
+        except Exception as e:
+            import traceback
+            print(traceback.format_exc())
+            print(e)
+            raise
+
+    def commit(self):
+        self.computation.set_referenced_xdata("map", self.__coefficients_xdata)
+        self.computation.set_referenced_xdata("residual", self.__residuals_xdata)
+
+
+def map_references(api, window):
+    # fit the references selected in the data panel, together with a linear background, to the spectrum image selected with them.
+    # the fit interval is the interval graphic selected in the target display. the background type and order can be changed in
+    # the inspector of the computation.
+    target_display = window.target_display
+    target_graphics = target_display.selected_graphics if target_display else list()
+    fit_interval_graphic = target_graphics[0] if len(target_graphics) == 1 and target_graphics[0].graphic_type == "interval-graphic" else None
+    data_items = [api._new_api_object(data_item) for data_item in window._document_controller.selected_data_items]
+    spectrum_images = [data_item for data_item in data_items if data_item.xdata and data_item.xdata.is_navigable and data_item.xdata.is_datum_1d]
+    references = [data_item for data_item in data_items if data_item.xdata and not data_item.xdata.is_navigable and data_item.xdata.is_datum_1d]
+    if fit_interval_graphic and len(spectrum_images) == 1 and references:
+        spectrum_image = spectrum_images[0]
+        navigation_shape = tuple(spectrum_image.xdata.navigation_dimension_shape)
+        map = api.library.create_data_item_from_data(numpy.zeros((len(references),) + navigation_shape), title="{} MLLS Maps".format(spectrum_image.title))
+        residual = api.library.create_data_item_from_data(numpy.zeros(navigation_shape), title="{} MLLS Residual".format(spectrum_image.title))
+        api.library.create_computation(
+            "eels.mlls_mapping",
+            inputs={
+                "spectrum_image_data_item": spectrum_image,
+                "reference_data_items": references,
+                "fit_interval_graphic": fit_interval_graphic,
+                "background_type": "polynomial",
+                "background_order": 1,
+            },
+            outputs={
+                "map": map,
+                "residual": residual,
+            }
+        )
+        window.display_data_item(map)
+
+
+Symbolic.register_computation_type("eels.mlls_mapping", EELSMLLSMapping)
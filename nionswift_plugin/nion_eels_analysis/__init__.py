@@ -8,6 +8,7 @@ from . import BackgroundSubtraction
 from . import ElementalMappingPanel
 from . import AlignZLP
 from . import ThicknessMap
+from . import MLLSMapping
 from . import LiveThickness
 from . import LiveZLP
 
@@ -43,6 +44,7 @@ class MenuExtension:
         eels_menu.add_separator()
         eels_menu.add_menu_item(_("Map Signal"), functools.partial(BackgroundSubtraction.use_signal_for_map, api, window))
         eels_menu.add_menu_item(_("Map Thickness"), functools.partial(ThicknessMap.map_thickness, api, window))
+        eels_menu.add_menu_item(_("Map References (MLLS)"), functools.partial(MLLSMapping.map_references, api, window))
         eels_menu.add_separator()
         eels_menu.add_menu_item(_("Align ZLP (max method)"), functools.partial(AlignZLP.align_zlp, api, window))
         eels_menu.add_menu_item(_("Align ZLP (com method)"), functools.partial(AlignZLP.align_zlp_com, api, window))